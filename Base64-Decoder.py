@@ -1,25 +1,18 @@
-import base64
+import sys
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
-import tempfile
-import webbrowser
-import re
-import os
-import sys
-import imghdr
-import subprocess
 
-def is_base64(s):
-    try:
-        base64.b64decode(s)
-        return True
-    except Exception:
-        return False
+from rws_codecs import decode_blocks
+from rws_decode import Base64DecodeError, PayloadNotFoundError, format_file_summary, map_file, summarize_file
+from rws_detect import IMAGE_FORMATS, detect_file_format
+from rws_metrics import METRICS
+from rws_preview import PreviewPane, open_path
+from rws_worker import BackgroundJob
 
 def save_file(file_content, file_extension):
     file_path = filedialog.asksaveasfilename(defaultextension=file_extension, filetypes=[(f"{file_extension.upper()} Files", f"*{file_extension}")])
     if file_path:
-        with open(file_path, "wb") as file:
+        with METRICS.timer("stage_seconds", stage="save"), open(file_path, "wb") as file:
             file.write(file_content)
         messagebox.showinfo("Success", f"{file_extension.upper()} file saved.")
         return file_path
@@ -27,100 +20,135 @@ def save_file(file_content, file_extension):
 
 def open_file(file_path):
     if file_path:
-        if sys.platform == "win32":
-            os.startfile(file_path)
-        else:
-            opener = "open" if sys.platform == "darwin" else "xdg-open"
-            subprocess.call([opener, file_path])
+        with METRICS.timer("stage_seconds", stage="open"):
+            open_path(file_path)
 
-def detect_file_format(decoded_content):
-    # Check if the decoded content is an image
-    image_format = imghdr.what(None, decoded_content)
-    if image_format:
-        return image_format
+def start_job(work, on_done, determinate=True):
+    global current_job
+    
+    # Lock the buttons that start work and show progress while the worker runs
+    decode_button.config(state=tk.DISABLED)
+    encode_button.config(state=tk.DISABLED)
+    open_file_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
+    progress_bar.config(mode="determinate" if determinate else "indeterminate", value=0)
+    if not determinate:
+        progress_bar.start()
+    
+    def finish_job():
+        global current_job
+        current_job = None
+        progress_bar.stop()
+        progress_bar.config(mode="determinate", value=0)
+        decode_button.config(state=tk.NORMAL)
+        encode_button.config(state=tk.NORMAL)
+        open_file_button.config(state=tk.NORMAL)
+        cancel_button.config(state=tk.DISABLED)
+    
+    def job_done(result):
+        finish_job()
+        on_done(result)
+    
+    def job_failed(error):
+        finish_job()
+        handle_job_error(error)
+    
+    def update_progress(fraction):
+        progress_bar.config(value=fraction * 100)
+    
+    current_job = BackgroundJob(window, work, job_done, job_failed, on_progress=update_progress, on_cancel=finish_job).start()
 
-    # Check if the decoded content is HTML
-    try:
-        decoded_html = decoded_content.decode("utf-8")
-        if "<html" in decoded_html.lower() and "</html>" in decoded_html.lower():
-            return "html"
-    except:
-        pass
-
-    # Check for common file signatures or patterns
-    file_signatures = {
-        "pdf": b"%PDF-",
-        "zip": b"PK\x03\x04",
-        "rar": b"Rar!\x1a\x07",
-        "7z": b"7z\xBC\xAF\x27\x1C",
-        "tar": b"ustar\x00",
-        "gz": b"\x1F\x8B\x08",
-        "bz2": b"BZh",
-        "exe": b"MZ",
-        "doc": b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1",
-        "xls": b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1",
-        "ppt": b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1",
-        "docx": b"PK\x03\x04",
-        "xlsx": b"PK\x03\x04",
-        "pptx": b"PK\x03\x04",
-    }
-
-    for file_format, signature in file_signatures.items():
-        if decoded_content.startswith(signature):
-            return file_format
+def cancel_job():
+    if current_job:
+        current_job.cancel()
 
-    return None
+def handle_job_error(error):
+    if isinstance(error, Base64DecodeError):
+        messagebox.showwarning("Warning", f"Invalid base64 code: {error}.")
+    elif isinstance(error, PayloadNotFoundError):
+        messagebox.showwarning("Warning", f"{error}.")
+    else:
+        messagebox.showerror("Error", f"An error occurred: {str(error)}")
+
+def decode_and_detect(base64_code, job, unpack_archives=False):
+    # Runs on the worker thread, so no Tk calls in here; each block's encoding is detected
+    from rws_unpack import expand
+    
+    results = []
+    for block in decode_blocks(base64_code, progress=job.report):
+        job.check_cancelled()
+        if block.error is not None:
+            results.append((block, None, None))
+            continue
+        file_format = detect_file_format(block.content)
+        if not unpack_archives:
+            results.append((block, file_format, None))
+            continue
+        # gz/bz2/zip payloads are replaced by the files inside them
+        unpacked_files, unpack_error = expand(block.content, file_format, job.check_cancelled)
+        for unpacked in unpacked_files:
+            results.append((block._replace(content=unpacked.content), unpacked.format, unpack_error))
+    return results
+
+def decode_file_and_detect(file_path, job, unpack_archives=False):
+    # The file is mapped, not read, so even huge captures never sit in memory as a whole
+    with map_file(file_path) as data:
+        return decode_and_detect(data, job, unpack_archives)
 
 def compile_base64():
-    base64_code = code_entry.get("1.0", tk.END).strip()
+    # Tk variables are read here, the worker must not touch them
+    unpack_archives = unpack_var.get()
     
-    if not base64_code:
+    if input_file:
+        # Decode straight from disk, the text field only holds a preview
+        start_job(lambda job: decode_file_and_detect(input_file, job, unpack_archives), handle_decoded_blocks)
+        return
+    
+    base64_code = code_entry.get("1.0", tk.END)
+    
+    if base64_code.isspace() or not base64_code:
         messagebox.showwarning("Warning", "Please enter the base64 code.")
         return
     
-    try:
-        # Check if the specified format is present
-        if "-----" in base64_code:
-            # Extract base64 code between the dashes
-            base64_code = re.findall(r'-----(.*?)-----', base64_code, re.DOTALL)
-            if base64_code:
-                base64_code = base64_code[0].strip()
-            else:
-                messagebox.showwarning("Warning", "No valid base64 code found between the dashes.")
-                return
+    # Clean, validate, decode and detect every block on a worker so the window stays responsive
+    start_job(lambda job: decode_and_detect(base64_code, job, unpack_archives), handle_decoded_blocks)
+
+def handle_decoded_blocks(results):
+    for block, file_format, unpack_error in results:
+        if block.error is not None:
+            messagebox.showwarning("Warning", f"Invalid {block.codec} code: {block.error}.")
         else:
-            # Remove non-base64 content
-            base64_code = re.sub(r'[^a-zA-Z0-9+/=\s]', '', base64_code)
-            base64_code = ''.join(base64_code.split())
-        
-        if not is_base64(base64_code):
-            messagebox.showwarning("Warning", "Invalid base64 code.")
-            return
-        
-        decoded_content = base64.b64decode(base64_code)
-        
-        # Detect the file format
-        file_format = detect_file_format(decoded_content)
-        
+            if block.corrected:
+                messagebox.showinfo("Information", f"Error correction repaired {block.corrected} damaged bytes.")
+            if unpack_error is not None:
+                messagebox.showwarning("Warning", f"{unpack_error}. The compressed file is kept as it is.")
+            handle_decoded_content(block.content, file_format)
+
+def handle_decoded_content(decoded_content, file_format):
+    # Every decoded file is previewed in the window, opening it elsewhere is opt-in
+    preview_pane.show(decoded_content, file_format)
+    
+    try:
         if file_format:
-            if file_format in imghdr.tests:
+            if file_format in IMAGE_FORMATS:
                 # Save the decoded image if the option is enabled
                 if save_image_var.get():
-                    saved_file_path = save_file(decoded_content, f".{file_format}")
+                    save_file(decoded_content, f".{file_format}")
+                
+                # Open the decoded image in the default image viewer if the option is enabled
+                if open_image_var.get():
+                    preview_pane.open_externally()
             elif file_format == "html":
                 # Save the decoded HTML if the option is enabled
-                if save_html_var.get():
-                    saved_file_path = save_file(decoded_content, ".html")
-                    # Open the saved HTML in the default web browser if the option is enabled
-                    if open_html_var.get():
+                saved_file_path = save_file(decoded_content, ".html") if save_html_var.get() else None
+                
+                # Open the decoded HTML in the default web browser if the option is enabled
+                if open_html_var.get():
+                    if saved_file_path:
+                        import webbrowser
                         webbrowser.open(saved_file_path)
-                else:
-                    # Open the decoded HTML in the default web browser if the option is enabled
-                    if open_html_var.get():
-                        with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".html") as temp_file:
-                            temp_file.write(decoded_content.decode("utf-8"))
-                            temp_file_path = temp_file.name
-                        webbrowser.open(temp_file_path)
+                    else:
+                        preview_pane.open_externally()
             else:
                 # Save the decoded file with the detected extension
                 save_file(decoded_content, f".{file_format}")
@@ -180,17 +208,56 @@ def select_file_format(decoded_content):
     file_format_window.wait_window()
 
 def open_base64_file():
-    file_path = filedialog.askopenfilename(filetypes=[("Text Files", "*.txt")])
+    file_path = filedialog.askopenfilename(filetypes=[("All Files", "*.*"), ("Text Files", "*.txt")])
     if file_path:
-        with open(file_path, "r") as file:
-            base64_code = file.read().strip()
-            code_entry.delete("1.0", tk.END)
-            code_entry.insert(tk.END, base64_code)
+        # Only a preview goes into the text field, inserting megabytes into Tk takes seconds
+        start_job(lambda job: summarize_file(file_path), show_file_preview, determinate=False)
+
+def show_file_preview(summary):
+    global input_file
+    input_file = summary.path
+    code_entry.config(state=tk.NORMAL)
+    code_entry.delete("1.0", tk.END)
+    code_entry.insert(tk.END, format_file_summary(summary))
+    code_entry.config(state=tk.DISABLED)
+    open_file_button.config(text="Close File", command=close_input_file)
+
+def close_input_file():
+    # Back to decoding whatever is typed or pasted into the text field
+    global input_file
+    input_file = None
+    code_entry.config(state=tk.NORMAL)
+    code_entry.delete("1.0", tk.END)
+    open_file_button.config(text="Open Base64 File", command=open_base64_file)
+
+def encode_file():
+    file_path = filedialog.askopenfilename(filetypes=[("All Files", "*.*")])
+    if file_path:
+        # Trying every compressor takes a while on big files, so it runs on a worker too
+        # Tk variables are read here, the worker must not touch them
+        fec = fec_var.get()
+        start_job(lambda job: package_file(file_path, fec), handle_package, determinate=False)
+
+def package_file(file_path, fec=False):
+    # The encode side is only needed when sending, so it stays out of startup
+    from rws_encode import package
+    
+    with open(file_path, "rb") as file:
+        return package(file.read(), fec=fec)
+
+def handle_package(result):
+    from rws_encode import format_package_summary
+    
+    # Ready to paste into VarAC straight away
+    window.clipboard_clear()
+    window.clipboard_append(result.text.decode("ascii"))
+    if messagebox.askyesno("Package Ready", f"{format_package_summary(result)}.\n\nThe package is on the clipboard. Save it to a file as well?"):
+        save_file(result.text, ".txt")
 
 def open_settings():
     settings_window = tk.Toplevel(window)
     settings_window.title("Settings")
-    settings_window.geometry("400x400")
+    settings_window.geometry("400x550")
     settings_window.configure(bg="#FFFFFF")
     
     settings_frame = ttk.Frame(settings_window, padding=20)
@@ -200,64 +267,110 @@ def open_settings():
     settings_label.pack(anchor=tk.W, pady=(0, 20))
     
     # Open HTML option
-    open_html_checkbox = ttk.Checkbutton(settings_frame, text="Open HTML file after decoding", variable=open_html_var)
+    open_html_checkbox = ttk.Checkbutton(settings_frame, text="Open HTML file in the browser after decoding", variable=open_html_var)
     open_html_checkbox.pack(anchor=tk.W, pady=(0, 10))
     
     # Save HTML option
     save_html_checkbox = ttk.Checkbutton(settings_frame, text="Prompt to save HTML file after decoding", variable=save_html_var)
     save_html_checkbox.pack(anchor=tk.W, pady=(0, 10))
     
+    # Open Image option
+    open_image_checkbox = ttk.Checkbutton(settings_frame, text="Open image file in the image viewer after decoding", variable=open_image_var)
+    open_image_checkbox.pack(anchor=tk.W, pady=(0, 10))
+    
+    # Save Image option
+    save_image_checkbox = ttk.Checkbutton(settings_frame, text="Prompt to save image file after decoding", variable=save_image_var)
+    save_image_checkbox.pack(anchor=tk.W, pady=(0, 10))
+    
+    # Unpack archives option
+    unpack_checkbox = ttk.Checkbutton(settings_frame, text="Unpack gzip, bz2, xz and zip payloads", variable=unpack_var)
+    unpack_checkbox.pack(anchor=tk.W, pady=(0, 10))
+    
+    # Error correction option
+    fec_checkbox = ttk.Checkbutton(settings_frame, text="Add error correction to encoded files", variable=fec_var)
+    fec_checkbox.pack(anchor=tk.W, pady=(0, 10))
+    
     close_button = ttk.Button(settings_frame, text="Close", command=settings_window.destroy, style="Accent.TButton")
     close_button.pack(pady=(0, 10))
 
-# Create the main window
-window = tk.Tk()
-window.title("Base64 Decoder")
-window.geometry("800x600")
-window.configure(bg="#FFFFFF")
-
-# Create a style for the main window
-style = ttk.Style(window)
-style.theme_use("clam")
-style.configure(".", background="#FFFFFF", foreground="#333333", font=("Segoe UI", 12))
-style.configure("TFrame", background="#FFFFFF")
-style.configure("TLabel", background="#FFFFFF", foreground="#333333", font=("Segoe UI", 14))
-style.configure("TButton", font=("Segoe UI", 12), padding=10)
-style.configure("Accent.TButton", background="#007BFF", foreground="#FFFFFF", font=("Segoe UI", 12, "bold"), padding=10)
-
-# Create a frame for the main content
-main_frame = ttk.Frame(window, padding=20)
-main_frame.pack(fill=tk.BOTH, expand=True)
-
-# Create and pack the label
-label = ttk.Label(main_frame, text="Enter base64 code:")
-label.pack(anchor=tk.W, pady=(0, 10))
-
-# Create and pack the text entry field
-code_entry = tk.Text(main_frame, height=15, width=80, font=("Consolas", 12), bg="#F5F5F5", fg="#333333", padx=10, pady=10, wrap=tk.WORD, bd=0, highlightthickness=1, highlightcolor="#CCCCCC", highlightbackground="#CCCCCC")
-code_entry.pack(fill=tk.BOTH, expand=True, pady=(0, 20))
-
-# Create a frame for the buttons
-button_frame = ttk.Frame(main_frame)
-button_frame.pack(anchor=tk.W)
-
-# Create and pack the decode button
-decode_button = ttk.Button(button_frame, text="Decode", command=compile_base64, style="Accent.TButton")
-decode_button.pack(side=tk.LEFT, padx=(0, 10))
-
-# Create and pack the open file button
-open_file_button = ttk.Button(button_frame, text="Open Base64 File", command=open_base64_file)
-open_file_button.pack(side=tk.LEFT, padx=(0, 10))
-
-# Create and pack the settings button
-settings_button = ttk.Button(button_frame, text="Settings", command=open_settings)
-settings_button.pack(side=tk.LEFT)
-
-# Create variables for settings options
-open_html_var = tk.BooleanVar(value=True)
-save_html_var = tk.BooleanVar(value=False)
-open_image_var = tk.BooleanVar(value=True)
-save_image_var = tk.BooleanVar(value=False)
-
-# Start the main event loop
-window.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    # Worker processes (see rws_parallel) import this script again, only the real run builds the window
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+        multiprocessing.freeze_support()
+
+    # Create the main window
+    window = tk.Tk()
+    window.title("Base64 Decoder")
+    window.geometry("800x800")
+    window.configure(bg="#FFFFFF")
+
+    # Create a style for the main window
+    style = ttk.Style(window)
+    style.theme_use("clam")
+    style.configure(".", background="#FFFFFF", foreground="#333333", font=("Segoe UI", 12))
+    style.configure("TFrame", background="#FFFFFF")
+    style.configure("TLabel", background="#FFFFFF", foreground="#333333", font=("Segoe UI", 14))
+    style.configure("TButton", font=("Segoe UI", 12), padding=10)
+    style.configure("Accent.TButton", background="#007BFF", foreground="#FFFFFF", font=("Segoe UI", 12, "bold"), padding=10)
+
+    # Create a frame for the main content
+    main_frame = ttk.Frame(window, padding=20)
+    main_frame.pack(fill=tk.BOTH, expand=True)
+
+    # Create and pack the label
+    label = ttk.Label(main_frame, text="Enter base64 code:")
+    label.pack(anchor=tk.W, pady=(0, 10))
+
+    # Create and pack the text entry field
+    code_entry = tk.Text(main_frame, height=8, width=80, font=("Consolas", 12), bg="#F5F5F5", fg="#333333", padx=10, pady=10, wrap=tk.WORD, bd=0, highlightthickness=1, highlightcolor="#CCCCCC", highlightbackground="#CCCCCC")
+    code_entry.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
+
+    # Create and pack the progress bar for background decoding
+    progress_bar = ttk.Progressbar(main_frame, mode="determinate", maximum=100)
+    progress_bar.pack(fill=tk.X, pady=(0, 20))
+
+    # Create a frame for the buttons
+    button_frame = ttk.Frame(main_frame)
+    button_frame.pack(anchor=tk.W)
+
+    # Create and pack the decode button
+    decode_button = ttk.Button(button_frame, text="Decode", command=compile_base64, style="Accent.TButton")
+    decode_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    # Create and pack the cancel button, only enabled while decoding
+    cancel_button = ttk.Button(button_frame, text="Cancel", command=cancel_job, state=tk.DISABLED)
+    cancel_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    # Create and pack the open file button
+    open_file_button = ttk.Button(button_frame, text="Open Base64 File", command=open_base64_file)
+    open_file_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    # Create and pack the encode button
+    encode_button = ttk.Button(button_frame, text="Encode File", command=encode_file)
+    encode_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    # Create and pack the settings button
+    settings_button = ttk.Button(button_frame, text="Settings", command=open_settings)
+    settings_button.pack(side=tk.LEFT)
+
+    # Create and pack the preview pane, decoded files are shown here instead of in outside viewers
+    preview_pane = PreviewPane(main_frame, opener=open_file)
+    preview_pane.pack(fill=tk.BOTH, expand=True, pady=(20, 0))
+
+    # The background job currently running, if any
+    current_job = None
+
+    # The file being decoded from disk, None while decoding the text field
+    input_file = None
+
+    # Create variables for settings options
+    open_html_var = tk.BooleanVar(value=False)
+    save_html_var = tk.BooleanVar(value=False)
+    open_image_var = tk.BooleanVar(value=False)
+    save_image_var = tk.BooleanVar(value=False)
+    unpack_var = tk.BooleanVar(value=True)
+    fec_var = tk.BooleanVar(value=False)
+
+    # Start the main event loop
+    window.mainloop()
\ No newline at end of file
@@ -0,0 +1,226 @@
+"""Load test for the Gopher server.
+
+Usage:
+    python gopher_loadtest.py [--engine asyncio|threads] [-c CLIENTS] [--duration SECONDS]
+                              [--files 1000] [--small-size 4K] [--large-files 10] [--large-size 4M]
+                              [--mix menu=20,small=70,large=10] [--max-connections 64]
+
+A gopher folder of generated files is written to a temp directory and served
+by a GopherServer on an ephemeral localhost port. CLIENTS concurrent clients
+then request a weighted mix of menu pages, small files and large files for
+the given duration, each on its own connection as Gopher clients do. The
+clients run in separate processes (threads within each one), so they do not
+compete with the server for its interpreter lock.
+
+The report has requests per second, p50/p99/p999 latency (connect to the
+last byte), bytes per second and the error counts by kind, overall and for
+each kind of selector.
+"""
+
+import argparse
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# The shared helpers live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gopher_server import BUSY_RESPONSE, MAX_CONNECTIONS, MENU_PAGE_SIZE, GopherServer
+from rws_bench import parse_size, percentile
+
+# Share of requests going to each kind of selector
+DEFAULT_MIX = {"menu": 20, "small": 70, "large": 10}
+
+# Seconds a client waits on a stalled connection before counting a timeout
+CLIENT_TIMEOUT = 30.0
+
+NOT_FOUND_RESPONSE = b"Error: File not found."
+
+
+def make_folder(folder, files=1000, small_size=4 * 1024, large_files=10, large_size=4 * 1024 * 1024, seed=1234):
+    # Returns {kind: [(selector, expected size or None)]}; menus have no fixed size
+    rng = random.Random(seed)
+    targets = {"menu": [("", None), ("/", None)], "small": [], "large": []}
+    pages = -(-(files + large_files) // MENU_PAGE_SIZE)
+    targets["menu"] += [(f"/page/{page}", None) for page in range(2, pages + 1)]
+
+    line = bytes(rng.choice(b"abcdefghijklmnopqrstuvwxyz ") for _ in range(79)) + b"\n"
+    for index in range(files):
+        name = f"small-{index:06d}.txt"
+        with open(os.path.join(folder, name), "wb") as file:
+            file.write((line * (small_size // len(line) + 1))[:small_size])
+        targets["small"].append((f"/{name}", small_size))
+    for index in range(large_files):
+        name = f"large-{index:03d}.bin"
+        with open(os.path.join(folder, name), "wb") as file:
+            file.write(rng.randbytes(large_size))
+        targets["large"].append((f"/{name}", large_size))
+    return targets
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in DEFAULT_MIX or not weight.isdigit():
+            raise ValueError(f"Bad --mix entry {item!r}, expected e.g. menu=20,small=70,large=10")
+        mix[kind] = int(weight)
+    return mix
+
+
+def fetch(host, port, selector, timeout=CLIENT_TIMEOUT):
+    # One Gopher request on its own connection; returns (response bytes received, first bytes)
+    with socket.create_connection((host, port), timeout) as sock:
+        sock.sendall(selector.encode("utf-8") + b"\r\n")
+        received = 0
+        head = b""
+        while True:
+            chunk = sock.recv(256 * 1024)
+            if not chunk:
+                return received, head
+            if len(head) < 64:
+                head += chunk[:64 - len(head)]
+            received += len(chunk)
+
+
+def classify(head, received, expected):
+    # None for a good response, otherwise the kind of error
+    if head.startswith(BUSY_RESPONSE[:12]):
+        return "busy"
+    if head.startswith(NOT_FOUND_RESPONSE):
+        return "not_found"
+    if expected is not None and received != expected:
+        return "short"
+    if received == 0:
+        return "empty"
+    return None
+
+
+def _client_process(task):
+    # Runs in a worker process: threads clients for duration seconds, returns the raw samples
+    host, port, targets, mix, threads, duration, seed = task
+    kinds = [kind for kind in mix if mix[kind] and targets[kind]]
+    weights = [mix[kind] for kind in kinds]
+    samples = {kind: [] for kind in kinds}
+    received = Counter()
+    errors = Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            selector, expected = rng.choice(targets[kind])
+            started = time.perf_counter()
+            try:
+                size, head = fetch(host, port, selector)
+                error = classify(head, size, expected)
+            except socket.timeout:
+                size, error = 0, "timeout"
+            except ConnectionRefusedError:
+                size, error = 0, "refused"
+            except OSError:
+                size, error = 0, "reset"
+            elapsed = time.perf_counter() - started
+            with lock:
+                if error is None:
+                    samples[kind].append(elapsed)
+                    received[kind] += size
+                else:
+                    errors[(kind, error)] += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return samples, received, errors, time.perf_counter() - started
+
+
+def run_load(host, port, targets, mix=DEFAULT_MIX, clients=64, duration=10.0, processes=None, seed=1):
+    # Returns (samples by kind, bytes by kind, Counter of (kind, error), seconds)
+    processes = max(1, min(clients, processes or os.cpu_count() or 1))
+    shares = [clients // processes + (index < clients % processes) for index in range(processes)]
+    samples = {}
+    received = Counter()
+    errors = Counter()
+    elapsed = 0.0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        tasks = [(host, port, targets, mix, share, duration, seed + index) for index, share in enumerate(shares)]
+        for part_samples, part_received, part_errors, part_elapsed in executor.map(_client_process, tasks):
+            for kind, values in part_samples.items():
+                samples.setdefault(kind, []).extend(values)
+            received.update(part_received)
+            errors.update(part_errors)
+            elapsed = max(elapsed, part_elapsed)
+    return samples, received, errors, elapsed
+
+
+def format_report(samples, received, errors, elapsed):
+    lines = [f"{'selector':<10} {'requests':>10} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9} {'MB/s':>9} {'errors':>7}"]
+    everything = [value for values in samples.values() for value in values]
+    rows = [(kind, samples[kind], received[kind]) for kind in sorted(samples)]
+    rows.append(("all", everything, sum(received.values())))
+    for kind, values, size in rows:
+        failed = sum(count for (error_kind, _), count in errors.items() if kind in ("all", error_kind))
+        if values:
+            latency = [f"{percentile(values, fraction) * 1000:>9.2f}" for fraction in (0.50, 0.99, 0.999)]
+        else:
+            latency = [f"{'n/a':>9}"] * 3
+        lines.append(
+            f"{kind:<10} {len(values):>10,} {len(values) / elapsed:>10,.1f} {' '.join(latency)} "
+            f"{size / elapsed / 1024 ** 2:>9.2f} {failed:>7,}"
+        )
+    if errors:
+        by_error = Counter()
+        for (_, error), count in errors.items():
+            by_error[error] += count
+        lines.append("errors: " + ", ".join(f"{error} {count:,}" for error, count in by_error.most_common()))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the Gopher server on a generated folder.")
+    parser.add_argument("--engine", choices=["asyncio", "threads"], default="asyncio", help="server engine (default: asyncio)")
+    parser.add_argument("-c", "--clients", type=int, default=64, help="concurrent clients (default: 64)")
+    parser.add_argument("-p", "--processes", type=int, default=None, help="client processes (default: CPU count)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load (default: 10)")
+    parser.add_argument("--files", type=int, default=1000, help="small files in the folder (default: 1000)")
+    parser.add_argument("--small-size", default="4K", help="size of each small file (default: 4K)")
+    parser.add_argument("--large-files", type=int, default=10, help="large files in the folder (default: 10)")
+    parser.add_argument("--large-size", default="4M", help="size of each large file (default: 4M)")
+    parser.add_argument("--mix", default=",".join(f"{kind}={weight}" for kind, weight in DEFAULT_MIX.items()),
+                        help="request weights per selector kind (default: menu=20,small=70,large=10)")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help=f"server connection limit (default: {MAX_CONNECTIONS})")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+        small_size = parse_size(args.small_size)
+        large_size = parse_size(args.large_size)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    with tempfile.TemporaryDirectory(prefix="gopher-load-") as folder:
+        print(f"Writing {args.files:,} x {args.small_size} and {args.large_files:,} x {args.large_size} files...", file=sys.stderr)
+        targets = make_folder(folder, args.files, small_size, args.large_files, large_size)
+        server = GopherServer(folder, "127.0.0.1", 0, engine=args.engine, max_connections=args.max_connections)
+        with server:
+            host, port = server.server_address
+            print(f"{args.engine} server on {host}:{port}, {args.clients} clients for {args.duration:g} s", file=sys.stderr)
+            results = run_load(host, port, targets, mix, args.clients, args.duration, args.processes)
+    print(format_report(*results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
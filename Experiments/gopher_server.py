@@ -0,0 +1,529 @@
+"""Concurrent Gopher server for the decoded files in the gopher folder.
+
+Two engines serve the same selectors:
+
+* "asyncio" (default): one event loop on a background thread, every client
+  is a coroutine.
+* "threads": a socketserver TCPServer that hands each connection to a
+  bounded thread pool.
+
+Either way the server runs off the Tk thread and is started and stopped
+explicitly with start()/stop(). Files are streamed with sendfile, so the
+memory used per connection stays flat however large the file is.
+
+While rws_metrics is enabled every request is counted and timed, and the
+collected metrics are served as text at the /metrics selector.
+
+Given a search function (ContentStore.search from gopher_store), the main
+menu also offers a type 7 search item at /search. The client sends its
+words after a tab, and the server answers with a menu of matching files.
+"""
+
+import asyncio
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from stat import S_ISREG
+
+from rws_metrics import METRICS
+
+# Directory menus are split into pages of this many items
+MENU_PAGE_SIZE = 500
+
+# Files up to this size are kept in memory once requested, within the total budget
+HOT_FILE_MAX_SIZE = 64 * 1024
+HOT_CACHE_BUDGET = 16 * 1024 * 1024
+
+# Directory mtimes this close to now may not reflect a change made in the same tick
+RACY_MTIME_WINDOW = 2.0
+
+# Connection limits: longest request line, seconds to wait for it, seconds a
+# send may stall, slowest acceptable transfer rate, and clients served at once
+MAX_REQUEST_LENGTH = 1024
+READ_TIMEOUT = 10.0
+WRITE_TIMEOUT = 30.0
+MIN_SEND_RATE = 4 * 1024
+MAX_CONNECTIONS = 64
+
+# Connections the kernel queues before accept(); at least max_connections, so a burst of
+# clients gets accepted (or told the server is busy) instead of stalling on SYN retries
+LISTEN_BACKLOG = 128
+
+BUSY_RESPONSE = b"3Server busy, try again later.\tfake\t(NULL)\t0\r\n"
+BAD_REQUEST_RESPONSE = b"3Bad request.\tfake\t(NULL)\t0\r\n"
+SERVER_ERROR_RESPONSE = b"3Server error.\tfake\t(NULL)\t0\r\n"
+NOT_FOUND_RESPONSE = b"Error: File not found."
+
+# Selector that serves the Prometheus-style metrics dump while metrics are enabled
+METRICS_SELECTOR = "/metrics"
+
+# Type 7 search selector, and the most files one search lists
+SEARCH_SELECTOR = "/search"
+SEARCH_RESULTS = 100
+
+
+class RequestTooLong(Exception):
+    pass
+
+
+def read_request(sock, limit=MAX_REQUEST_LENGTH):
+    # Read until CRLF (or the client closes its side); selectors may arrive split over segments
+    data = bytearray()
+    while b"\n" not in data:
+        chunk = sock.recv(limit + 1 - len(data))
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > limit and b"\n" not in data:
+            raise RequestTooLong()
+    return bytes(data.split(b"\n", 1)[0])
+
+
+def parse_selector(request):
+    # Returns (selector, search words); the selector is everything up to the first tab,
+    # URL-encoded, and a type 7 search sends its words after that tab
+    request = request.strip().decode("utf-8")
+    selector, _, words = request.partition("\t")
+    return urllib.parse.unquote(selector), words.split("\t")[0]
+
+
+def record_request(engine, outcome, sent, started):
+    # outcome is "ok", "bad_request", "error" or "busy"; sent is the bytes written
+    if not METRICS.enabled:
+        return
+    METRICS.count("gopher_requests_total", engine=engine, outcome=outcome)
+    METRICS.count("gopher_bytes_sent_total", sent, engine=engine)
+    METRICS.observe("gopher_request_seconds", time.perf_counter() - started, engine=engine)
+
+
+class GopherSite:
+    """Resolve selectors against the gopher folder, with cached menus and hot files.
+
+    The encoded directory menu is rebuilt only when the folder's mtime moves,
+    and small files are kept in an LRU cache that is checked against each
+    file's mtime and size on every hit. Safe to share between threads.
+
+    search(words, limit) returns [(StoredFile, snippet)] for the /search
+    selector; without it there is no search.
+    """
+
+    def __init__(self, folder, host="localhost", port=70, page_size=MENU_PAGE_SIZE, search=None):
+        self.folder = folder
+        self.host = host
+        self.port = port
+        self.page_size = page_size
+        self.search = search
+        self._root = os.path.realpath(folder)
+        self._lock = threading.Lock()
+        self._listing = None
+        self._listing_key = None
+        self._pages = {}
+        self._hot_files = OrderedDict()
+        self._hot_bytes = 0
+
+    def resolve(self, selector, words=""):
+        # Returns ("data", bytes) for menus, errors and cached files or ("file", path)
+        if selector == "" or selector == ".":
+            return "data", self._welcome_menu()
+        if selector == SEARCH_SELECTOR and self.search is not None:
+            return "data", self.search_menu(words)
+        if selector == "/":
+            return "data", self.directory_menu(1)
+        if selector == METRICS_SELECTOR and METRICS.enabled:
+            return "data", METRICS.render_prometheus().encode("utf-8")
+        if selector.startswith("/page/"):
+            try:
+                return "data", self.directory_menu(int(selector[len("/page/"):]))
+            except ValueError:
+                pass
+
+        # Serve the requested file, never anything outside the gopher folder
+        file_path = os.path.realpath(os.path.join(self.folder, selector.lstrip("/")))
+        if os.path.commonpath([self._root, file_path]) != self._root:
+            return "data", NOT_FOUND_RESPONSE
+        # Hidden paths, like the store's index and temp files in .store, are never served
+        if any(part.startswith(".") for part in os.path.relpath(file_path, self._root).split(os.sep)):
+            return "data", NOT_FOUND_RESPONSE
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return "data", NOT_FOUND_RESPONSE
+        if not S_ISREG(stat.st_mode):
+            return "data", NOT_FOUND_RESPONSE
+        if stat.st_size <= HOT_FILE_MAX_SIZE:
+            content = self._hot_file(file_path, stat)
+            if content is not None:
+                return "data", content
+        return "file", file_path
+
+    def _welcome_menu(self):
+        # Serve the Gopher menu
+        menu = "iWelcome to Our Gopher Server\r\n"  # Informational header
+        menu += "1Main Directory\t/\t{}\t{}\r\n".format(self.host, self.port)
+        if self.search is not None:
+            menu += "7Search Decoded Text\t{}\t{}\t{}\r\n".format(SEARCH_SELECTOR, self.host, self.port)
+        if METRICS.enabled:
+            menu += "0Server Metrics\t{}\t{}\t{}\r\n".format(METRICS_SELECTOR, self.host, self.port)
+        return menu.encode("utf-8")
+
+    def directory_menu(self, page):
+        with self._lock:
+            error = self._refresh_listing()
+            if error is None and page in self._pages:
+                return self._pages[page]
+
+            # Serve the main directory listing
+            lines = [
+                "iContents of Main Directory\tfake\t(NULL)\t0\r\n",  # Prettified header
+                "i--------------------------------\tfake\t(NULL)\t0\r\n",  # Decorative separator
+            ]
+            pages = 0
+            if error is not None:
+                lines.append("3Error: {}\tfake\t(NULL)\t0\r\n".format(error))
+            else:
+                pages = max(1, -(-len(self._listing) // self.page_size))
+                start = (page - 1) * self.page_size
+                for item in self._listing[start:start + self.page_size] if page >= 1 else []:
+                    lines.append("0{}\t/{}\t{}\t{}\r\n".format(item, item, self.host, self.port))
+                if pages > 1:
+                    lines.append("iPage {} of {}\tfake\t(NULL)\t0\r\n".format(page, pages))
+                    if page > 1:
+                        lines.append("1Previous Page\t/page/{}\t{}\t{}\r\n".format(min(page - 1, pages), self.host, self.port))
+                    if page < pages:
+                        lines.append("1Next Page\t/page/{}\t{}\t{}\r\n".format(max(page + 1, 2), self.host, self.port))
+            lines.append("1Return to Main Menu\t.\t{}\t{}\r\n".format(self.host, self.port))  # Link to go back to the main menu
+            menu = "".join(lines).encode("utf-8")
+            if 1 <= page <= pages:
+                self._pages[page] = menu
+            return menu
+
+    def search_menu(self, words):
+        # Matching files best first, each followed by the words around the match
+        words = " ".join(words.split())
+        lines = []
+        if not words:
+            lines.append("3Enter the words to search for.\tfake\t(NULL)\t0\r\n")
+        else:
+            results = self.search(words, SEARCH_RESULTS)
+            lines.append("iSearch results for {}\tfake\t(NULL)\t0\r\n".format(words))
+            lines.append("i--------------------------------\tfake\t(NULL)\t0\r\n")
+            if not results:
+                lines.append("iNo matching files.\tfake\t(NULL)\t0\r\n")
+            for record, snippet in results:
+                lines.append("0{}\t/{}\t{}\t{}\r\n".format(record.file_name, record.file_name, self.host, self.port))
+                if snippet:
+                    lines.append("i  {}\tfake\t(NULL)\t0\r\n".format(snippet))
+        lines.append("1Return to Main Menu\t.\t{}\t{}\r\n".format(self.host, self.port))
+        return "".join(lines).encode("utf-8")
+
+    def _refresh_listing(self):
+        # Rebuild the sorted file list only when the folder changed; returns an error string on failure
+        try:
+            mtime_ns = os.stat(self.folder).st_mtime_ns
+            racy = time.time() - mtime_ns / 1e9 < RACY_MTIME_WINDOW
+            if self._listing is not None and mtime_ns == self._listing_key and not racy:
+                return None
+            with os.scandir(self.folder) as entries:
+                self._listing = sorted(entry.name for entry in entries if entry.is_file() and not entry.name.startswith("."))
+        except OSError as e:
+            self._listing = None
+            self._listing_key = None
+            self._pages.clear()
+            return str(e)
+        self._listing_key = mtime_ns
+        self._pages.clear()
+        return None
+
+    def _hot_file(self, file_path, stat):
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._hot_files.get(file_path)
+            if cached is not None and cached[0] == key:
+                self._hot_files.move_to_end(file_path)
+                return cached[1]
+        try:
+            with open(file_path, "rb") as file:
+                content = file.read(HOT_FILE_MAX_SIZE + 1)
+        except OSError:
+            return None
+        if len(content) != stat.st_size:
+            # Changed while we were reading it, just stream it this time
+            return None
+        with self._lock:
+            previous = self._hot_files.pop(file_path, None)
+            if previous is not None:
+                self._hot_bytes -= len(previous[1])
+            self._hot_files[file_path] = (key, content)
+            self._hot_bytes += len(content)
+            # Evict the least recently served files once over budget
+            while self._hot_bytes > HOT_CACHE_BUDGET:
+                _, (_, evicted) = self._hot_files.popitem(last=False)
+                self._hot_bytes -= len(evicted)
+        return content
+
+
+class GopherRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        started = time.perf_counter()
+        outcome, sent = self.serve()
+        record_request("threads", outcome, sent, started)
+
+    def serve(self):
+        # Returns (outcome, bytes sent) for the metrics
+        server = self.server
+        try:
+            self.request.settimeout(server.read_timeout)
+            selector, words = parse_selector(read_request(self.request, server.max_request_length))
+        except (RequestTooLong, UnicodeDecodeError):
+            self.request.settimeout(server.write_timeout)
+            self.request.sendall(BAD_REQUEST_RESPONSE)
+            return "bad_request", len(BAD_REQUEST_RESPONSE)
+        except OSError:
+            # Timed out or the client went away before sending a selector
+            return "error", 0
+
+        # From here on the timeout applies to each send, so a stalled client is dropped
+        self.request.settimeout(server.write_timeout)
+        try:
+            kind, value = server.gopher_site.resolve(selector, words)
+        except Exception:
+            # A failing lookup (a search on a damaged index, say) still gets the client an answer
+            server.handle_error(self.request, self.client_address)
+            kind, value = "error", SERVER_ERROR_RESPONSE
+        try:
+            if kind != "file":
+                self.request.sendall(value)
+                return "error" if kind == "error" else "ok", len(value)
+            try:
+                file = open(value, "rb")
+            except OSError:
+                # Removed since resolve() found it
+                self.request.sendall(NOT_FOUND_RESPONSE)
+                return "ok", len(NOT_FOUND_RESPONSE)
+            # sendfile() goes kernel to socket without copying the file through Python,
+            # and falls back to bounded chunked reads where the OS has no sendfile
+            with file:
+                return "ok", self.request.sendfile(file)
+        except OSError:
+            return "error", 0
+
+
+class ThreadPoolTCPServer(socketserver.TCPServer):
+    # Like ThreadingMixIn, but connections share a bounded pool of threads and
+    # clients beyond max_connections are turned away instead of queueing up
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, max_workers, max_connections=MAX_CONNECTIONS):
+        # socketserver listens with a backlog of 5 unless told otherwise
+        self.request_queue_size = max(LISTEN_BACKLOG, max_connections)
+        super().__init__(server_address, handler_class)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gopher")
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            record_request("threads", "busy", 0, time.perf_counter())
+            try:
+                request.settimeout(1.0)
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self._executor.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+class GopherServer:
+    def __init__(self, folder, host="localhost", port=70, engine="asyncio", max_workers=32, page_size=MENU_PAGE_SIZE,
+                 max_connections=MAX_CONNECTIONS, read_timeout=READ_TIMEOUT, write_timeout=WRITE_TIMEOUT,
+                 max_request_length=MAX_REQUEST_LENGTH, search=None):
+        if engine not in ("asyncio", "threads"):
+            raise ValueError(f"Unknown Gopher server engine: {engine}")
+        self.folder = folder
+        self.host = host
+        self.port = port
+        self.engine = engine
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self.max_connections = max_connections
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.max_request_length = max_request_length
+        self.search = search
+        self._active_connections = 0
+        self.site = None
+        self.server_address = None
+        self._thread = None
+        self._server = None
+        self._loop = None
+        self._ready = threading.Event()
+        self._startup_error = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        # Blocks until the socket is bound, so bind errors surface here
+        if self.running:
+            return self
+        self._ready.clear()
+        self._startup_error = None
+        target = self._run_asyncio if self.engine == "asyncio" else self._run_threads
+        self._thread = threading.Thread(target=target, name="gopher-server", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._startup_error:
+            self._thread.join()
+            self._thread = None
+            raise self._startup_error
+        return self
+
+    def stop(self, timeout=5):
+        if not self.running:
+            return
+        if self.engine == "asyncio":
+            self._loop.call_soon_threadsafe(self._server.close)
+        else:
+            self._server.shutdown()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Threaded engine
+
+    def _run_threads(self):
+        try:
+            server = ThreadPoolTCPServer((self.host, self.port), GopherRequestHandler, self.max_workers, self.max_connections)
+        except OSError as e:
+            self._startup_error = e
+            self._ready.set()
+            return
+        server.read_timeout = self.read_timeout
+        server.write_timeout = self.write_timeout
+        server.max_request_length = self.max_request_length
+        self._server = server
+        self.server_address = server.server_address[:2]
+        self.site = server.gopher_site = GopherSite(self.folder, self.host, self.server_address[1], self.page_size, self.search)
+        self._ready.set()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    # Asyncio engine
+
+    def _run_asyncio(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve_asyncio())
+        finally:
+            self._loop.close()
+
+    async def _serve_asyncio(self):
+        try:
+            self._server = await asyncio.start_server(
+                self._handle_client, self.host, self.port, reuse_address=True, limit=self.max_request_length,
+                backlog=max(LISTEN_BACKLOG, self.max_connections),
+            )
+        except OSError as e:
+            self._startup_error = e
+            self._ready.set()
+            return
+        self.server_address = self._server.sockets[0].getsockname()[:2]
+        self.site = GopherSite(self.folder, self.host, self.server_address[1], self.page_size, self.search)
+        self._ready.set()
+        try:
+            await self._server.wait_closed()
+        finally:
+            # Let clients that are mid-transfer finish before the loop goes away
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=5)
+
+    async def _handle_client(self, reader, writer):
+        started = time.perf_counter()
+        if self._active_connections >= self.max_connections:
+            writer.write(BUSY_RESPONSE)
+            writer.close()
+            record_request("asyncio", "busy", 0, started)
+            return
+        self._active_connections += 1
+        outcome, sent = "error", 0
+        try:
+            outcome, sent = await self._serve_client(reader, writer)
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            self._active_connections -= 1
+            writer.close()
+            record_request("asyncio", outcome, sent, started)
+
+    async def _serve_client(self, reader, writer):
+        # Read until CRLF (or EOF) with a size limit and a deadline; returns (outcome, bytes sent)
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\n"), self.read_timeout)
+        except asyncio.IncompleteReadError as e:
+            request = e.partial
+        except asyncio.LimitOverrunError:
+            request = None
+        try:
+            selector, words = parse_selector(request) if request is not None else (None, "")
+        except UnicodeDecodeError:
+            selector = None
+        if selector is None:
+            writer.write(BAD_REQUEST_RESPONSE)
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+            return "bad_request", len(BAD_REQUEST_RESPONSE)
+
+        # Keep only a small amount queued per client so slow readers push back on us
+        writer.transport.set_write_buffer_limits(high=64 * 1024)
+        loop = asyncio.get_running_loop()
+        try:
+            if selector == SEARCH_SELECTOR:
+                # The query and the store lock would stall every other client on the loop
+                kind, value = await loop.run_in_executor(None, self.site.resolve, selector, words)
+            else:
+                kind, value = self.site.resolve(selector, words)
+        except Exception as e:
+            # A failing lookup (a search on a damaged index, say) still gets the client an answer
+            loop.call_exception_handler({"message": f"Gopher request for {selector!r} failed", "exception": e})
+            kind, value = "error", SERVER_ERROR_RESPONSE
+        if kind == "file":
+            try:
+                file = open(value, "rb")
+            except OSError:
+                # Removed since resolve() found it
+                kind, value = "data", NOT_FOUND_RESPONSE
+        if kind != "file":
+            writer.write(value)
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+            return "error" if kind == "error" else "ok", len(value)
+        # Zero-copy where the event loop supports it, chunked reads otherwise
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            deadline = self.write_timeout + size / MIN_SEND_RATE
+            sent = await asyncio.wait_for(loop.sendfile(writer.transport, file), deadline)
+        return "ok", sent
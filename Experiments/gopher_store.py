@@ -0,0 +1,220 @@
+"""Content-addressed store for decoded files in the gopher folder.
+
+Every file is named after the SHA-256 of its content and written atomically
+(temp file + rename), so the same payload is only ever stored once. A small
+SQLite index maps each hash to its format, size, source and first-seen time,
+and also remembers which raw payloads produced which file so a payload that
+was already received can be recognised before it is even decoded.
+
+Text and HTML are also added to an FTS5 full-text index as they are stored,
+so searches (the gopher server's type 7 selector) are one indexed query
+however large the folder grows.
+"""
+
+import hashlib
+import html
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from rws_decode import iter_chunks
+from rws_metrics import METRICS
+
+# Index and temp files live here, os.path.isfile() keeps it out of the gopher menu
+STORE_DIR = ".store"
+
+# Formats whose text goes into the search index, and how much of each file is indexed
+SEARCH_FORMATS = ("txt", "html")
+SEARCH_TEXT_LIMIT = 1024 * 1024
+
+StoredFile = namedtuple("StoredFile", ["digest", "file_name", "format", "size", "source", "first_seen"])
+
+# A search hit: the stored file and a short excerpt around the matched words
+SearchResult = namedtuple("SearchResult", ["file", "snippet"])
+
+_MARKUP = re.compile(r"<(script|style)\b.*?</\1\s*>|<[^>]*>", re.IGNORECASE | re.DOTALL)
+
+# Where a decoded payload came from; stored is the existing StoredFile for a repeat
+PayloadOrigin = namedtuple("PayloadOrigin", ["source", "payload_digest", "stored"])
+
+
+def content_digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def payload_digest(data, start=0, end=None):
+    # Hash a raw payload region chunk by chunk without slicing it out
+    digest = hashlib.sha256()
+    for chunk in iter_chunks(data, start, end):
+        digest.update(chunk.encode("utf-8", "surrogatepass") if isinstance(chunk, str) else chunk)
+    return digest.hexdigest()
+
+
+def searchable_text(content, file_format):
+    # The words of a text or HTML file as they are read, or None for other formats
+    if file_format not in SEARCH_FORMATS:
+        return None
+    text = bytes(content[:SEARCH_TEXT_LIMIT]).decode("utf-8", "replace")
+    if file_format == "html":
+        text = html.unescape(_MARKUP.sub(" ", text))
+    return text
+
+
+def _match_expression(query):
+    # Every word has to appear; quoting each one keeps FTS5 operators and stray quotes literal
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in query.split())
+
+
+class ContentStore:
+    def __init__(self, folder):
+        self.folder = folder
+        self.store_dir = os.path.join(folder, STORE_DIR)
+        os.makedirs(self.store_dir, exist_ok=True)
+        # Shared between the Tk thread and decode workers
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.store_dir, "index.sqlite3"), check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "id INTEGER PRIMARY KEY, digest TEXT NOT NULL UNIQUE, file_name TEXT NOT NULL, format TEXT, "
+                "size INTEGER NOT NULL, source TEXT, first_seen REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS payloads (payload_digest TEXT PRIMARY KEY, digest TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS checkpoints (name TEXT PRIMARY KEY, position INTEGER NOT NULL)")
+            # Full-text index over the stored text and HTML, where SQLite was built with FTS5.
+            # Its rows use the id of their files row as rowid, so replacing one is a rowid lookup.
+            try:
+                self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(body)")
+                self.searchable = True
+            except sqlite3.OperationalError:
+                self.searchable = False
+
+    def lookup(self, digest):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest, file_name, format, size, source, first_seen FROM files WHERE digest = ?", (digest,)
+            ).fetchone()
+        return StoredFile(*row) if row else None
+
+    def lookup_payload(self, payload_digest):
+        # One indexed lookup tells us whether this exact payload was stored before
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT files.digest, file_name, format, size, source, first_seen FROM payloads "
+                "JOIN files ON files.digest = payloads.digest WHERE payload_digest = ?",
+                (payload_digest,),
+            ).fetchone()
+        if row is None or not os.path.isfile(os.path.join(self.folder, row[1])):
+            return None
+        return StoredFile(*row)
+
+    def checkpoint(self, name):
+        # How far a long-running import got (see varac_backfill), 0 when it never ran
+        with self._lock:
+            row = self._conn.execute("SELECT position FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def save_checkpoint(self, name, position):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?)", (name, position))
+
+    def path(self, record):
+        return os.path.join(self.folder, record.file_name)
+
+    def put(self, content, file_extension, source=None, payload_digest=None):
+        # Returns (record, created); created is False when the content was already stored
+        digest = content_digest(content)
+        record = self.lookup(digest)
+        created = record is None or not os.path.isfile(self.path(record))
+        if created:
+            file_name = f"{digest}{file_extension}"
+            with METRICS.timer("stage_seconds", stage="save"):
+                self._write_atomic(os.path.join(self.folder, file_name), content)
+            record = StoredFile(digest, file_name, file_extension.lstrip(".") or None, len(content), source, time.time())
+            with self._lock, self._conn:
+                # An upsert keeps the id the search index refers to
+                self._conn.execute(
+                    "INSERT INTO files (digest, file_name, format, size, source, first_seen) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (digest) DO UPDATE SET file_name = excluded.file_name, format = excluded.format, "
+                    "size = excluded.size, source = excluded.source, first_seen = excluded.first_seen",
+                    record,
+                )
+                file_id = self._conn.execute("SELECT id FROM files WHERE digest = ?", (digest,)).fetchone()[0]
+                self._index(file_id, content, record.format)
+
+        if payload_digest:
+            with self._lock, self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO payloads VALUES (?, ?)", (payload_digest, digest))
+        return record, created
+
+    def _index(self, file_id, content, file_format):
+        # Called with the lock held, inside the transaction that stores the file
+        text = searchable_text(content, file_format) if self.searchable else None
+        if text is None:
+            return
+        with METRICS.timer("stage_seconds", stage="index"):
+            self._conn.execute("DELETE FROM search WHERE rowid = ?", (file_id,))
+            self._conn.execute("INSERT INTO search (rowid, body) VALUES (?, ?)", (file_id, text))
+
+    def index_missing(self):
+        # Index text files stored before the search index existed; returns how many were added
+        if not self.searchable:
+            return 0
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, file_name, format FROM files WHERE format IN ({}) "
+                "AND id NOT IN (SELECT rowid FROM search)".format(", ".join("?" * len(SEARCH_FORMATS))),
+                SEARCH_FORMATS,
+            ).fetchall()
+        indexed = 0
+        for file_id, file_name, file_format in rows:
+            try:
+                with open(os.path.join(self.folder, file_name), "rb") as file:
+                    content = file.read(SEARCH_TEXT_LIMIT)
+            except OSError:
+                continue
+            with self._lock, self._conn:
+                self._index(file_id, content, file_format)
+            indexed += 1
+        return indexed
+
+    def search(self, query, limit=100):
+        # Best matches first; every word of the query has to appear in the file
+        expression = _match_expression(query)
+        if not self.searchable or not expression:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT files.digest, file_name, format, size, source, first_seen, "
+                "snippet(search, 0, '', '', '...', 10) FROM search JOIN files ON files.id = search.rowid "
+                "WHERE search MATCH ? ORDER BY rank LIMIT ?",
+                (expression, limit),
+            ).fetchall()
+        return [
+            SearchResult(StoredFile(*row[:6]), " ".join(row[6].split()))
+            for row in rows
+            if os.path.isfile(os.path.join(self.folder, row[1]))
+        ]
+
+    def _write_atomic(self, file_path, content):
+        # Readers (like the gopher server) never see a half-written file
+        fd, temp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(content)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def close(self):
+        self._conn.close()
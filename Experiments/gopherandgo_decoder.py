@@ -1,166 +1,252 @@
-import base64
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
-import tempfile
-import webbrowser
-import re
-from PIL import Image
-from io import BytesIO
 import os
 import sys
-import sqlite3
-import socketserver
 import threading
-import mimetypes
-import urllib.parse
 
-class GopherRequestHandler(socketserver.BaseRequestHandler):
-    def handle(self):
-        request = self.request.recv(1024).strip().decode("utf-8")
-        selector = urllib.parse.unquote(request.split("\t")[0])  # Decode URL-encoded selector
-        
-        if selector == "" or selector == ".":
-            # Serve the Gopher menu
-            menu = "iWelcome to Our Gopher Server\r\n"  # Informational header
-            menu += "1Main Directory\t/\tlocalhost\t70\r\n"
-            self.request.sendall(menu.encode("utf-8"))
-        elif selector == "/":
-            # Serve the main directory listing
-            menu = "iContents of Main Directory\tfake\t(NULL)\t0\r\n"  # Prettified header
-            menu += "i--------------------------------\tfake\t(NULL)\t0\r\n"  # Decorative separator
-            try:
-                for item in os.listdir(gopher_folder):
-                    item_path = os.path.join(gopher_folder, item)
-                    if os.path.isfile(item_path):
-                        menu += "0{}\t/{}\tlocalhost\t70\r\n".format(item, item)
-            except Exception as e:
-                menu += "3Error: {}\tfake\t(NULL)\t0\r\n".format(str(e))
-            menu += "1Return to Main Menu\t.\tlocalhost\t70\r\n"  # Link to go back to the main menu
-            self.request.sendall(menu.encode("utf-8"))
-        else:
-            # Serve the requested file
-            selector = selector.lstrip('/')
-            file_path = os.path.join(gopher_folder, selector)
-            if os.path.isfile(file_path):
-                with open(file_path, "rb") as file:
-                    content = file.read()
-                self.request.sendall(content)
-            else:
-                self.request.sendall(b"Error: File not found.")
+# The shared decode pipeline lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rws_codecs import decode_region
+from rws_decode import (Base64DecodeError, PayloadNotFoundError, format_file_summary, iter_blocks, iter_payload_regions,
+                        map_file, summarize_file)
+from rws_detect import detect_file_format
+from rws_metrics import METRICS
+from rws_preview import PreviewPane, open_path
+from rws_worker import BackgroundJob
 
+# PIL, sqlite3, asyncio and friends are imported by the functions that use them,
+# so the window comes up without waiting for them
+
+def start_services():
+    # Runs once the window is up, so the store and the server socket never delay the first paint
+    global content_store
+    from gopher_store import ContentStore
+    
+    # Create the Gopher files folder if it doesn't exist
+    os.makedirs(gopher_folder, exist_ok=True)
+    
+    # Decoded files are kept in a content-addressed store inside the Gopher folder
+    content_store = ContentStore(gopher_folder)
+    
+    # Text saved before the search index existed is indexed in the background
+    threading.Thread(target=content_store.index_missing, name="search-index", daemon=True).start()
+    
+    try:
+        start_gopher_server()
+    except OSError as e:
+        messagebox.showwarning("Warning", f"The Gopher server could not be started on port {port}: {e}.")
 
 def start_gopher_server():
-    server = socketserver.TCPServer((host, port), GopherRequestHandler)
-    server_thread = threading.Thread(target=server.serve_forever)
-    server_thread.daemon = True
-    server_thread.start()
+    # Serve the Gopher folder on a background thread until stop_gopher_server()
+    global gopher_server
+    from gopher_server import GopherServer
+    search = content_store.search if content_store and content_store.searchable else None
+    gopher_server = GopherServer(gopher_folder, host, port, engine=gopher_engine, search=search).start()
+    return gopher_server
 
-def is_base64(s):
-    try:
-        base64.b64decode(s)
-        return True
-    except Exception:
-        return False
+def stop_gopher_server():
+    if gopher_server:
+        gopher_server.stop()
 
-def save_file(file_content, file_extension):
-    file_name = urllib.parse.quote(f"decoded_file{file_extension}")
-    file_path = os.path.join(gopher_folder, file_name)
-    with open(file_path, "wb") as file:
-        file.write(file_content)
-    messagebox.showinfo("Success", f"{file_extension.upper()} file saved.")
+def on_close():
+    # Shut the Gopher server down cleanly instead of killing it with the process
+    stop_gopher_server()
+    window.destroy()
+
+def save_file(file_content, file_extension, origin=None, success_message=None):
+    # Files are stored under their content hash, the same content is only written once
+    source = origin.source if origin else None
+    payload_digest = origin.payload_digest if origin else None
+    record, created = content_store.put(file_content, file_extension, source, payload_digest)
+    if created:
+        messagebox.showinfo("Success", success_message or f"{file_extension.upper()} file saved.")
+    else:
+        messagebox.showinfo("Information", f"{file_extension.upper()} file already saved as {record.file_name}.")
+    return content_store.path(record)
 
 def open_file(file_path):
-    if sys.platform == "win32":
-        os.startfile(file_path)
+    with METRICS.timer("stage_seconds", stage="open"):
+        open_path(file_path)
+
+def start_job(work, on_done, determinate=True):
+    global current_job
+    
+    # Lock the action buttons and show progress while the worker runs
+    decode_button.config(state=tk.DISABLED)
+    read_database_button.config(state=tk.DISABLED)
+    backfill_button.config(state=tk.DISABLED)
+    open_file_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
+    progress_bar.config(mode="determinate" if determinate else "indeterminate", value=0)
+    if not determinate:
+        progress_bar.start()
+    
+    def finish_job():
+        global current_job
+        current_job = None
+        progress_bar.stop()
+        progress_bar.config(mode="determinate", value=0)
+        decode_button.config(state=tk.NORMAL)
+        read_database_button.config(state=tk.NORMAL)
+        backfill_button.config(state=tk.NORMAL)
+        open_file_button.config(state=tk.NORMAL)
+        cancel_button.config(state=tk.DISABLED)
+    
+    def job_done(result):
+        finish_job()
+        on_done(result)
+    
+    def job_failed(error):
+        finish_job()
+        handle_job_error(error)
+    
+    def update_progress(fraction):
+        progress_bar.config(value=fraction * 100)
+    
+    current_job = BackgroundJob(window, work, job_done, job_failed, on_progress=update_progress, on_cancel=finish_job).start()
+
+def cancel_job():
+    if current_job:
+        current_job.cancel()
+
+def handle_job_error(error):
+    import sqlite3
+    
+    if isinstance(error, Base64DecodeError):
+        messagebox.showwarning("Warning", f"Invalid base64 code: {error}.")
+    elif isinstance(error, PayloadNotFoundError):
+        messagebox.showwarning("Warning", f"{error}.")
+    elif isinstance(error, sqlite3.Error):
+        messagebox.showerror("Error", f"An error occurred while reading the VarAC database: {str(error)}")
     else:
-        opener = "open" if sys.platform == "darwin" else "xdg-open"
-        os.system(f"{opener} {file_path}")
+        messagebox.showerror("Error", f"An error occurred: {str(error)}")
 
-def compile_base64():
-    base64_code = code_entry.get("1.0", tk.END).strip()
+def decode_and_detect(base64_code, job, source="paste", unpack_archives=False):
+    # Runs on the worker thread, so no Tk calls in here
+    from gopher_store import PayloadOrigin
+    from gopher_store import payload_digest as hash_payload
+    from rws_unpack import expand
     
-    if not base64_code:
+    results = []
+    with METRICS.timer("stage_seconds", stage="extract"):
+        regions = list(iter_payload_regions(base64_code))
+    for start, end in regions:
+        job.check_cancelled()
+        
+        # A payload that was already stored costs one hash lookup instead of a decode
+        payload_digest = hash_payload(base64_code, start, end)
+        origin = PayloadOrigin(source, payload_digest, content_store.lookup_payload(payload_digest))
+        if origin.stored:
+            METRICS.count("decode_outcomes_total", outcome="duplicate")
+            results.append((None, None, None, None, origin, None))
+            continue
+        
+        # The encoding (base64, base64url, base32, base85, ...) is detected per block
+        block = decode_region(base64_code, start, end, progress=job.report)
+        if block.error is not None:
+            results.append((block, None, None, None, origin, None))
+            continue
+        
+        # gz/bz2/zip payloads are replaced by the files inside them, which expand() sniffs
+        file_format = detect_file_format(block.content)
+        unpacked_files, unpack_error = [(block, file_format)], None
+        if unpack_archives:
+            unpacked, unpack_error = expand(block.content, file_format, job.check_cancelled)
+            unpacked_files = [(block._replace(content=item.content), item.format) for item in unpacked]
+        for unpacked_block, file_format in unpacked_files:
+            content_kind = detect_content_kind(unpacked_block.content)
+            results.append((unpacked_block, file_format) + content_kind + (origin, unpack_error))
+    return results
+
+def detect_content_kind(decoded_content):
+    from io import BytesIO
+    from PIL import Image
+    
+    # Check if the decoded content is an image
+    try:
+        image = Image.open(BytesIO(decoded_content))
+        image.verify()
+        return "image", None
+    except Exception:
+        pass
+    
+    # Check if the decoded content is HTML or plain text
+    try:
+        decoded_text = decoded_content.decode("utf-8")
+    except UnicodeDecodeError:
+        return None, None
+    lowered = decoded_text.lower()
+    if "<html" in lowered and "</html>" in lowered:
+        return "html", decoded_text
+    return "text", decoded_text
+
+def decode_file_and_detect(file_path, job, unpack_archives=False):
+    # The file is mapped, not read, so even huge captures never sit in memory as a whole
+    with map_file(file_path) as data:
+        return decode_and_detect(data, job, file_path, unpack_archives)
+
+def compile_base64(source="paste"):
+    # Tk variables are read here, the worker must not touch them
+    unpack_archives = unpack_var.get()
+    
+    if input_file:
+        # Decode straight from disk, the text field only holds a preview
+        start_job(lambda job: decode_file_and_detect(input_file, job, unpack_archives), handle_decoded_blocks)
+        return
+    
+    base64_code = code_entry.get("1.0", tk.END)
+    
+    if base64_code.isspace() or not base64_code:
         messagebox.showwarning("Warning", "Please enter the base64 code.")
         return
     
-    try:
-        # Check if the specified format is present
-        if "-----" in base64_code:
-            # Extract base64 code between the dashes
-            base64_code = re.findall(r'-----(.*?)-----', base64_code, re.DOTALL)
-            if base64_code:
-                base64_code = base64_code[0].strip()
-            else:
-                messagebox.showwarning("Warning", "No valid base64 code found between the dashes.")
-                return
+    # Clean, validate, decode and detect every block on a worker so the window stays responsive
+    start_job(lambda job: decode_and_detect(base64_code, job, source, unpack_archives), handle_decoded_blocks)
+
+def handle_decoded_blocks(results):
+    for block, file_format, content_kind, decoded_text, origin, unpack_error in results:
+        if origin.stored:
+            messagebox.showinfo("Information", f"Payload already received, saved as {origin.stored.file_name}.")
+        elif block.error is not None:
+            messagebox.showwarning("Warning", f"Invalid {block.codec} code: {block.error}.")
         else:
-            # Remove non-base64 content
-            base64_code = re.sub(r'[^a-zA-Z0-9+/=\s]', '', base64_code)
-            base64_code = ''.join(base64_code.split())
-        
-        if not is_base64(base64_code):
-            messagebox.showwarning("Warning", "Invalid base64 code.")
-            return
-        
-        decoded_content = base64.b64decode(base64_code)
-        
-        # Check if the decoded content is an image
-        try:
-            image = Image.open(BytesIO(decoded_content))
-            image.verify()
-            is_image = True
-        except:
-            is_image = False
-        
+            if block.corrected:
+                messagebox.showinfo("Information", f"Error correction repaired {block.corrected} damaged bytes.")
+            if unpack_error is not None:
+                messagebox.showwarning("Warning", f"{unpack_error}. The compressed file is kept as it is.")
+            handle_decoded_content(block.content, file_format, content_kind, decoded_text, origin)
+
+def handle_decoded_content(decoded_content, file_format, content_kind, decoded_text, origin=None):
+    is_image = content_kind == "image"
+    is_html = content_kind == "html"
+    is_text = content_kind == "text"
+    
+    # Every decoded file is previewed in the window, opening it elsewhere is opt-in
+    preview_pane.show(decoded_content, "html" if is_html else file_format)
+    
+    try:
         if is_image:
             # Save the decoded image
             if save_image_var.get():
-                save_file(decoded_content, ".png")
+                save_file(decoded_content, ".png", origin)
             
             # Open the decoded image in the default image viewer
             if open_image_var.get():
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-                    temp_file.write(decoded_content)
-                    temp_file_path = temp_file.name
-                open_file(temp_file_path)
+                preview_pane.open_externally()
         else:
-            # Check if the decoded content is HTML
-            try:
-                decoded_html = decoded_content.decode("utf-8")
-                if "<html" in decoded_html.lower() and "</html>" in decoded_html.lower():
-                    is_html = True
-                else:
-                    is_html = False
-            except:
-                is_html = False
-            
             if is_html:
                 # Save the decoded HTML
                 if save_html_var.get():
-                    save_file(decoded_html.encode("utf-8"), ".html")
+                    save_file(decoded_content, ".html", origin)
                 
                 # Open the decoded HTML in the default web browser
                 if open_html_var.get():
-                    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".html") as temp_file:
-                        temp_file.write(decoded_html)
-                        temp_file_path = temp_file.name
-                    webbrowser.open(temp_file_path)
+                    preview_pane.open_externally()
             else:
-                # Check if the decoded content is plain text
-                try:
-                    decoded_text = decoded_content.decode("utf-8")
-                    is_text = True
-                except:
-                    is_text = False
-                
                 if is_text:
                     # Save the decoded text file to the Gopher folder
                     if save_text_var.get():
-                        file_name = urllib.parse.quote("decoded_text.txt")
-                        file_path = os.path.join(gopher_folder, file_name)
-                        with open(file_path, "w") as file:
-                            file.write(decoded_text)
-                        messagebox.showinfo("Success", "Text file saved to the Gopher folder.")
+                        save_file(decoded_content, ".txt", origin, "Text file saved to the Gopher folder.")
                 else:
                     # Prompt the user to select the file format
                     file_formats = [".wav", ".mp3", ".ogg", ".flac", ".aac", ".m4a", ".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".csv", ".zip", ".rar", ".7z"]
@@ -182,7 +268,7 @@ def compile_base64():
                     
                     def save_file_as_format():
                         file_extension = selected_format.get()
-                        save_file(decoded_content, file_extension)
+                        save_file(decoded_content, file_extension, origin)
                         file_format_window.destroy()
                     
                     save_button = ttk.Button(file_format_frame, text="Save", command=save_file_as_format, style="Accent.TButton")
@@ -196,24 +282,39 @@ def compile_base64():
         messagebox.showerror("Error", f"An error occurred: {str(e)}")
 
 def open_base64_file():
-    file_path = filedialog.askopenfilename(filetypes=[("Text Files", "*.txt")])
+    file_path = filedialog.askopenfilename(filetypes=[("All Files", "*.*"), ("Text Files", "*.txt")])
     if file_path:
-        with open(file_path, "r") as file:
-            base64_code = file.read().strip()
-            code_entry.delete("1.0", tk.END)
-            code_entry.insert(tk.END, base64_code)
+        # Only a preview goes into the text field, inserting megabytes into Tk takes seconds
+        start_job(lambda job: summarize_file(file_path), show_file_preview, determinate=False)
+
+def show_file_preview(summary):
+    global input_file
+    input_file = summary.path
+    code_entry.config(state=tk.NORMAL)
+    code_entry.delete("1.0", tk.END)
+    code_entry.insert(tk.END, format_file_summary(summary))
+    code_entry.config(state=tk.DISABLED)
+    open_file_button.config(text="Close File", command=close_input_file)
+
+def close_input_file():
+    # Back to decoding whatever is typed or pasted into the text field
+    global input_file
+    input_file = None
+    code_entry.config(state=tk.NORMAL)
+    code_entry.delete("1.0", tk.END)
+    open_file_button.config(text="Open Base64 File", command=open_base64_file)
 
 def open_settings():
     settings_window = tk.Toplevel(window)
     settings_window.title("Settings")
-    settings_window.geometry("400x450")
+    settings_window.geometry("400x600")
     settings_window.configure(bg="#FFFFFF")
     
     settings_frame = ttk.Frame(settings_window, padding=20)
     settings_frame.pack(fill=tk.BOTH, expand=True)
     
     # Open HTML option
-    open_html_checkbox = ttk.Checkbutton(settings_frame, text="Open HTML file after decoding", variable=open_html_var)
+    open_html_checkbox = ttk.Checkbutton(settings_frame, text="Open HTML file in the browser after decoding", variable=open_html_var)
     open_html_checkbox.pack(anchor=tk.W, pady=(0, 10))
     
     # Save HTML option
@@ -221,7 +322,7 @@ def open_settings():
     save_html_checkbox.pack(anchor=tk.W, pady=(0, 10))
     
     # Open Image option
-    open_image_checkbox = ttk.Checkbutton(settings_frame, text="Open image file after decoding", variable=open_image_var)
+    open_image_checkbox = ttk.Checkbutton(settings_frame, text="Open image file in the image viewer after decoding", variable=open_image_var)
     open_image_checkbox.pack(anchor=tk.W, pady=(0, 10))
     
     # Save Image option
@@ -230,125 +331,275 @@ def open_settings():
     
     # Save Text option
     save_text_checkbox = ttk.Checkbutton(settings_frame, text="Prompt to save text file after decoding", variable=save_text_var)
-    save_text_checkbox.pack(anchor=tk.W, pady=(0, 20))
+    save_text_checkbox.pack(anchor=tk.W, pady=(0, 10))
+    
+    # VarAC watch poll interval option
+    poll_interval_frame = ttk.Frame(settings_frame)
+    poll_interval_frame.pack(anchor=tk.W, pady=(0, 10))
+    
+    poll_interval_label = ttk.Label(poll_interval_frame, text="Watch VarAC every (seconds):")
+    poll_interval_label.pack(side=tk.LEFT)
+    
+    poll_interval_spinbox = ttk.Spinbox(poll_interval_frame, from_=1, to=3600, width=6, textvariable=varac_poll_interval_var)
+    poll_interval_spinbox.pack(side=tk.LEFT, padx=(10, 0))
+    
+    # Unpack archives option
+    unpack_checkbox = ttk.Checkbutton(settings_frame, text="Unpack gzip, bz2, xz and zip payloads", variable=unpack_var)
+    unpack_checkbox.pack(anchor=tk.W, pady=(0, 10))
+    
+    # Metrics option
+    metrics_checkbox = ttk.Checkbutton(settings_frame, text="Collect metrics (served at /metrics over Gopher)", variable=metrics_var, command=lambda: METRICS.enable(metrics_var.get()))
+    metrics_checkbox.pack(anchor=tk.W, pady=(0, 20))
     
     close_button = ttk.Button(settings_frame, text="Close", command=settings_window.destroy, style="Accent.TButton")
     close_button.pack(pady=(0, 10))
 
+def locate_varac_database():
+    from varac_reader import DEFAULT_DB_PATH
+    
+    if os.path.isfile(DEFAULT_DB_PATH):
+        return DEFAULT_DB_PATH
+    
+    # Prompt the user to select the directory containing the VarAC database
+    messagebox.showinfo("Information", "VarAC database not found in the default location. Please select the directory containing the VarAC database.")
+    db_directory = filedialog.askdirectory(title="Select VarAC Database Directory")
+    if not db_directory:
+        return None
+    
+    # Check if the VarAC database file exists in the selected directory
+    db_path = os.path.join(db_directory, "VarAC.db")
+    if not os.path.isfile(db_path):
+        messagebox.showerror("Error", "VarAC database not found in the selected directory.")
+        return None
+    return db_path
+
 def read_varac_database():
+    db_path = locate_varac_database()
+    if db_path:
+        # Query the database on a worker so the window stays responsive
+        start_job(lambda job: read_latest_base64(db_path, job), handle_varac_base64, determinate=False)
+
+def read_latest_base64(db_path, job):
+    # Runs on the worker thread, the connection never leaves it
+    from rws_fec import merge_receptions
+    from varac_reader import RECEPTION_LOOKBACK, connect_readonly
+    conn = connect_readonly(db_path)
     try:
-        # Default path to the VarAC SQLite database
-        default_db_path = "C:\\VarAC\\VarAC.db"
-        
-        if not os.path.isfile(default_db_path):
-            # Prompt the user to select the directory containing the VarAC database
-            messagebox.showinfo("Information", "VarAC database not found in the default location. Please select the directory containing the VarAC database.")
-            db_directory = filedialog.askdirectory(title="Select VarAC Database Directory")
-            if not db_directory:
-                return
-            
-            # Check if the VarAC database file exists in the selected directory
-            db_path = os.path.join(db_directory, "VarAC.db")
-            if not os.path.isfile(db_path):
-                messagebox.showerror("Error", "VarAC database not found in the selected directory.")
-                return
-        else:
-            db_path = default_db_path
-        
-        # Connect to the VarAC SQLite database
-        conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
         
-        # Query the datastream table to get the latest base64 code
+        # Query the datastream table to get the latest entry with base64 blocks,
+        # and the entries before it that may hold repeats of the same payload
         cursor.execute("SELECT entry FROM datastream ORDER BY id DESC")
-        results = cursor.fetchall()
-        
-        base64_code = ""
-        for result in results:
+        latest = None
+        earlier = []
+        for result in cursor:
+            job.check_cancelled()
             entry = result[0]
-            if "-----" in entry:
-                # Extract base64 code between the dashes
-                base64_code = re.findall(r'-----(.*?)-----', entry, re.DOTALL)
-                if base64_code:
-                    base64_code = base64_code[0].strip()
-                    break
-        
-        if base64_code:
-            code_entry.delete("1.0", tk.END)
-            code_entry.insert(tk.END, base64_code)
-            compile_base64()
-        else:
-            messagebox.showinfo("Information", "No base64 code found in the VarAC database.")
-        
+            if not entry or next(iter_blocks(entry), None) is None:
+                continue
+            if latest is None:
+                latest = entry
+                continue
+            earlier.append(entry)
+            if len(earlier) >= RECEPTION_LOOKBACK:
+                break
+        if latest is None:
+            return ""
+        # Keep the whole entry so every block in it gets decoded, voted on against its repeats
+        return merge_receptions(latest, earlier)[0]
+    finally:
         conn.close()
+
+def backfill_varac_database():
+    db_path = locate_varac_database()
+    if not db_path:
+        return
+    if not messagebox.askyesno("Backfill VarAC", "Decode every payload in the VarAC history into the Gopher folder? An interrupted backfill continues where it stopped."):
+        return
+    # Tk variables are read here, the worker must not touch them
+    unpack_archives = unpack_var.get()
+    start_job(lambda job: run_backfill(db_path, job, unpack_archives), handle_backfill_done)
+
+def run_backfill(db_path, job, unpack_archives=False):
+    from varac_backfill import backfill
+    
+    return backfill(db_path, content_store, unpack_archives=unpack_archives, progress=job.report,
+                    check_cancelled=job.check_cancelled)
+
+def handle_backfill_done(stats):
+    from varac_backfill import format_backfill_summary
+    messagebox.showinfo("Backfill Complete", f"{format_backfill_summary(stats)}.")
+
+def toggle_varac_watch():
+    global varac_watcher
+    import sqlite3
+    from varac_reader import DatastreamWatcher
+    
+    if varac_watcher:
+        varac_watcher.close()
+        varac_watcher = None
+        watch_database_button.config(text="Watch VarAC")
+        return
+    
+    db_path = locate_varac_database()
+    if not db_path:
+        return
+    try:
+        varac_watcher = DatastreamWatcher(db_path)
     except sqlite3.Error as e:
         messagebox.showerror("Error", f"An error occurred while reading the VarAC database: {str(e)}")
+        return
+    watch_database_button.config(text="Stop Watching")
+    schedule_varac_poll(varac_watcher)
+
+def schedule_varac_poll(watcher):
+    try:
+        interval = max(1, int(varac_poll_interval_var.get()))
+    except (tk.TclError, ValueError):
+        interval = 5
+    window.after(interval * 1000, lambda: poll_varac(watcher))
+
+def poll_varac(watcher):
+    # Stop quietly if watching was turned off (or restarted) since the last poll
+    if watcher is not varac_watcher:
+        return
+    
+    def poll_done(results):
+        if results:
+            handle_decoded_blocks(results)
+        schedule_varac_poll(watcher)
+    
+    def poll_failed(error):
+        # Errors from a watcher that was already stopped are expected, ignore them
+        if watcher is varac_watcher:
+            toggle_varac_watch()
+            handle_job_error(error)
+    
+    unpack_archives = unpack_var.get()
+    BackgroundJob(window, lambda job: decode_new_entries(watcher, job, unpack_archives), poll_done, poll_failed).start()
+
+def decode_new_entries(watcher, job, unpack_archives=False):
+    # Runs on the worker thread: fetch rows newer than the last one seen and decode their blocks
+    results = []
+    for entry_id, entry in watcher.poll():
+        if entry and next(iter_blocks(entry), None) is not None:
+            results.extend(decode_and_detect(entry, job, f"VarAC datastream {entry_id}", unpack_archives))
+    return results
+
+def handle_varac_base64(base64_code):
+    if base64_code:
+        close_input_file()
+        code_entry.delete("1.0", tk.END)
+        code_entry.insert(tk.END, base64_code)
+        compile_base64("VarAC")
+    else:
+        messagebox.showinfo("Information", "No base64 code found in the VarAC database.")
 
 # Gopher server configuration
 host = "localhost"
 port = 70
+gopher_engine = "asyncio"  # Or "threads" for the thread-pool server
+gopher_server = None
 gopher_folder = os.path.abspath("gopher_files")  # Convert to absolute path
 
-# Create the Gopher files folder if it doesn't exist
-if not os.path.exists(gopher_folder):
-    os.makedirs(gopher_folder)
-
-# Start the Gopher server
-start_gopher_server()
-
-# Create the main window
-window = tk.Tk()
-window.title("Base64 Decoder")
-window.geometry("800x600")
-window.configure(bg="#FFFFFF")
-
-# Create a style for the main window
-style = ttk.Style(window)
-style.theme_use("clam")
-style.configure(".", background="#FFFFFF", foreground="#333333", font=("Segoe UI", 12))
-style.configure("TFrame", background="#FFFFFF")
-style.configure("TLabel", background="#FFFFFF", foreground="#333333", font=("Segoe UI", 14))
-style.configure("TButton", font=("Segoe UI", 12), padding=10)
-style.configure("Accent.TButton", background="#007BFF", foreground="#FFFFFF", font=("Segoe UI", 12, "bold"), padding=10)
-
-# Create a frame for the main content
-main_frame = ttk.Frame(window, padding=20)
-main_frame.pack(fill=tk.BOTH, expand=True)
-
-# Create and pack the label
-label = ttk.Label(main_frame, text="Enter base64 code:")
-label.pack(anchor=tk.W, pady=(0, 10))
-
-# Create and pack the text entry field
-code_entry = tk.Text(main_frame, height=15, width=80, font=("Consolas", 12), bg="#F5F5F5", fg="#333333", padx=10, pady=10, wrap=tk.WORD, bd=0, highlightthickness=1, highlightcolor="#CCCCCC", highlightbackground="#CCCCCC")
-code_entry.pack(fill=tk.BOTH, expand=True, pady=(0, 20))
-
-# Create a frame for the buttons
-button_frame = ttk.Frame(main_frame)
-button_frame.pack(anchor=tk.W)
-
-# Create and pack the decode button
-decode_button = ttk.Button(button_frame, text="Decode", command=compile_base64, style="Accent.TButton")
-decode_button.pack(side=tk.LEFT, padx=(0, 10))
-
-# Create and pack the open file button
-open_file_button = ttk.Button(button_frame, text="Open Base64 File", command=open_base64_file)
-open_file_button.pack(side=tk.LEFT, padx=(0, 10))
-
-# Create and pack the read from VarAC database button
-read_database_button = ttk.Button(button_frame, text="Read from VarAC", command=read_varac_database)
-read_database_button.pack(side=tk.LEFT, padx=(0, 10))
-
-# Create and pack the settings button 
-settings_button = ttk.Button(button_frame, text="Settings", command=open_settings)
-settings_button.pack(side=tk.LEFT)
-
-# Create variables for settings options
-open_html_var = tk.BooleanVar(value=True)
-save_html_var = tk.BooleanVar(value=False)
-save_text_var = tk.BooleanVar(value=False)
-open_image_var = tk.BooleanVar(value=True)
-save_image_var = tk.BooleanVar(value=False)
-
-# Start the main event loop
-window.mainloop()
\ No newline at end of file
+# Created by start_services() once the window is up
+content_store = None
+
+if __name__ == "__main__":
+    # Worker processes (see rws_parallel) import this script again, only the real run builds the window
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+        multiprocessing.freeze_support()
+
+    # Create the main window
+    window = tk.Tk()
+    window.title("Base64 Decoder")
+    window.geometry("800x800")
+    window.configure(bg="#FFFFFF")
+    window.protocol("WM_DELETE_WINDOW", on_close)
+
+    # Create a style for the main window
+    style = ttk.Style(window)
+    style.theme_use("clam")
+    style.configure(".", background="#FFFFFF", foreground="#333333", font=("Segoe UI", 12))
+    style.configure("TFrame", background="#FFFFFF")
+    style.configure("TLabel", background="#FFFFFF", foreground="#333333", font=("Segoe UI", 14))
+    style.configure("TButton", font=("Segoe UI", 12), padding=10)
+    style.configure("Accent.TButton", background="#007BFF", foreground="#FFFFFF", font=("Segoe UI", 12, "bold"), padding=10)
+
+    # Create a frame for the main content
+    main_frame = ttk.Frame(window, padding=20)
+    main_frame.pack(fill=tk.BOTH, expand=True)
+
+    # Create and pack the label
+    label = ttk.Label(main_frame, text="Enter base64 code:")
+    label.pack(anchor=tk.W, pady=(0, 10))
+
+    # Create and pack the text entry field
+    code_entry = tk.Text(main_frame, height=8, width=80, font=("Consolas", 12), bg="#F5F5F5", fg="#333333", padx=10, pady=10, wrap=tk.WORD, bd=0, highlightthickness=1, highlightcolor="#CCCCCC", highlightbackground="#CCCCCC")
+    code_entry.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
+
+    # Create and pack the progress bar for background work
+    progress_bar = ttk.Progressbar(main_frame, mode="determinate", maximum=100)
+    progress_bar.pack(fill=tk.X, pady=(0, 20))
+
+    # Create a frame for the buttons
+    button_frame = ttk.Frame(main_frame)
+    button_frame.pack(anchor=tk.W)
+
+    # Create and pack the decode button
+    decode_button = ttk.Button(button_frame, text="Decode", command=compile_base64, style="Accent.TButton")
+    decode_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    # Create and pack the cancel button, only enabled while work is running
+    cancel_button = ttk.Button(button_frame, text="Cancel", command=cancel_job, state=tk.DISABLED)
+    cancel_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    # Create and pack the open file button
+    open_file_button = ttk.Button(button_frame, text="Open Base64 File", command=open_base64_file)
+    open_file_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    # Create and pack the read from VarAC database button
+    read_database_button = ttk.Button(button_frame, text="Read from VarAC", command=read_varac_database)
+    read_database_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    # Create and pack the backfill button, imports the whole VarAC history
+    backfill_button = ttk.Button(button_frame, text="Backfill VarAC", command=backfill_varac_database)
+    backfill_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    # Create and pack the watch VarAC button, decodes new payloads as they arrive
+    watch_database_button = ttk.Button(button_frame, text="Watch VarAC", command=toggle_varac_watch)
+    watch_database_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    # Create and pack the settings button 
+    settings_button = ttk.Button(button_frame, text="Settings", command=open_settings)
+    settings_button.pack(side=tk.LEFT)
+
+    # Create and pack the preview pane, decoded files are shown here instead of in outside viewers
+    preview_pane = PreviewPane(main_frame, opener=open_file)
+    preview_pane.pack(fill=tk.BOTH, expand=True, pady=(20, 0))
+
+    # The background job currently running, if any
+    current_job = None
+
+    # The VarAC datastream watcher while watch mode is on
+    varac_watcher = None
+
+    # The file being decoded from disk, None while decoding the text field
+    input_file = None
+
+    # Create variables for settings options
+    open_html_var = tk.BooleanVar(value=False)
+    save_html_var = tk.BooleanVar(value=False)
+    save_text_var = tk.BooleanVar(value=False)
+    open_image_var = tk.BooleanVar(value=False)
+    save_image_var = tk.BooleanVar(value=False)
+    varac_poll_interval_var = tk.IntVar(value=5)
+    unpack_var = tk.BooleanVar(value=True)
+    metrics_var = tk.BooleanVar(value=METRICS.enabled)
+
+    # Open the store and start the Gopher server as soon as the window is idle
+    window.after_idle(start_services)
+
+    # Start the main event loop
+    window.mainloop()
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""Import every payload ever received from a VarAC database into the gopher folder.
+
+Usage:
+    python varac_backfill.py [--db VarAC.db] [--folder gopher_files] [-j JOBS] [--unpack] [--restart]
+
+The datastream table is read in id order, BACKFILL_BATCH_SIZE rows at a
+time with fetchmany(), and every -----delimited----- block in every row is
+decoded on a worker pool. Decoded files go into the content-addressed store
+(see gopher_store), so repeats are stored once and payloads that were
+already received are skipped before they are decoded. The last row id of
+each finished batch is saved in the store, so an interrupted backfill picks
+up where it stopped.
+"""
+
+import argparse
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+# The shared decode pipeline lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gopher_store import ContentStore, payload_digest
+from rws_codecs import decode_region
+from rws_decode import iter_blocks
+from rws_detect import detect_file_format, file_extension
+from rws_parallel import mark_pool_worker
+from rws_unpack import expand
+from varac_reader import DEFAULT_DB_PATH, connect_readonly
+
+# Rows read per fetchmany() call; progress is saved after each batch
+BACKFILL_BATCH_SIZE = 500
+
+BackfillStats = namedtuple("BackfillStats", ["rows", "payloads", "stored", "duplicates", "failed", "last_id"])
+
+
+def checkpoint_name(db_path):
+    return f"varac-backfill:{os.path.abspath(db_path)}"
+
+
+def decode_payload(text, unpack_archives=False):
+    # Runs in a worker: returns [(content, extension)] or raises the decode error
+    block = decode_region(text, 0, len(text))
+    if block.error is not None:
+        raise block.error
+    file_format = detect_file_format(block.content)
+    unpacked_files = [(block.content, file_format)]
+    if unpack_archives:
+        unpacked, _ = expand(block.content, file_format)
+        unpacked_files = [(item.content, item.format) for item in unpacked]
+    return [(bytes(content), _extension(content, file_format)) for content, file_format in unpacked_files]
+
+
+def _extension(content, file_format):
+    # Plain text gets .txt like the text files the decoder saves, other unknown content stays .bin
+    if file_format is None:
+        try:
+            content.decode("utf-8")
+            return ".txt"
+        except UnicodeDecodeError:
+            pass
+    return file_extension(file_format)
+
+
+def _decode_task(task):
+    text, unpack_archives = task
+    try:
+        return decode_payload(text, unpack_archives), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def backfill(db_path, store, jobs=None, batch_size=BACKFILL_BATCH_SIZE, unpack_archives=False, restart=False,
+             progress=None, check_cancelled=None):
+    """Decode every payload in the datastream table after the saved checkpoint into store.
+
+    progress(done, total) is called with row counts after every batch.
+    """
+    name = checkpoint_name(db_path)
+    last_id = 0 if restart else store.checkpoint(name)
+    rows = payloads = stored = duplicates = failed = 0
+
+    conn = connect_readonly(db_path)
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=mark_pool_worker)
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM datastream WHERE id > ?", (last_id,)).fetchone()[0]
+        cursor = conn.execute("SELECT id, entry FROM datastream WHERE id > ? ORDER BY id", (last_id,))
+        while True:
+            if check_cancelled:
+                check_cancelled()
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+
+            # Payloads the store already has cost one hash and one lookup, not a decode
+            tasks = []
+            seen = set()
+            for row_id, entry in batch:
+                for start, end in iter_blocks(entry or ""):
+                    payloads += 1
+                    digest = payload_digest(entry, start, end)
+                    if digest in seen or store.lookup_payload(digest):
+                        duplicates += 1
+                        continue
+                    seen.add(digest)
+                    tasks.append((f"VarAC datastream {row_id}", digest, entry[start:end]))
+
+            chunksize = max(1, len(tasks) // ((jobs or os.cpu_count() or 1) * 4))
+            results = executor.map(_decode_task, [(text, unpack_archives) for _, _, text in tasks], chunksize=chunksize)
+            for (source, digest, _), (files, error) in zip(tasks, results):
+                if error is not None:
+                    failed += 1
+                    continue
+                for content, extension in files:
+                    _, created = store.put(content, extension, source, digest)
+                    if created:
+                        stored += 1
+                    else:
+                        duplicates += 1
+
+            # Only a batch that is completely stored moves the checkpoint
+            rows += len(batch)
+            last_id = batch[-1][0]
+            store.save_checkpoint(name, last_id)
+            if progress:
+                progress(rows, total)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        conn.close()
+    return BackfillStats(rows, payloads, stored, duplicates, failed, last_id)
+
+
+def format_backfill_summary(stats):
+    return (
+        f"{stats.rows:,} rows, {stats.payloads:,} payloads: {stats.stored:,} files stored, "
+        f"{stats.duplicates:,} already stored, {stats.failed:,} could not be decoded"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import every payload from a VarAC database into the gopher folder.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help=f"VarAC database (default: {DEFAULT_DB_PATH})")
+    parser.add_argument("--folder", default="gopher_files", help="gopher folder to store the files in (default: gopher_files)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help=f"rows read at a time (default: {BACKFILL_BATCH_SIZE})")
+    parser.add_argument("--unpack", action="store_true", help="store the files inside gzip, bz2, xz and zip payloads")
+    parser.add_argument("--restart", action="store_true", help="start from the first row instead of the saved checkpoint")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.db):
+        print(f"{args.db}: VarAC database not found", file=sys.stderr)
+        return 1
+    store = ContentStore(os.path.abspath(args.folder))
+
+    def report(done, total):
+        print(f"\r{done:,}/{total:,} rows", end="", file=sys.stderr, flush=True)
+
+    try:
+        stats = backfill(args.db, store, args.jobs, args.batch_size, args.unpack, args.restart, progress=report)
+    except KeyboardInterrupt:
+        print(f"\nStopped, the next run continues after row {store.checkpoint(checkpoint_name(args.db))}", file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+    print(file=sys.stderr)
+    print(format_backfill_summary(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
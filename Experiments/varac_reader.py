@@ -0,0 +1,53 @@
+"""Read base64 payloads out of the VarAC datastream table.
+
+VarAC keeps writing to its database while we read it, so every connection
+here is opened read-only through a SQLite URI.
+"""
+
+import os
+import sqlite3
+import urllib.request
+
+# Default path to the VarAC SQLite database
+DEFAULT_DB_PATH = "C:\\VarAC\\VarAC.db"
+
+# Rows fetched per poll, keeps each poll's cost flat however far behind we are
+POLL_BATCH_SIZE = 100
+
+# Earlier entries with payloads searched for repeats of the latest one (see rws_fec.merge_receptions)
+RECEPTION_LOOKBACK = 50
+
+
+def connect_readonly(db_path, check_same_thread=True):
+    uri = "file:{}?mode=ro".format(urllib.request.pathname2url(os.path.abspath(db_path)))
+    return sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+
+
+class DatastreamWatcher:
+    """Remember the last datastream id seen and only fetch rows after it.
+
+    Each poll is an indexed range query on the id, so it costs the same no
+    matter how large the table grows. By default the watcher starts at the
+    newest row and only reports entries received after it was created.
+    """
+
+    def __init__(self, db_path, last_id=None, batch_size=POLL_BATCH_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        # Polls run on worker threads, one at a time
+        self._conn = connect_readonly(db_path, check_same_thread=False)
+        if last_id is None:
+            last_id = self._conn.execute("SELECT MAX(id) FROM datastream").fetchone()[0] or 0
+        self.last_id = last_id
+
+    def poll(self):
+        rows = self._conn.execute(
+            "SELECT id, entry FROM datastream WHERE id > ? ORDER BY id LIMIT ?",
+            (self.last_id, self.batch_size),
+        ).fetchall()
+        if rows:
+            self.last_id = rows[-1][0]
+        return rows
+
+    def close(self):
+        self._conn.close()
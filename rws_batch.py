@@ -0,0 +1,154 @@
+"""Headless batch decoder: decode many base64 payload files without the GUI.
+
+Usage:
+    python rws_batch.py [-o OUTPUT_DIR] [-j JOBS] [--strict] [--unpack] [--codec NAME] [PATH ...]
+
+PATH may be a file or a directory (searched recursively). With no PATH, or
+with "-", the payload is read from stdin. Every -----delimited----- block in
+an input is decoded to its own output file, in the encoding detected for it
+unless --codec names one (see rws_codecs). With --unpack, gzip, bz2, xz and zip
+payloads are written out as the files inside them.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from rws_codecs import CODECS, decode_region
+from rws_decode import iter_payload_regions, map_file
+from rws_detect import detect_file_format, file_extension
+from rws_parallel import mark_pool_worker
+from rws_unpack import expand
+
+
+def collect_inputs(paths):
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                inputs.extend(os.path.join(root, name) for name in sorted(files))
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def write_output(output_dir, stem, extension, content):
+    # Exclusive create so parallel workers never overwrite each other's results
+    counter = 0
+    while True:
+        suffix = f"_{counter}" if counter else ""
+        output_path = os.path.join(output_dir, f"{stem}{suffix}{extension}")
+        try:
+            with open(output_path, "xb") as file:
+                file.write(content)
+            return output_path
+        except FileExistsError:
+            counter += 1
+
+
+def decode_data(data, source, output_dir, strict=False, unpack_archives=False, codec=None):
+    # One result per delimited block, or a single result for an unframed payload
+    results = []
+    stem = os.path.splitext(os.path.basename(source))[0] or "decoded_file"
+    try:
+        blocks = list(iter_payload_regions(data))
+    except ValueError as e:
+        return [{"source": source, "ok": False, "error": str(e)}]
+
+    for index, (start, end) in enumerate(blocks):
+        label = source if len(blocks) == 1 else f"{source}#{index + 1}"
+        try:
+            block = decode_region(data, start, end, strict, codec=codec)
+            if block.error is not None:
+                raise block.error
+            decoded_content = block.content
+            file_format = detect_file_format(decoded_content)
+            if not unpack_archives:
+                output_path = write_output(output_dir, stem, file_extension(file_format), decoded_content)
+                results.append({"source": label, "ok": True, "format": file_format, "size": len(decoded_content), "output": output_path, "codec": block.codec, "corrected": block.corrected})
+                continue
+            unpacked_files, unpack_error = expand(decoded_content, file_format)
+            for unpacked in unpacked_files:
+                member_label = f"{label}/{unpacked.name}" if unpacked.name else label
+                member_stem = os.path.splitext(os.path.basename(unpacked.name))[0] if unpacked.name else stem
+                output_path = write_output(output_dir, member_stem or stem, file_extension(unpacked.format), unpacked.content)
+                result = {"source": member_label, "ok": True, "format": unpacked.format, "size": len(unpacked.content), "output": output_path, "codec": block.codec, "corrected": block.corrected}
+                if unpack_error is not None:
+                    result["warning"] = f"{unpack_error}, kept the compressed file"
+                results.append(result)
+        except (OSError, ValueError) as e:
+            results.append({"source": label, "ok": False, "error": str(e)})
+    return results
+
+
+def decode_file(path, output_dir, strict=False, unpack_archives=False, codec=None):
+    try:
+        # Scan and decode straight from the page cache instead of reading the file in
+        with map_file(path) as data:
+            return decode_data(data, path, output_dir, strict, unpack_archives, codec)
+    except OSError as e:
+        return [{"source": path, "ok": False, "error": str(e)}]
+
+
+def format_summary(result):
+    if result["ok"]:
+        summary = f"{result['source']}: {result['format'] or 'unknown'}, {result['size']} bytes -> {result['output']}"
+        if result.get("codec", "base64") != "base64":
+            summary += f" (from {result['codec']})"
+        if result.get("corrected"):
+            summary += f" (repaired {result['corrected']} damaged bytes)"
+        if "warning" in result:
+            summary += f" ({result['warning']})"
+        return summary
+    return f"{result['source']}: FAILED ({result['error']})"
+
+
+def run_batch(paths, output_dir, jobs=None, strict=False, out=sys.stdout, unpack_archives=False, codec=None):
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+
+    def report(result):
+        results.append(result)
+        print(format_summary(result), file=out, flush=True)
+
+    if not paths or paths == ["-"]:
+        for result in decode_data(sys.stdin.buffer.read(), "stdin", output_dir, strict, unpack_archives, codec):
+            report(result)
+        return results
+
+    inputs = collect_inputs(paths)
+    if jobs == 1 or len(inputs) <= 1:
+        for path in inputs:
+            for result in decode_file(path, output_dir, strict, unpack_archives, codec):
+                report(result)
+    else:
+        # Files are decoded side by side, each on one core
+        with ProcessPoolExecutor(max_workers=jobs, initializer=mark_pool_worker) as executor:
+            futures = [executor.submit(decode_file, path, output_dir, strict, unpack_archives, codec) for path in inputs]
+            for future in as_completed(futures):
+                for result in future.result():
+                    report(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode base64 payload files without the GUI.")
+    parser.add_argument("paths", nargs="*", help="payload files or directories, '-' or nothing for stdin")
+    parser.add_argument("-o", "--output-dir", default="decoded", help="where decoded files are written (default: decoded)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--strict", action="store_true", help="reject non-base64 characters instead of skipping them")
+    parser.add_argument("--unpack", action="store_true", help="write out the files inside gzip, bz2, xz and zip payloads")
+    parser.add_argument("--codec", choices=["auto"] + list(CODECS), default="auto", help="payload encoding (default: detect per block)")
+    args = parser.parse_args(argv)
+
+    codec = None if args.codec == "auto" else args.codec
+    results = run_batch(args.paths, args.output_dir, args.jobs, args.strict, unpack_archives=args.unpack, codec=codec)
+    failed = sum(1 for result in results if not result["ok"])
+    print(f"{len(results) - failed} decoded, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
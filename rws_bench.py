@@ -0,0 +1,349 @@
+"""Benchmarks for the decode and detection pipeline.
+
+Usage:
+    python rws_bench.py [--sizes 1K,64K,1M,16M] [--kinds clean,noisy,...]
+                        [--stages extract,validate,decode,detect,pipeline]
+                        [--repeat 5] [--save-baseline FILE] [--compare FILE]
+
+    python rws_bench.py --startup [--startup-budget 60]
+
+Payloads are generated deterministically, so runs on the same machine are
+comparable. Every (kind, size, stage) case runs in a freshly spawned process
+so its peak RSS is not polluted by the cases before it. --full runs every
+size from 1 KB up to 500 MB.
+
+--startup replays the module-level imports of each GUI script under
+python -X importtime and fails when they take longer than the budget or pull
+in a module that is meant to load on first use.
+"""
+
+import argparse
+import ast
+import base64
+import gc
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows has no getrusage, peak RSS is reported as n/a
+    resource = None
+
+from rws_codecs import decode_blocks
+from rws_decode import is_base64, iter_payload_regions
+from rws_detect import detect_file_format
+
+DEFAULT_SIZES = ["1K", "64K", "1M", "16M"]
+FULL_SIZES = ["1K", "64K", "1M", "16M", "128M", "500M"]
+KINDS = ["clean", "noisy", "delimited", "image", "html", "binary"]
+STAGES = ["extract", "validate", "decode", "detect", "pipeline"]
+
+# Number of -----delimited----- blocks in the "delimited" payload
+DELIMITED_BLOCKS = 8
+
+# GUI scripts whose startup imports are checked by --startup
+STARTUP_SCRIPTS = ["Base64-Decoder.py", os.path.join("Experiments", "gopherandgo_decoder.py")]
+
+# Milliseconds of imports a GUI may spend before its window appears
+STARTUP_BUDGET_MS = 60
+
+# Heavy modules the GUIs import on first use, never at startup
+DEFERRED_MODULES = frozenset([
+    "PIL", "sqlite3", "asyncio", "socketserver", "mimetypes", "tempfile", "webbrowser", "urllib.request", "imghdr",
+    "zipfile", "bz2", "lzma", "rws_unpack",
+    "multiprocessing", "gopher_server", "gopher_store", "varac_reader", "varac_backfill", "rws_encode", "rws_parallel",
+])
+
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def make_payload(kind, size, seed=1234):
+    # Returns the text as the GUI would hold it; size is the decoded payload size
+    rng = random.Random(seed)
+    if kind == "image":
+        raw = b"\x89PNG\r\n\x1a\n" + rng.randbytes(max(0, size - 8))
+    elif kind == "html":
+        body = b"<p>" + bytes(rng.choice(b"abcdefghij klmnop") for _ in range(min(size, 4096))) + b"</p>\n"
+        filler = body * (max(0, size - 40) // len(body) + 1)
+        raw = b"<html><body>\n" + filler[:max(0, size - 28)] + b"</body></html>\n"
+    else:
+        raw = rng.randbytes(size)
+
+    if kind == "noisy":
+        # Line-wrapped base64 with chat-style junk mixed in
+        lines = base64.encodebytes(raw).decode("ascii").splitlines()
+        return "\n".join(f"> {line} ~" for line in lines)
+    if kind == "delimited":
+        step = max(1, -(-size // DELIMITED_BLOCKS))
+        parts = []
+        for index in range(0, len(raw), step):
+            parts.append(f"de N0CALL {index}: -----{base64.b64encode(raw[index:index + step]).decode('ascii')}-----\n")
+        return "".join(parts)
+    return base64.b64encode(raw).decode("ascii")
+
+
+def _decode_all(text):
+    return [block.content for block in decode_blocks(text)]
+
+
+def _stage(stage, text):
+    # Returns (function to time, bytes it processes)
+    if stage == "extract":
+        return lambda: list(iter_payload_regions(text)), len(text)
+    if stage == "validate":
+        return lambda: [is_base64(text[start:end]) for start, end in iter_payload_regions(text)], len(text)
+    if stage == "decode":
+        return lambda: _decode_all(text), len(text)
+    if stage == "detect":
+        decoded = _decode_all(text)
+        return lambda: [detect_file_format(content) for content in decoded], sum(len(content) for content in decoded)
+    if stage == "pipeline":
+        # What compile_base64 does: every block's codec detected, decoded, then sniffed
+        def pipeline():
+            for block in decode_blocks(text):
+                if block.error is None:
+                    detect_file_format(block.content)
+        return pipeline, len(text)
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def _proc_status(field):
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    # Linux can reset the high-water mark, so setup (payload generation) does not mask the stage.
+    # Returns the current RSS to measure from, or None if the reset is not supported.
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        return None
+    return _proc_status("VmRSS")
+
+
+def _peak_rss():
+    peak = _proc_status("VmHWM")
+    if peak is not None or resource is None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(kind, size, stage, repeat, conn):
+    text = make_payload(kind, size)
+    function, processed = _stage(stage, text)
+    gc.collect()
+    rss_before = _reset_peak_rss()
+    if rss_before is None:
+        rss_before = _peak_rss()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    rss_after = _peak_rss()
+    conn.send({
+        "kind": kind,
+        "size": size,
+        "stage": stage,
+        "processed": processed,
+        "timings": timings,
+        "peak_rss_delta": None if rss_before is None else max(0, rss_after - rss_before),
+    })
+    conn.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarise(result):
+    timings = result["timings"]
+    median = statistics.median(timings)
+    return {
+        "p50": median,
+        "p90": percentile(timings, 0.90),
+        "p99": percentile(timings, 0.99),
+        "throughput": result["processed"] / median if median else float("inf"),
+        "peak_rss_delta": result["peak_rss_delta"],
+    }
+
+
+def run_isolated(kind, size, stage, repeat):
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_case, args=(kind, size, stage, repeat, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        raise RuntimeError(f"Benchmark {kind}/{size}/{stage} died with exit code {process.exitcode}")
+    return result
+
+
+def _startup_snippet(script):
+    # The script's module-level imports (and sys.path setup) without building the window
+    with open(script, encoding="utf-8") as file:
+        tree = ast.parse(file.read(), script)
+    statements = [
+        node for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+        or (isinstance(node, ast.Expr) and "sys.path" in ast.unparse(node))
+    ]
+    return f"__file__ = {os.path.abspath(script)!r}\n" + "\n".join(ast.unparse(node) for node in statements)
+
+
+def _import_times(code, cwd):
+    # Returns [(module, self_us, cumulative_us, depth)] as reported by -X importtime
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=cwd, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def measure_startup(script):
+    # Returns (milliseconds spent in the script's own imports, top-level modules by cost, deferred modules loaded)
+    cwd = os.path.dirname(os.path.abspath(script))
+    interpreter = {name for name, _, _, _ in _import_times("pass", cwd)}
+    entries = [entry for entry in _import_times(_startup_snippet(script), cwd) if entry[0] not in interpreter]
+    top_level = sorted(((name, cumulative) for name, _, cumulative, depth in entries if depth == 0),
+                       key=lambda item: item[1], reverse=True)
+    total_ms = sum(cumulative for _, cumulative in top_level) / 1000
+    deferred = sorted({name for name, _, _, _ in entries if name in DEFERRED_MODULES or name.split(".")[0] in DEFERRED_MODULES})
+    return total_ms, top_level, deferred
+
+
+def check_startup(budget_ms):
+    # Prints each GUI's import cost and returns the number of scripts over budget
+    root = os.path.dirname(os.path.abspath(__file__))
+    failures = 0
+    for script in STARTUP_SCRIPTS:
+        try:
+            total_ms, top_level, deferred = measure_startup(os.path.join(root, script))
+        except RuntimeError as e:
+            print(f"{script:<40} failed to import: {e}")
+            failures += 1
+            continue
+        status = "ok" if total_ms <= budget_ms and not deferred else "OVER BUDGET"
+        print(f"{script:<40} {total_ms:>8.1f} ms  (budget {budget_ms} ms)  {status}")
+        for name, cumulative in top_level[:5]:
+            print(f"    {name:<36} {cumulative / 1000:>8.1f} ms")
+        for name in deferred:
+            print(f"    {name} is imported at startup, it should load on first use")
+        if status != "ok":
+            failures += 1
+    return failures
+
+
+def case_key(kind, size, stage):
+    return f"{kind}/{size}/{stage}"
+
+
+def format_row(key, summary):
+    rss = summary["peak_rss_delta"]
+    rss_text = "n/a" if rss is None else f"{rss / 1024 ** 2:.1f}"
+    return (f"{key:<28} {summary['p50'] * 1000:>10.3f} {summary['p90'] * 1000:>10.3f} {summary['p99'] * 1000:>10.3f} "
+            f"{summary['throughput'] / 1024 ** 2:>10.1f} {rss_text:>10}")
+
+
+def compare(results, baseline, threshold):
+    # Returns the cases that got slower (p50) or hungrier (peak RSS) than the baseline allows
+    regressions = []
+    for key, summary in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        if summary["p50"] > previous["p50"] * (1 + threshold):
+            regressions.append(f"{key}: p50 {previous['p50'] * 1000:.3f} ms -> {summary['p50'] * 1000:.3f} ms")
+        old_rss, new_rss = previous.get("peak_rss_delta"), summary["peak_rss_delta"]
+        if old_rss is not None and new_rss is not None and new_rss > old_rss * (1 + threshold) + 1024 ** 2:
+            regressions.append(f"{key}: peak RSS {old_rss / 1024 ** 2:.1f} MB -> {new_rss / 1024 ** 2:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the base64 decode and detection pipeline.")
+    parser.add_argument("--sizes", default=",".join(DEFAULT_SIZES), help="decoded payload sizes, e.g. 1K,1M,500M")
+    parser.add_argument("--full", action="store_true", help="run every size from 1K to 500M")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="payload kinds: " + ",".join(KINDS))
+    parser.add_argument("--stages", default=",".join(STAGES), help="pipeline stages: " + ",".join(STAGES))
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case (default: 5)")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the results to FILE as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline, exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before a regression (default: 0.10)")
+    parser.add_argument("--startup", action="store_true", help="check the GUI startup imports against the budget instead")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET_MS, metavar="MS",
+                        help=f"startup import budget per GUI in milliseconds (default: {STARTUP_BUDGET_MS})")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        return 1 if check_startup(args.startup_budget) else 0
+
+    sizes = FULL_SIZES if args.full else [size for size in args.sizes.split(",") if size]
+    kinds = [kind for kind in args.kinds.split(",") if kind]
+    stages = [stage for stage in args.stages.split(",") if stage]
+
+    print(f"{'case':<28} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'MB/s':>10} {'peak MB':>10}")
+    results = {}
+    for size in sizes:
+        for kind in kinds:
+            for stage in stages:
+                key = case_key(kind, size, stage)
+                summary = summarise(run_isolated(kind, parse_size(size), stage, args.repeat))
+                results[key] = summary
+                print(format_row(key, summary), flush=True)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        print(f"{len(regressions)} regression(s) against {args.compare}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
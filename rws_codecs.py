@@ -0,0 +1,465 @@
+"""Registry of the text encodings a payload can arrive in.
+
+Base64 is still the default, but senders on slow links also use base64url,
+base32, base85 (RFC 1924, as in base64.b85encode), Ascii85 (<~ ... ~>) and
+uuencode. Every codec streams its input in CHUNK_SIZE pieces like the base64
+decoder does, and uses the stdlib routine for the heavy lifting: binascii
+for base64, base64url and uuencode, the base64 module for the others.
+
+detect_codec() looks at the framing and the alphabet of the first few KB of
+a payload region. The codecs are tried in registration order, and base64,
+which skips anything outside its alphabet, is the fallback when none of them
+matches. A codec whose alphabet is a subset of base64's (base32) also has to
+fit the whole region, since a sample that only uses shared characters proves
+nothing.
+"""
+
+import base64
+import binascii
+import re
+import time
+from collections import namedtuple
+from functools import partial
+
+from rws_decode import (Base64DecodeError, DecodedBlock, StreamingBase64Decoder, decode_base64, iter_chunks,
+                        iter_payload_regions, observe_stages)
+from rws_fec import FecError, is_protected, repair
+from rws_metrics import METRICS
+
+# Characters of a region that detect_codec() looks at
+DETECT_WINDOW = 4 * 1024
+
+# What detect_codec() returns when no other codec matches
+FALLBACK_CODEC = "base64"
+
+# Below this share of characters outside the base64 alphabet a payload is noisy base64, not base85
+BASE85_MIN_FOREIGN = 0.10
+
+# Share of characters outside a codec's alphabet that detection still takes for line noise
+DETECT_NOISE = 0.02
+
+# Shorter regions are too little evidence for base85, they stay base64
+BASE85_MIN_LENGTH = 16
+
+# Characters of a region decoded up front to look for an error correction header (see rws_fec)
+FEC_PEEK = 512
+
+BASE64_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=")
+BASE64URL_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+BASE32_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ234567=")
+BASE85_CHARS = frozenset("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz!#$%&()*+-;<=>?@^_`{|}~")
+ASCII85_CHARS = frozenset(chr(c) for c in range(ord("!"), ord("u") + 1)) | {"z"}
+
+_UU_BEGIN = re.compile(r"begin [0-7]{3,4} ")
+
+# decode(data, start, end, strict, progress) -> bytearray; detect(sample, chars) -> bool;
+# encode(data) -> ASCII bytes that decode() and detect() recognise, or None for decode-only codecs;
+# placeholder is the character decode(..., placeholder=...) substitutes for garbled ones, or None
+# for codecs that cannot keep their alignment (those payloads are never error corrected);
+# confirm(data, start, end) -> bool checks the whole region once detect() matched the sample.
+# detect is None for the fallback codec, which detection never picks by itself.
+Codec = namedtuple("Codec", ["name", "decode", "detect", "encode", "placeholder", "confirm"], defaults=[None, None, None])
+
+CODECS = {}
+
+
+def register_codec(codec):
+    # Later registrations are tried after the earlier ones; registering a name again replaces it
+    CODECS[codec.name] = codec
+    return codec
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec: {name}") from None
+
+
+def _sample(data, start, end):
+    sample = data[start:min(end, start + DETECT_WINDOW)]
+    return sample if isinstance(sample, str) else bytes(sample).decode("latin-1")
+
+
+def _run_end(data, start, end, char):
+    # Where a leading run of char (line breaks allowed) ends
+    strip = char + " \t\r\n\v\f"
+    position = start
+    for chunk in iter_chunks(data, start, end):
+        text = chunk if isinstance(chunk, str) else bytes(chunk).decode("latin-1")
+        rest = text.lstrip(strip)
+        position += len(text) - len(rest)
+        if rest:
+            break
+    return position
+
+
+def detect_codec(data, start=0, end=None):
+    if end is None:
+        end = len(data)
+    sample = _sample(data, start, end)
+    chars = set(sample.translate(_WHITESPACE_TABLE))
+    if len(chars) == 1 and end - start > len(sample):
+        # Zero bytes encode to one repeated character in every codec ("A" in base64, "0" in
+        # base85), so a payload that opens with many of them is judged on what follows the run
+        position = _run_end(data, start, end, chars.pop())
+        sample = _sample(data, position, end)
+        chars = set(sample.translate(_WHITESPACE_TABLE))
+    for codec in CODECS.values():
+        if codec.detect is None:
+            continue
+        if codec.detect(sample, chars) and (codec.confirm is None or codec.confirm(data, start, end)):
+            return codec
+    return CODECS[FALLBACK_CODEC]
+
+
+def _stream(decoder, data, start, end, progress):
+    done = 0
+    for chunk in iter_chunks(data, start, end):
+        decoder.feed(chunk)
+        if progress:
+            done += len(chunk)
+            progress(done, end - start)
+    decoded = decoder.finish()
+    observe_stages(decoder)
+    return decoded
+
+
+def _ascii(chunk, strict, name, offset, keep_positions=False):
+    # Non-ASCII characters are never part of an encoding: dropped, or an error when strict
+    if not isinstance(chunk, str):
+        return bytes(chunk)
+    try:
+        return chunk.encode("ascii", "strict" if strict else "replace" if keep_positions else "ignore")
+    except UnicodeEncodeError as e:
+        raise Base64DecodeError(f"Invalid {name} character", offset + e.start) from None
+
+
+class GroupDecoder:
+    """Decode an encoding made of fixed-size character groups as the input arrives.
+
+    Subclasses set ALPHABET, GROUP (characters per group), GROUP_BYTES and
+    DECODE (the stdlib routine for a run of groups); whole groups are decoded
+    per chunk and the remainder is carried over, the last partial group is
+    decoded by finish(). With a placeholder, characters outside the alphabet
+    (and PADDING) are replaced by it instead of dropped.
+    """
+
+    NAME = ""
+    ALPHABET = frozenset()
+    PADDING = b""
+    GROUP = 1
+    GROUP_BYTES = 1
+
+    def __init__(self, strict=False, base_offset=0, placeholder=None):
+        self.strict = strict
+        self.placeholder = placeholder
+        self.output = bytearray()
+        self._offset = base_offset
+        self._carry = b""
+        alphabet = "".join(sorted(self.ALPHABET)).encode("ascii")
+        self._junk = bytes(b for b in range(256) if b not in alphabet)
+        self._invalid = re.compile(b"[^" + re.escape(alphabet) + rb"\s]")
+        self._substitute = None
+        if placeholder:
+            garbled = bytes(b for b in range(256) if b not in alphabet or b in self.PADDING)
+            self._substitute = bytes.maketrans(garbled, placeholder * len(garbled))
+        # Same stage timers as StreamingBase64Decoder, only tracked while metrics are enabled
+        self.clean_seconds = 0.0 if METRICS.enabled else None
+        self.validate_seconds = 0.0 if METRICS.enabled else None
+
+    def prepare(self, cleaned):
+        # Hook for shorthand characters that expand before grouping
+        return cleaned
+
+    def feed(self, chunk):
+        if not chunk:
+            return
+        raw = _ascii(chunk, self.strict, self.NAME, self._offset, self._substitute is not None)
+        if self.strict and not self._substitute:
+            self._check(raw)
+        if self.clean_seconds is None:
+            cleaned = self._clean(raw)
+        else:
+            started = time.perf_counter()
+            cleaned = self._clean(raw)
+            self.clean_seconds += time.perf_counter() - started
+        buffered = self._carry + self.prepare(cleaned)
+        whole = len(buffered) - len(buffered) % self.GROUP
+        if whole:
+            self._decode(buffered[:whole])
+        self._carry = buffered[whole:]
+        self._offset += len(chunk)
+
+    def _clean(self, raw):
+        if self._substitute:
+            return raw.translate(self._substitute, b" \t\r\n\v\f")
+        return raw.translate(None, self._junk)
+
+    def _check(self, raw):
+        if self.validate_seconds is None:
+            match = self._invalid.search(raw)
+        else:
+            started = time.perf_counter()
+            match = self._invalid.search(raw)
+            self.validate_seconds += time.perf_counter() - started
+        if match:
+            raise Base64DecodeError(f"Invalid {self.NAME} character", self._offset + match.start())
+
+    def finish(self):
+        if self._carry:
+            self._decode(self._carry)
+            self._carry = b""
+        return self.output
+
+    def _decode(self, data):
+        try:
+            self.output += self.DECODE(data)
+        except (binascii.Error, ValueError) as e:
+            if not self._substitute:
+                raise Base64DecodeError(f"Invalid {self.NAME} data ({e})", self._offset) from None
+            self._decode_each(data)
+
+    def _decode_each(self, data):
+        # A garbled group decodes to zero bytes so the ones after it stay where they belong;
+        # a garbled partial group at the end is left for the error correction to fill in
+        for position in range(0, len(data), self.GROUP):
+            group = data[position:position + self.GROUP]
+            try:
+                self.output += self.DECODE(group)
+            except (binascii.Error, ValueError):
+                if len(group) == self.GROUP:
+                    self.output += bytes(self.GROUP_BYTES)
+
+
+def _b32decode_unpadded(data):
+    if len(data) % 8:
+        # An unpadded last group
+        data += b"=" * (8 - len(data) % 8)
+    return base64.b32decode(data)
+
+
+class Base32Decoder(GroupDecoder):
+    NAME = "base32"
+    ALPHABET = BASE32_CHARS
+    PADDING = b"="
+    GROUP = 8
+    GROUP_BYTES = 5
+    DECODE = staticmethod(_b32decode_unpadded)
+
+
+class Base85Decoder(GroupDecoder):
+    NAME = "base85"
+    ALPHABET = BASE85_CHARS
+    GROUP = 5
+    GROUP_BYTES = 4
+    DECODE = staticmethod(base64.b85decode)
+
+
+class Ascii85Decoder(GroupDecoder):
+    NAME = "Ascii85"
+    ALPHABET = ASCII85_CHARS
+    GROUP = 5
+    GROUP_BYTES = 4
+    DECODE = staticmethod(base64.a85decode)
+
+    def prepare(self, cleaned):
+        # "z" stands for a whole group of zero bytes
+        return cleaned.replace(b"z", b"!!!!!")
+
+
+class UudecodeDecoder:
+    """Decode uuencoded lines between the "begin" and "end" lines as they arrive."""
+
+    def __init__(self, strict=False, base_offset=0):
+        self.strict = strict
+        self.output = bytearray()
+        self._offset = base_offset
+        self._line = b""
+        self._state = "header"
+        # binascii.a2b_uu() cleans and validates each line as it decodes it
+        self.clean_seconds = self.validate_seconds = None
+
+    def feed(self, chunk):
+        if not chunk:
+            return
+        raw = _ascii(chunk, self.strict, "uuencode", self._offset)
+        lines = (self._line + raw).split(b"\n")
+        self._line = lines.pop()
+        for line in lines:
+            self._feed_line(line.rstrip(b"\r"))
+            self._offset += len(line) + 1
+
+    def finish(self):
+        if self._line:
+            self._feed_line(self._line.rstrip(b"\r"))
+            self._line = b""
+        if self._state == "header":
+            raise Base64DecodeError("No uuencode begin line", self._offset)
+        if self._state == "data" and self.strict:
+            raise Base64DecodeError("Missing uuencode end line", self._offset)
+        return self.output
+
+    def _feed_line(self, line):
+        if self._state == "header":
+            if line.startswith(b"begin "):
+                self._state = "data"
+        elif self._state == "data":
+            if line.strip() == b"end":
+                self._state = "end"
+            elif line.strip():
+                try:
+                    self.output += binascii.a2b_uu(line)
+                except binascii.Error:
+                    if self.strict:
+                        raise Base64DecodeError("Invalid uuencode line", self._offset) from None
+                    # Some encoders pad lines with junk, trust the length byte (as the uu module did)
+                    length = (((line[0] - 32) & 63) * 4 + 5) // 3
+                    self.output += binascii.a2b_uu(line[:length])
+
+
+def _decode_streaming(decoder_class, data, start, end, strict=False, progress=None, **options):
+    return _stream(decoder_class(strict=strict, base_offset=start, **options), data, start, end, progress)
+
+
+def _decode_base64url(data, start, end, strict=False, progress=None, placeholder=None):
+    decoder = StreamingBase64Decoder(strict=strict, base_offset=start, altchars=b"-_", padded=False, placeholder=placeholder)
+    return _stream(decoder, data, start, end, progress)
+
+
+def _decode_ascii85(data, start, end, strict=False, progress=None):
+    # Only what is inside the <~ ~> framing is data
+    opening, closing = ("<~", "~>") if isinstance(data, str) else (b"<~", b"~>")
+    position = data.find(opening, start, end)
+    if position >= 0:
+        start = position + len(opening)
+    position = data.rfind(closing, start, end)
+    if position >= 0:
+        end = position
+    return _decode_streaming(Ascii85Decoder, data, start, end, strict, progress)
+
+
+def _detect_ascii85(sample, chars):
+    return sample.lstrip().startswith("<~")
+
+
+def _detect_uuencode(sample, chars):
+    return _UU_BEGIN.match(sample.lstrip()) is not None
+
+
+_FOREIGN_TABLES = {}
+_WHITESPACE_TABLE = str.maketrans("", "", " \t\r\n\v\f")
+
+
+def _foreign(sample, alphabet):
+    # Characters of sample outside alphabet and whitespace, counted by str.translate
+    table = _FOREIGN_TABLES.get(alphabet)
+    if table is None:
+        table = _FOREIGN_TABLES[alphabet] = str.maketrans("", "", "".join(alphabet) + " \t\r\n\v\f")
+    return len(sample.translate(table))
+
+
+def _mostly(sample, chars, alphabet):
+    # A few garbled characters must not send a payload to the wrong codec
+    return bool(chars) and (chars <= alphabet or _foreign(sample, alphabet) <= DETECT_NOISE * len(sample))
+
+
+def _detect_base32(sample, chars):
+    return len(sample) >= 8 and _mostly(sample, chars, BASE32_CHARS)
+
+
+def _confirm_base32(data, start, end):
+    # Base64 that opens with zero bytes (silence, sparse files) starts with a run of "A" that reads
+    # as base32, so the whole region has to be base32: next to no other characters, "=" only at
+    # the end, and a length base32 can have. Those are the only ways b32decode() can fail on
+    # cleaned input, so this says what a trial decode would without decoding twice.
+    chars = pads = foreign = 0
+    for chunk in iter_chunks(data, start, end):
+        text = (chunk if isinstance(chunk, str) else bytes(chunk).decode("latin-1")).translate(_WHITESPACE_TABLE)
+        body = text.rstrip("=")
+        if "=" in body or (pads and body):
+            return False
+        pads += len(text) - len(body)
+        chars += len(text)
+        foreign += _foreign(text, BASE32_CHARS)
+    if foreign > DETECT_NOISE * chars:
+        return False
+    if pads:
+        return chars % 8 == 0 and pads in (1, 3, 4, 6)
+    return chars % 8 in (0, 2, 4, 5, 7)
+
+
+def _detect_base64url(sample, chars):
+    if not chars & {"-", "_"} or not _mostly(sample, chars, BASE64URL_CHARS):
+        return False
+    # Noisy base64 can pick up a stray "-" or "_" too, so base64url has to outnumber "+/"
+    return chars <= BASE64URL_CHARS or sample.count("-") + sample.count("_") > sample.count("+") + sample.count("/")
+
+
+def _detect_base85(sample, chars):
+    if len(sample) < BASE85_MIN_LENGTH or not _mostly(sample, chars, BASE85_CHARS):
+        return False
+    return _foreign(sample, BASE64_CHARS) >= BASE85_MIN_FOREIGN * len(sample)
+
+
+def _encode_uuencode(data):
+    lines = [b"begin 644 payload\n"]
+    lines.extend(binascii.b2a_uu(data[position:position + 45]) for position in range(0, len(data), 45))
+    lines.append(b"`\nend\n")
+    return b"".join(lines)
+
+
+# Ascii85 has no placeholder: a character garbled into "z" expands to five and shifts the rest
+register_codec(Codec("Ascii85", _decode_ascii85, _detect_ascii85, partial(base64.a85encode, adobe=True)))
+register_codec(Codec("uuencode", partial(_decode_streaming, UudecodeDecoder), _detect_uuencode, _encode_uuencode))
+register_codec(Codec("base32", partial(_decode_streaming, Base32Decoder), _detect_base32, base64.b32encode, b"A", _confirm_base32))
+register_codec(Codec("base64url", _decode_base64url, _detect_base64url, lambda data: base64.urlsafe_b64encode(data).rstrip(b"="), b"A"))
+register_codec(Codec("base85", partial(_decode_streaming, Base85Decoder), _detect_base85, base64.b85encode, b"0"))
+register_codec(Codec("base64", decode_base64, None, base64.b64encode, b"A"))
+
+
+def decode_region(data, start, end, strict=False, progress=None, codec=None):
+    # Decode one payload region in the given codec (name) or the one detected for it; a bad block
+    # is reported in the result, not raised. progress gets (position in data, len(data)).
+    codec = get_codec(codec) if codec else detect_codec(data, start, end)
+    region_progress = None
+    if progress:
+        total = len(data)
+        region_progress = lambda done, _: progress(start + done, total)
+    protected = not strict and _is_protected_region(codec, data, start, end)
+    corrected = 0
+    try:
+        with METRICS.timer("stage_seconds", stage="decode"):
+            if protected:
+                # Garbled characters become placeholders so the error correction can find them
+                content = codec.decode(data, start, end, strict, region_progress, placeholder=codec.placeholder)
+            else:
+                content = codec.decode(data, start, end, strict, region_progress)
+        if protected:
+            content, corrected = repair(content)
+            METRICS.count("corrected_bytes_total", corrected)
+    except (binascii.Error, FecError) as e:
+        METRICS.count("decode_outcomes_total", outcome="error", codec=codec.name)
+        return DecodedBlock(start, end, None, e, codec.name)
+    METRICS.count("decode_outcomes_total", outcome="repaired" if corrected else "ok", codec=codec.name)
+    METRICS.count("decoded_bytes_total", len(content))
+    return DecodedBlock(start, end, content, None, codec.name, corrected)
+
+
+def _is_protected_region(codec, data, start, end):
+    # Only the first few hundred characters are decoded to look for the header
+    if codec.placeholder is None:
+        return False
+    try:
+        head = codec.decode(data, start, min(end, start + FEC_PEEK), placeholder=codec.placeholder)
+    except binascii.Error:
+        return False
+    return is_protected(head)
+
+
+def decode_blocks(data, strict=False, progress=None, codec=None):
+    # Decode every payload region one at a time, each in its own detected codec
+    with METRICS.timer("stage_seconds", stage="extract"):
+        regions = list(iter_payload_regions(data))
+    for start, end in regions:
+        yield decode_region(data, start, end, strict, progress, codec)
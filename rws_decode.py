@@ -0,0 +1,322 @@
+"""Shared decode pipeline used by the Base64 Decoder tools."""
+
+import binascii
+import mmap
+import os
+import re
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from rws_metrics import METRICS
+
+# Size of the raw input slices fed to the decoder (characters or bytes)
+CHUNK_SIZE = 64 * 1024
+
+# Characters of a payload file shown in the GUIs instead of the whole file
+PREVIEW_SIZE = 4 * 1024
+
+# Base64 regions at least this long are decoded on every core (see rws_parallel)
+PARALLEL_THRESHOLD = 64 * 1024 * 1024
+
+BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+# Everything that is not part of the alphabet or padding gets dropped by the cleaner
+_JUNK_BYTES = bytes(b for b in range(256) if b not in BASE64_ALPHABET + b"=")
+_INVALID_STR = re.compile(r"[^A-Za-z0-9+/=\s]")
+_INVALID_BYTES = re.compile(rb"[^A-Za-z0-9+/=\s]")
+_ALPHABET_STR = re.compile(r"[A-Za-z0-9+/=]")
+_ALPHABET_BYTES = re.compile(rb"[A-Za-z0-9+/=]")
+_WHITESPACE_BYTES = b" \t\r\n\v\f"
+
+
+class Base64DecodeError(binascii.Error):
+    def __init__(self, message, offset):
+        super().__init__(f"{message} at offset {offset}")
+        self.offset = offset
+
+
+class PayloadNotFoundError(ValueError):
+    pass
+
+
+class StreamingBase64Decoder:
+    """Clean, validate and decode base64 incrementally into one output buffer.
+
+    Feed it str or bytes chunks of any size; only whole 4-character quanta are
+    decoded, the 0-3 leftover characters are carried into the next chunk.
+    Offsets in errors are positions in the raw input that was fed in.
+    Outside strict mode padding is handled like base64.b64decode: stray "="
+    is skipped and whatever follows completed padding is ignored.
+    """
+
+    def __init__(self, strict=False, base_offset=0, altchars=None, padded=True, placeholder=None):
+        # altchars replace "+/" (b"-_" for base64url); padded=False accepts input without "=" padding.
+        # placeholder (b"A") stands in for every character outside the alphabet, padding included,
+        # so a garbled character costs one byte instead of shifting everything after it.
+        self.strict = strict
+        self.padded = padded and placeholder is None
+        self._substitute = None
+        if placeholder:
+            self._substitute = bytes.maketrans(_JUNK_BYTES + b"=", placeholder * (len(_JUNK_BYTES) + 1))
+        self._altchars = None
+        if altchars:
+            self._altchars = (str.maketrans(altchars.decode("ascii"), "+/"), bytes.maketrans(altchars, b"+/"))
+        self.output = bytearray()
+        self._offset = base_offset
+        self._carry = b""
+        self._pad_needed = 0
+        self._pad_seen = 0
+        self._pending_pads = 0
+        self._finished = False
+        # Time spent cleaning and, in strict mode, validating; only tracked while metrics are enabled
+        self.clean_seconds = 0.0 if METRICS.enabled else None
+        self.validate_seconds = 0.0 if METRICS.enabled else None
+
+    def feed(self, chunk):
+        if not chunk:
+            return
+        if self._finished:
+            # Outside strict mode everything after completed padding is ignored
+            self._offset += len(chunk)
+            return
+        if self.clean_seconds is None:
+            cleaned = self._clean(chunk)
+        else:
+            started = time.perf_counter()
+            validated = self.validate_seconds
+            cleaned = self._clean(chunk)
+            # The strict character check inside _clean() is counted as validation
+            self.clean_seconds += time.perf_counter() - started - (self.validate_seconds - validated)
+
+        if not self.strict:
+            self._feed_lenient(cleaned)
+        elif self._pad_seen:
+            # The padding went on into this chunk
+            self._check_padding(chunk, cleaned, 0)
+        else:
+            pad_index = cleaned.find(b"=")
+            self._decode_data(cleaned if pad_index < 0 else cleaned[:pad_index])
+            if pad_index >= 0:
+                self._pad_needed = (4 - len(self._carry)) % 4
+                if self._pad_needed not in (1, 2):
+                    self._fail("Unexpected padding", chunk, pad_index)
+                self._check_padding(chunk, cleaned, pad_index)
+
+        self._offset += len(chunk)
+
+    def _check_padding(self, chunk, cleaned, pad_index):
+        # Strict mode: exactly the "=" the last quantum needs, and nothing after them
+        pads = cleaned[pad_index:]
+        extra = pads.lstrip(b"=")
+        count = len(pads) - len(extra)
+        if self._pad_seen + count > self._pad_needed:
+            self._fail("Excess padding", chunk, pad_index + self._pad_needed - self._pad_seen)
+        if extra:
+            self._fail("Data after padding", chunk, len(cleaned) - len(extra))
+        self._pad_seen += count
+
+    def _feed_lenient(self, cleaned):
+        # Same rules as base64.b64decode without validate: "=" only counts once two or three
+        # characters of a quantum are in, and padding that completes the quantum ends the data
+        while True:
+            pad_index = cleaned.find(b"=")
+            data = cleaned if pad_index < 0 else cleaned[:pad_index]
+            if data:
+                self._pending_pads = 0
+                self._decode_data(data)
+            if pad_index < 0:
+                return
+            pads = cleaned[pad_index:]
+            cleaned = pads.lstrip(b"=")
+            if len(self._carry) >= 2:
+                self._pending_pads += len(pads) - len(cleaned)
+                if len(self._carry) + self._pending_pads >= 4:
+                    self._pad_seen = self._pad_needed = 4 - len(self._carry)
+                    self._finished = True
+                    return
+
+    def _decode_data(self, data):
+        # Decode the whole quanta, carry the 0-3 leftover characters
+        buffered = self._carry + data
+        whole = len(buffered) - len(buffered) % 4
+        if whole:
+            self.output += binascii.a2b_base64(memoryview(buffered)[:whole])
+        self._carry = buffered[whole:]
+
+    def finish(self):
+        if self._substitute and len(self._carry) == 1:
+            # A stray character left over from substitution carries no whole byte
+            self._carry = b""
+        if not self.padded and not self._pad_seen and len(self._carry) in (2, 3):
+            self._pad_seen = self._pad_needed = 4 - len(self._carry)
+        if self._pad_seen:
+            if self._pad_seen < self._pad_needed:
+                raise Base64DecodeError("Incorrect padding", self._offset)
+            self.output += binascii.a2b_base64(self._carry + b"=" * self._pad_needed)
+        elif self._carry:
+            if len(self._carry) == 1:
+                raise Base64DecodeError("Truncated base64 data", self._offset)
+            raise Base64DecodeError("Incorrect padding", self._offset)
+        self._carry = b""
+        return self.output
+
+    def _clean(self, chunk):
+        if self._altchars:
+            chunk = chunk.translate(self._altchars[0] if isinstance(chunk, str) else self._altchars[1])
+        if self._substitute:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("ascii", "replace")
+            return bytes(chunk).translate(self._substitute, _WHITESPACE_BYTES)
+        if self.strict:
+            self._check(chunk)
+        if isinstance(chunk, str):
+            chunk = chunk.encode("ascii", "ignore")
+        return bytes(chunk).translate(None, _JUNK_BYTES)
+
+    def _check(self, chunk):
+        # Strict mode: anything but the alphabet, padding and whitespace is an error
+        pattern = _INVALID_STR if isinstance(chunk, str) else _INVALID_BYTES
+        if self.validate_seconds is None:
+            match = pattern.search(chunk)
+        else:
+            started = time.perf_counter()
+            match = pattern.search(chunk)
+            self.validate_seconds += time.perf_counter() - started
+        if match:
+            raise Base64DecodeError("Invalid base64 character", self._offset + match.start())
+
+    def _raw_offset(self, chunk, cleaned_index):
+        # Map an index in the cleaned chunk back to the raw input (error path only)
+        pattern = _ALPHABET_STR if isinstance(chunk, str) else _ALPHABET_BYTES
+        for position, match in enumerate(pattern.finditer(chunk)):
+            if position == cleaned_index:
+                return self._offset + match.start()
+        return self._offset + len(chunk)
+
+    def _fail(self, message, chunk, cleaned_index):
+        raise Base64DecodeError(message, self._raw_offset(chunk, cleaned_index))
+
+
+def iter_chunks(data, start=0, end=None, chunk_size=CHUNK_SIZE):
+    # Slice a str/bytes region lazily so the whole region is never copied at once
+    if end is None:
+        end = len(data)
+    for position in range(start, end, chunk_size):
+        yield data[position:min(position + chunk_size, end)]
+
+
+def decode_base64(data, start=0, end=None, strict=False, progress=None, placeholder=None):
+    # progress(done, total) is called after every chunk; raising from it aborts the decode
+    if end is None:
+        end = len(data)
+    if end - start >= PARALLEL_THRESHOLD and placeholder is None:
+        from rws_parallel import decode_base64_parallel
+        decoded = decode_base64_parallel(data, start, end, strict, progress)
+        if decoded is not None:
+            return decoded
+    decoder = StreamingBase64Decoder(strict=strict, base_offset=start, placeholder=placeholder)
+    done = 0
+    for chunk in iter_chunks(data, start, end):
+        decoder.feed(chunk)
+        if progress:
+            done += len(chunk)
+            progress(done, end - start)
+    decoded = decoder.finish()
+    observe_stages(decoder)
+    return decoded
+
+
+def observe_stages(decoder):
+    # Report the clean and validate time a decoder collected while metrics were enabled;
+    # only strict mode validates anything
+    if decoder.clean_seconds is None:
+        return
+    METRICS.observe("stage_seconds", decoder.clean_seconds, stage="clean")
+    if decoder.strict:
+        METRICS.observe("stage_seconds", decoder.validate_seconds, stage="validate")
+
+
+def iter_blocks(data, start=0):
+    # Yield the (start, end) of every -----delimited----- block in one linear scan,
+    # pairing delimiters the same way re.findall(r'-----(.*?)-----') does.
+    # Works on str, bytes and mmap without copying the blocks out.
+    marker = "-----" if isinstance(data, str) else b"-----"
+    position = start
+    while True:
+        opening = data.find(marker, position)
+        if opening < 0:
+            return
+        block_start = opening + len(marker)
+        block_end = data.find(marker, block_start)
+        if block_end < 0:
+            return
+        yield block_start, block_end
+        position = block_end + len(marker)
+
+
+def iter_payload_regions(data):
+    # Every delimited block, or the whole input when it has no framing at all
+    marker = "-----" if isinstance(data, str) else b"-----"
+    found = False
+    for region in iter_blocks(data):
+        found = True
+        yield region
+    if not found:
+        if data.find(marker) >= 0:
+            raise PayloadNotFoundError("No valid base64 code found between the dashes")
+        yield 0, len(data)
+
+
+# codec is the name of the encoding the block was decoded from (see rws_codecs),
+# corrected the number of bytes error correction repaired (see rws_fec)
+DecodedBlock = namedtuple("DecodedBlock", ["start", "end", "content", "error", "codec", "corrected"], defaults=["base64", 0])
+
+
+def is_base64(s):
+    try:
+        decode_base64(s)
+        return True
+    except binascii.Error:
+        return False
+
+
+@contextmanager
+def map_file(path):
+    # Read-only view of a payload file straight from the page cache, b"" for an empty file.
+    # Everything above works on it as on bytes, without reading the file into memory.
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+FileSummary = namedtuple("FileSummary", ["path", "size", "blocks", "payload_chars", "preview"])
+
+
+def summarize_file(path, preview_size=PREVIEW_SIZE):
+    # Size, delimited block count and the first preview_size characters of a payload file;
+    # blocks is 0 when the file has no framing and is decoded as a whole
+    with map_file(path) as data:
+        regions = list(iter_blocks(data))
+        payload_chars = sum(end - start for start, end in regions) if regions else len(data)
+        preview = bytes(data[:preview_size]).decode("ascii", "replace")
+        return FileSummary(path, len(data), len(regions), payload_chars, preview)
+
+
+def format_file_summary(summary):
+    # What the GUIs show in place of the file contents
+    if summary.blocks:
+        framing = f"{summary.blocks} delimited block(s)"
+    else:
+        framing = "no ----- framing, the whole file is decoded"
+    text = (
+        f"File: {summary.path}\n"
+        f"Size: {summary.size:,} bytes, {framing}, about {summary.payload_chars * 3 // 4:,} bytes once decoded\n\n"
+        f"{summary.preview}"
+    )
+    if summary.size > len(summary.preview):
+        text += "\n\n[Preview truncated, the whole file is decoded straight from disk]"
+    return text
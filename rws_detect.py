@@ -0,0 +1,199 @@
+"""File format detection shared by the GUI and the batch decoder.
+
+Detection only ever looks at a bounded head and tail window of the decoded
+buffer, so sniffing a 500 MB payload costs the same as sniffing 1 KB. The
+signature table is compiled once into a dict keyed by the leading byte.
+"""
+
+import codecs
+import struct
+
+from rws_metrics import METRICS
+
+# Bytes of the payload that the sniffer is allowed to look at
+HEAD_WINDOW = 8 * 1024
+TAIL_WINDOW = 64 * 1024 + 22  # Largest possible ZIP end-of-central-directory record
+
+# Image formats (same names imghdr used to report)
+IMAGE_FORMATS = frozenset(["jpeg", "png", "gif", "tiff", "rgb", "pbm", "pgm", "ppm", "rast", "xbm", "bmp", "webp", "exr"])
+
+ZIP_MAGIC = b"PK\x03\x04"
+OLE_MAGIC = b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1"
+
+
+def _pnm_check(h):
+    return len(h) >= 3 and h[2:3] in (b" ", b"\t", b"\n", b"\r")
+
+
+# (format, magic at offset 0, optional extra check on the head window)
+FILE_SIGNATURES = [
+    ("jpeg", b"\xFF\xD8\xFF", None),
+    ("png", b"\x89PNG\r\n\x1a\n", None),
+    ("gif", b"GIF87a", None),
+    ("gif", b"GIF89a", None),
+    ("tiff", b"MM", None),
+    ("tiff", b"II", None),
+    ("rgb", b"\x01\xDA", None),
+    ("pbm", b"P1", _pnm_check),
+    ("pbm", b"P4", _pnm_check),
+    ("pgm", b"P2", _pnm_check),
+    ("pgm", b"P5", _pnm_check),
+    ("ppm", b"P3", _pnm_check),
+    ("ppm", b"P6", _pnm_check),
+    ("rast", b"\x59\xA6\x6A\x95", None),
+    ("xbm", b"#define ", None),
+    ("bmp", b"BM", None),
+    ("webp", b"RIFF", lambda h: h[8:12] == b"WEBP"),
+    ("exr", b"\x76\x2F\x31\x01", None),
+    ("pdf", b"%PDF-", None),
+    ("zip", ZIP_MAGIC, None),
+    ("rar", b"Rar!\x1a\x07", None),
+    ("7z", b"7z\xBC\xAF\x27\x1C", None),
+    ("gz", b"\x1F\x8B\x08", None),
+    ("bz2", b"BZh", None),
+    ("xz", b"\xFD7zXZ\x00", None),
+    ("exe", b"MZ", None),
+    ("doc", OLE_MAGIC, None),
+]
+
+# Signatures that do not sit at offset 0
+OFFSET_SIGNATURES = [
+    ("tar", 257, b"ustar"),
+]
+
+
+def _compile_signatures(signatures):
+    # Index by leading byte, longest magic first so specific entries win
+    table = {}
+    for file_format, magic, check in signatures:
+        table.setdefault(magic[0], []).append((magic, file_format, check))
+    for entries in table.values():
+        entries.sort(key=lambda entry: len(entry[0]), reverse=True)
+    return table
+
+
+_SIGNATURE_TABLE = _compile_signatures(FILE_SIGNATURES)
+
+
+def _match_prefix(head):
+    if not head:
+        return None
+    for magic, file_format, check in _SIGNATURE_TABLE.get(head[0], ()):
+        if head.startswith(magic) and (check is None or check(head)):
+            return file_format
+    return None
+
+
+def _zip_names(data, tail_start):
+    # Yield member names from the central directory, falling back to local headers
+    tail = bytes(data[tail_start:])
+    eocd = tail.rfind(b"PK\x05\x06")
+    if eocd >= 0 and len(tail) - eocd >= 22:
+        entries, _, cd_offset = struct.unpack_from("<10xHII", tail, eocd)
+        position = cd_offset
+        for _ in range(min(entries, 64)):
+            header = bytes(data[position:position + 46])
+            if len(header) < 46 or not header.startswith(b"PK\x01\x02"):
+                break
+            name_length, extra_length, comment_length = struct.unpack_from("<HHH", header, 28)
+            yield bytes(data[position + 46:position + 46 + name_length])
+            position += 46 + name_length + extra_length + comment_length
+        return
+
+    position = 0
+    for _ in range(8):
+        header = bytes(data[position:position + 30])
+        if len(header) < 30 or not header.startswith(ZIP_MAGIC):
+            break
+        compressed_size, _, name_length, extra_length = struct.unpack_from("<IIHH", header, 18)
+        yield bytes(data[position + 30:position + 30 + name_length])
+        position += 30 + name_length + extra_length + compressed_size
+
+
+def _zip_subtype(data, tail_start):
+    # Office Open XML files are ZIPs whose members live under a known folder
+    for name in _zip_names(data, tail_start):
+        if name.startswith(b"word/"):
+            return "docx"
+        if name.startswith(b"xl/"):
+            return "xlsx"
+        if name.startswith(b"ppt/"):
+            return "pptx"
+    return "zip"
+
+
+OLE_STREAMS = {
+    "WordDocument": "doc",
+    "Workbook": "xls",
+    "Book": "xls",
+    "PowerPoint Document": "ppt",
+    "__properties_version1.0": "msg",
+}
+
+
+def _ole_subtype(data):
+    # Read the first directory sector of the compound file and look at the stream names
+    header = bytes(data[:512])
+    if len(header) < 512:
+        return "doc"
+    sector_size = 1 << struct.unpack_from("<H", header, 0x1E)[0]
+    directory_sector = struct.unpack_from("<I", header, 0x30)[0]
+    start = (directory_sector + 1) * sector_size
+    directory = bytes(data[start:start + sector_size])
+    for position in range(0, len(directory) - 127, 128):
+        name_length = struct.unpack_from("<H", directory, position + 0x40)[0]
+        if not 2 <= name_length <= 64:
+            continue
+        name = directory[position:position + name_length - 2].decode("utf-16-le", "ignore")
+        if name in OLE_STREAMS:
+            return OLE_STREAMS[name]
+    return "doc"
+
+
+def _looks_like_html(head, tail, complete):
+    if b"<html" not in head.lower() or b"</html>" not in tail.lower():
+        return False
+    # The head has to be valid UTF-8, a cut multi-byte sequence at the window edge is fine
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=complete)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def detect_file_format(decoded_content):
+    with METRICS.timer("stage_seconds", stage="sniff"):
+        return _detect_file_format(decoded_content)
+
+
+def _detect_file_format(decoded_content):
+    size = len(decoded_content)
+    head = bytes(decoded_content[:HEAD_WINDOW])
+    tail_start = max(0, size - TAIL_WINDOW)
+    file_format = _match_prefix(head)
+
+    # Images win over everything else, then HTML, then the other signatures
+    if file_format in IMAGE_FORMATS:
+        return file_format
+
+    html_tail = head if size <= HEAD_WINDOW else bytes(decoded_content[-HEAD_WINDOW:])
+    if _looks_like_html(head, html_tail, size <= HEAD_WINDOW):
+        return "html"
+
+    if file_format == "zip":
+        return _zip_subtype(decoded_content, tail_start)
+    if file_format == "doc":
+        return _ole_subtype(decoded_content)
+    if file_format:
+        return file_format
+
+    for file_format, offset, magic in OFFSET_SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return file_format
+
+    return None
+
+
+def file_extension(file_format):
+    # Extension used when saving without asking, unknown content is kept as raw binary
+    return f".{file_format}" if file_format else ".bin"
@@ -0,0 +1,154 @@
+"""Package a file for sending: compress, encode and frame it as small as possible.
+
+Usage:
+    python rws_encode.py [--codec base64] [--rate BPS] [--name] [--fec] [-o OUTPUT] FILE
+
+This is the mirror of the decode pipeline. The file is compressed with gzip
+(zlib), bz2 and xz (lzma) at several levels, and also tried uncompressed;
+the smallest result is encoded with the chosen codec (see rws_codecs) and
+wrapped in -----framing----- that the decoders and the VarAC reader pick
+up. The receiving side unpacks it again (see rws_unpack). With fec, Reed-
+Solomon parity is added after compression so the receiver can repair
+garbled characters (see rws_fec). Every package is decoded once before it
+is returned, so a package that would not round-trip is never sent.
+"""
+
+import argparse
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+from collections import namedtuple
+
+from rws_codecs import CODECS, decode_blocks, get_codec
+from rws_fec import protect
+from rws_metrics import METRICS
+
+# Link rate assumed for the airtime estimate, bits per second
+DEFAULT_LINK_RATE = 1200
+
+# (container, level) pairs tried by package(); level None means stored as it is
+COMPRESSION_CANDIDATES = [
+    ("raw", None),
+    ("gz", 1), ("gz", 6), ("gz", 9),
+    ("bz2", 1), ("bz2", 9),
+    ("xz", 0), ("xz", 6), ("xz", 9 | lzma.PRESET_EXTREME),
+]
+
+FRAME = b"-----"
+
+Package = namedtuple("Package", [
+    "text", "codec", "container", "level", "original_size", "compressed_size", "rate", "airtime", "fec",
+])
+
+
+def compress(content, container, level, name=None):
+    # The formats rws_detect recognises, so the receiver knows how to unpack them
+    if container == "raw":
+        return bytes(content)
+    if container == "gz":
+        buffer = io.BytesIO()
+        # mtime=0 keeps the output reproducible; the name costs airtime, so it is optional
+        with gzip.GzipFile(filename=name or "", mode="wb", fileobj=buffer, compresslevel=level, mtime=0) as file:
+            file.write(content)
+        return buffer.getvalue()
+    if container == "bz2":
+        return bz2.compress(content, level)
+    if container == "xz":
+        return lzma.compress(content, preset=level)
+    raise ValueError(f"Unknown container: {container}")
+
+
+def frame(encoded):
+    # Framing a codec output that itself contains the frame would cut the block short
+    if FRAME in encoded:
+        return None
+    if encoded.endswith(b"-"):
+        # Otherwise the closing frame would start one character early
+        encoded += b"\n"
+    return FRAME + encoded + FRAME + b"\n"
+
+
+def estimate_airtime(size, rate=DEFAULT_LINK_RATE):
+    # Seconds to send size bytes of 8-bit text at rate bits per second, ignoring modem overhead
+    return size * 8 / rate
+
+
+def package(content, codec="base64", name=None, rate=DEFAULT_LINK_RATE, candidates=COMPRESSION_CANDIDATES, fec=False):
+    # Returns the smallest Package; raises ValueError if codec cannot encode or round-trip this payload
+    encoder = get_codec(codec).encode
+    if encoder is None:
+        raise ValueError(f"The {codec} codec cannot encode")
+    if fec and get_codec(codec).placeholder is None:
+        raise ValueError(f"The {codec} codec cannot carry error correction, use another codec")
+
+    with METRICS.timer("stage_seconds", stage="compress"):
+        # Ties go to the earlier (cheaper to unpack) candidate
+        best = None
+        for container, level in candidates:
+            compressed = compress(content, container, level, name)
+            if best is None or len(compressed) < len(best[2]):
+                best = (container, level, compressed)
+    container, level, compressed = best
+
+    # Parity goes on last, it is what has to survive the link
+    text = frame(encoder(protect(compressed) if fec else compressed))
+    if text is None:
+        raise ValueError(f"The {codec} output contains the ----- framing, use another codec")
+    # Make sure the receiver gets the same bytes back, whichever codec it detects
+    block = next(decode_blocks(text), None)
+    if block is None or block.error is not None or bytes(block.content) != compressed:
+        raise ValueError(f"The {codec} package would not decode to the same bytes on the receiving side, use another codec")
+    airtime = estimate_airtime(len(text), rate)
+    return Package(text, codec, container, level, len(content), len(compressed), rate, airtime, fec)
+
+
+def format_package_summary(result):
+    if result.container == "raw":
+        compression = "stored"
+    elif result.container == "xz" and result.level & lzma.PRESET_EXTREME:
+        compression = f"xz level {result.level & ~lzma.PRESET_EXTREME} extreme"
+    else:
+        compression = f"{result.container} level {result.level}"
+    if result.fec:
+        compression += ", with error correction"
+    minutes, seconds = divmod(round(result.airtime), 60)
+    return (
+        f"{result.original_size:,} bytes -> {result.compressed_size:,} bytes ({compression}) -> "
+        f"{len(result.text):,} bytes of {result.codec} on air, about {minutes}m {seconds:02d}s at {result.rate} bps"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compress, encode and frame a file for sending.")
+    parser.add_argument("path", help="file to package")
+    parser.add_argument("-o", "--output", help="write the package here instead of stdout")
+    parser.add_argument("--codec", default="base64", choices=[name for name, codec in CODECS.items() if codec.encode],
+                        help="text encoding (default: base64, base85 is about 6%% smaller)")
+    parser.add_argument("--rate", type=int, default=DEFAULT_LINK_RATE, help=f"link rate in bits per second (default: {DEFAULT_LINK_RATE})")
+    parser.add_argument("--name", action="store_true", help="keep the file name in the package (gzip only)")
+    parser.add_argument("--fec", action="store_true", help="add Reed-Solomon parity so garbled characters can be repaired")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.path, "rb") as file:
+            content = file.read()
+        name = os.path.basename(args.path) if args.name else None
+        result = package(content, args.codec, name, args.rate, fec=args.fec)
+    except (OSError, ValueError) as e:
+        print(f"{args.path}: {e}", file=sys.stderr)
+        return 1
+
+    if args.output:
+        with open(args.output, "wb") as file:
+            file.write(result.text)
+    else:
+        sys.stdout.buffer.write(result.text)
+    print(format_package_summary(result), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+"""Error correction for payloads sent over noisy links.
+
+protect() adds Reed-Solomon parity over GF(256) to a payload before it is
+encoded, repair() checks it on the receiving side and fixes up to half as
+many damaged bytes per codeword as there are parity bytes. The payload is
+striped across the codewords (byte i goes to codeword i % n), so a burst of
+garbled characters is spread thin instead of wiping out one codeword, and
+the data itself stays in one piece:
+
+    header x3 | data | parity of codeword 0..n-1, interleaved the same way
+
+The 16-byte header (magic, version, parity bytes per codeword, data length
+and CRC-32) is sent three times and voted on. A clean reception costs one
+CRC-32; only codewords whose parity does not match are run through the
+decoder.
+
+merge_copies() and merge_receptions() work a level up, on the text: when the
+same payload was received several times, every character is decided by
+majority vote before anything is decoded.
+"""
+
+import re
+import struct
+import zlib
+from collections import Counter
+
+from rws_decode import iter_blocks
+from rws_metrics import METRICS
+
+MAGIC = b"RWSFEC"
+VERSION = 1
+
+# Parity bytes per 255-byte codeword, repairs up to 16 bytes in each (about 14% overhead)
+DEFAULT_PARITY = 32
+
+# Copies of the header at the start of a protected payload, voted two out of three
+HEADER_COPIES = 3
+
+# Received copies may differ in at most this share of characters to count as the same payload
+MAX_COPY_DIFFERENCE = 0.25
+
+_HEADER = struct.Struct(">6sBBII")
+HEADER_SIZE = _HEADER.size * HEADER_COPIES
+
+_PRIMITIVE = 0x11D
+
+_NON_WHITESPACE = re.compile(r"\S")
+
+
+class FecError(ValueError):
+    pass
+
+
+def _build_tables():
+    exp = [0] * 512
+    log = [0] * 256
+    value = 1
+    for power in range(255):
+        exp[power] = value
+        log[value] = power
+        value <<= 1
+        if value & 0x100:
+            value ^= _PRIMITIVE
+    # Doubled so products of two logs never need a modulo
+    for power in range(255, 512):
+        exp[power] = exp[power - 255]
+    return exp, log
+
+
+_EXP, _LOG = _build_tables()
+
+
+def _mul(x, y):
+    if x == 0 or y == 0:
+        return 0
+    return _EXP[_LOG[x] + _LOG[y]]
+
+
+def _div(x, y):
+    if y == 0:
+        raise ZeroDivisionError()
+    if x == 0:
+        return 0
+    return _EXP[(_LOG[x] + 255 - _LOG[y]) % 255]
+
+
+def _pow(x, power):
+    return _EXP[(_LOG[x] * power) % 255]
+
+
+def _inverse(x):
+    return _EXP[255 - _LOG[x]]
+
+
+def _poly_scale(poly, x):
+    return [_mul(coef, x) for coef in poly]
+
+
+def _poly_add(p, q):
+    result = [0] * max(len(p), len(q))
+    for i, coef in enumerate(p):
+        result[i + len(result) - len(p)] = coef
+    for i, coef in enumerate(q):
+        result[i + len(result) - len(q)] ^= coef
+    return result
+
+
+def _poly_mul(p, q):
+    result = [0] * (len(p) + len(q) - 1)
+    for j, q_coef in enumerate(q):
+        for i, p_coef in enumerate(p):
+            result[i + j] ^= _mul(p_coef, q_coef)
+    return result
+
+
+def _poly_eval(poly, x):
+    value = poly[0]
+    for coef in poly[1:]:
+        value = _mul(value, x) ^ coef
+    return value
+
+
+def _poly_mod(dividend, divisor):
+    # Remainder of dividing by a monic divisor
+    output = list(dividend)
+    for i in range(len(dividend) - len(divisor) + 1):
+        coef = output[i]
+        if coef:
+            for j in range(1, len(divisor)):
+                if divisor[j]:
+                    output[i + j] ^= _mul(divisor[j], coef)
+    return output[-(len(divisor) - 1):]
+
+
+class _Code:
+    """Reed-Solomon code with nsym parity symbols, generator roots 2^0 .. 2^(nsym-1)."""
+
+    def __init__(self, nsym):
+        self.nsym = nsym
+        generator = [1]
+        for i in range(nsym):
+            generator = _poly_mul(generator, [1, _pow(2, i)])
+        # Parity register update for every feedback byte, with the register held in one int
+        self._mask = (1 << (8 * nsym)) - 1
+        self._shift = 8 * (nsym - 1)
+        self._feedback = [
+            int.from_bytes(bytes(_mul(coef, value) for coef in generator[1:]), "big") for value in range(256)
+        ]
+
+    def parity(self, data):
+        register = 0
+        feedback, mask, shift = self._feedback, self._mask, self._shift
+        for byte in data:
+            register = ((register << 8) & mask) ^ feedback[byte ^ (register >> shift)]
+        return register.to_bytes(self.nsym, "big")
+
+    def correct(self, codeword):
+        # Returns the repaired codeword as a list; raises FecError past nsym // 2 errors
+        message = list(codeword)
+        syndromes = [_poly_eval(message, _pow(2, i)) for i in range(self.nsym)]
+        if not any(syndromes):
+            return message
+        locator = self._error_locator(syndromes)
+        positions = self._error_positions(locator[::-1], len(message))
+        message = self._apply_corrections(message, [0] + syndromes, positions)
+        if any(_poly_eval(message, _pow(2, i)) for i in range(self.nsym)):
+            raise FecError("Could not correct the codeword")
+        return message
+
+    def _error_locator(self, syndromes):
+        # Berlekamp-Massey
+        locator = [1]
+        previous = [1]
+        for i in range(self.nsym):
+            delta = syndromes[i]
+            for j in range(1, len(locator)):
+                delta ^= _mul(locator[-(j + 1)], syndromes[i - j])
+            previous = previous + [0]
+            if delta:
+                if len(previous) > len(locator):
+                    new_locator = _poly_scale(previous, delta)
+                    previous = _poly_scale(locator, _inverse(delta))
+                    locator = new_locator
+                locator = _poly_add(locator, _poly_scale(previous, delta))
+        while locator and locator[0] == 0:
+            del locator[0]
+        if (len(locator) - 1) * 2 > self.nsym:
+            raise FecError("Too many errors to correct")
+        return locator
+
+    def _error_positions(self, locator, length):
+        # Chien search
+        positions = [length - 1 - i for i in range(length) if _poly_eval(locator, _pow(2, i)) == 0]
+        if len(positions) != len(locator) - 1:
+            raise FecError("Too many errors to correct")
+        return positions
+
+    def _apply_corrections(self, message, syndromes, positions):
+        # Forney: error magnitudes from the error evaluator polynomial
+        coefficient_positions = [len(message) - 1 - position for position in positions]
+        locator = [1]
+        for position in coefficient_positions:
+            locator = _poly_mul(locator, _poly_add([1], [_pow(2, position), 0]))
+        evaluator = _poly_mod(_poly_mul(syndromes[::-1], locator), [1] + [0] * len(locator))[::-1]
+        roots = [_pow(2, position - 255) for position in coefficient_positions]
+        for i, root in enumerate(roots):
+            root_inverse = _inverse(root)
+            derivative = 1
+            for j, other in enumerate(roots):
+                if j != i:
+                    derivative = _mul(derivative, 1 ^ _mul(root_inverse, other))
+            if derivative == 0:
+                raise FecError("Could not find the error magnitude")
+            magnitude = _mul(root, _poly_eval(evaluator[::-1], root_inverse))
+            message[positions[i]] ^= _div(magnitude, derivative)
+        return message
+
+
+_CODES = {}
+
+
+def _code(nsym):
+    code = _CODES.get(nsym)
+    if code is None:
+        code = _CODES[nsym] = _Code(nsym)
+    return code
+
+
+def _codeword_count(length, nsym):
+    return max(1, -(-length // (255 - nsym)))
+
+
+def protect(data, nsym=DEFAULT_PARITY):
+    # Header, the data as it is, then the interleaved parity of every codeword
+    if not 2 <= nsym <= 128 or nsym % 2:
+        raise ValueError("nsym must be an even number between 2 and 128")
+    data = bytes(data)
+    count = _codeword_count(len(data), nsym)
+    code = _code(nsym)
+    parity = bytearray(count * nsym)
+    for index in range(count):
+        parity[index::count] = code.parity(data[index::count])
+    header = _HEADER.pack(MAGIC, VERSION, nsym, len(data), zlib.crc32(data))
+    return header * HEADER_COPIES + data + bytes(parity)
+
+
+def _vote_header(data, size=_HEADER.size):
+    first, second, third = (bytes(data[i * _HEADER.size:i * _HEADER.size + size]) for i in range(HEADER_COPIES))
+    return bytes(a if a == b or a == c else b for a, b, c in zip(first, second, third))
+
+
+def is_protected(data):
+    # Runs on every decoded region, so only the magic is voted on
+    return len(data) >= HEADER_SIZE and _vote_header(data, len(MAGIC)) == MAGIC
+
+
+def repair(data):
+    # Returns (payload, bytes corrected); raises FecError when it is too damaged to repair
+    magic, version, nsym, length, checksum = _HEADER.unpack(_vote_header(data))
+    if magic != MAGIC or version != VERSION or not nsym or nsym % 2:
+        raise FecError("Not an error-corrected payload, or its header is damaged")
+    count = _codeword_count(length, nsym)
+    # Bytes lost or gained in transit only hurt the end; pad or cut to the expected size
+    body = bytearray(data[HEADER_SIZE:HEADER_SIZE + length])
+    body += bytes(length - len(body))
+    parity = bytes(data[HEADER_SIZE + length:HEADER_SIZE + length + count * nsym])
+    parity += bytes(count * nsym - len(parity))
+    if zlib.crc32(body) == checksum:
+        return body, 0
+
+    code = _code(nsym)
+    corrected = 0
+    failed = 0
+    with METRICS.timer("stage_seconds", stage="repair"):
+        for index in range(count):
+            block = bytes(body[index::count])
+            block_parity = parity[index::count]
+            if code.parity(block) == block_parity:
+                continue
+            try:
+                fixed = code.correct(block + block_parity)[:len(block)]
+            except FecError:
+                failed += 1
+                continue
+            corrected += sum(1 for old, new in zip(block, fixed) if old != new)
+            body[index::count] = bytes(fixed)
+    if failed:
+        raise FecError(f"{failed} of {count} error correction blocks are too damaged to repair")
+    if zlib.crc32(body) != checksum:
+        raise FecError("The payload is too damaged to repair")
+    return body, corrected
+
+
+def merge_copies(copies):
+    # Majority vote per character over receptions of one payload; whitespace is ignored and
+    # copies whose length differs from the most common one are left out (a dropped character
+    # would shift every position after it). The result keeps the line breaks of the first copy
+    # that was voted on, which line-based codecs (uuencode) need. Returns (text, positions where
+    # the copies disagreed).
+    stripped = ["".join(copy.split()) for copy in copies]
+    length = Counter(len(copy) for copy in stripped).most_common(1)[0][0]
+    layout = next(copy for copy, text in zip(copies, stripped) if len(text) == length)
+    copies = [copy for copy in stripped if len(copy) == length]
+    if len(copies) < 3 or all(copy == copies[0] for copy in copies):
+        return layout, 0
+    merged = []
+    disputed = 0
+    for column in zip(*copies):
+        if column.count(column[0]) == len(column):
+            merged.append(column[0])
+            continue
+        disputed += 1
+        merged.append(Counter(column).most_common(1)[0][0])
+    voted = iter(merged)
+    return _NON_WHITESPACE.sub(lambda match: next(voted), layout), disputed
+
+
+def is_copy(text, other, max_difference=MAX_COPY_DIFFERENCE):
+    # Same payload received twice: equal length once whitespace is gone, and mostly equal characters
+    text = "".join(text.split())
+    other = "".join(other.split())
+    if len(text) != len(other) or not text:
+        return False
+    differences = sum(1 for a, b in zip(text, other) if a != b)
+    return differences <= max_difference * len(text)
+
+
+def merge_receptions(entry, earlier_entries):
+    # Rebuild entry with every -----block----- voted on against its copies in earlier entries.
+    # Returns (text, blocks merged); the entry comes back unchanged when it has no repeats.
+    candidates = [other[start:end] for other in earlier_entries for start, end in iter_blocks(other)]
+    blocks = []
+    merged_count = 0
+    for start, end in iter_blocks(entry):
+        block = entry[start:end]
+        copies = [block] + [candidate for candidate in candidates if is_copy(block, candidate)]
+        if len(copies) >= 3:
+            block, disputed = merge_copies(copies)
+            merged_count += 1
+            METRICS.count("merged_characters_total", disputed)
+        blocks.append(block)
+    if not merged_count:
+        return entry, 0
+    return "\n".join(f"-----{block}-----" for block in blocks), merged_count
@@ -0,0 +1,176 @@
+"""Timers and counters for the decode pipeline and the Gopher server.
+
+Collection is off unless the RWS_METRICS environment variable is set or
+enable() is called. While it is off, count() and observe() return after one
+flag check and timer() hands back a shared no-op context manager, so the
+hooks can stay in the hot paths.
+
+    import rws_metrics
+    rws_metrics.enable()
+    with rws_metrics.timer("stage_seconds", stage="decode"):
+        ...
+    rws_metrics.count("decode_outcomes_total", outcome="ok")
+    print(rws_metrics.render_prometheus())
+"""
+
+import bisect
+import os
+import threading
+import time
+
+# Prefix of every metric name in the Prometheus dump
+NAMESPACE = "rws"
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("_metrics", "_key", "_started")
+
+    def __init__(self, metrics, key):
+        self._metrics = metrics
+        self._key = key
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics._observe(self._key, time.perf_counter() - self._started)
+        return False
+
+
+class Histogram:
+    __slots__ = ("count", "sum", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        # Per-bucket counts, the last one is +Inf
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+
+class Metrics:
+    """A registry of counters and latency histograms keyed by name and labels.
+
+    Safe to update from the Tk thread, decode workers and the Gopher server
+    threads at the same time.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if self.enabled:
+            self._observe((name, tuple(sorted(labels.items()))), seconds)
+
+    def timer(self, name, **labels):
+        # Context manager that observes its wall time into the named histogram
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, (name, tuple(sorted(labels.items()))))
+
+    def _observe(self, key, seconds):
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        # Plain dicts keyed by (name, ((label, value), ...)), safe to keep or send between processes
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: {"count": histogram.count, "sum": histogram.sum, "buckets": list(histogram.buckets)}
+                for key, histogram in self._histograms.items()
+            }
+        return {"counters": counters, "histograms": histograms}
+
+    def render_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(snapshot["counters"].items()):
+            full_name = f"{NAMESPACE}_{name}"
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append(f"# TYPE {full_name} counter")
+            lines.append(f"{full_name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(snapshot["histograms"].items()):
+            full_name = f"{NAMESPACE}_{name}"
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append(f"# TYPE {full_name} histogram")
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS + ("+Inf",), histogram["buckets"]):
+                cumulative += bucket
+                lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(label, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for label, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+# The process-wide registry every module reports into
+METRICS = Metrics(enabled=bool(os.environ.get("RWS_METRICS")))
+
+enable = METRICS.enable
+disable = METRICS.disable
+reset = METRICS.reset
+count = METRICS.count
+observe = METRICS.observe
+timer = METRICS.timer
+snapshot = METRICS.snapshot
+render_prometheus = METRICS.render_prometheus
+
+
+def enabled():
+    return METRICS.enabled
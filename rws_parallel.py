@@ -0,0 +1,174 @@
+"""Decode one very large base64 payload on every core.
+
+binascii.a2b_base64 is most of the decode time and holds the GIL, so the
+work is split across processes. The region is cleaned once into a shared
+memory block, the data before the padding is cut at 4-character
+boundaries, and every worker decodes its span straight into its place in a
+second shared block. The tail (the last partial quantum and its padding) is
+decoded by the serial decoder, which also validates it.
+
+Only clean inputs take this path. Whenever the serial decoder would raise
+(strict mode with a bad character, misplaced padding), None is returned and
+the caller decodes serially, so errors and output are always the same as on
+the serial path.
+
+Processes that are themselves pool workers decode serially. Pools that run
+decodes (rws_batch, varac_backfill) start their workers with
+mark_pool_worker as the initializer.
+"""
+
+import binascii
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+from rws_decode import (_INVALID_BYTES, _INVALID_STR, _JUNK_BYTES, Base64DecodeError, StreamingBase64Decoder,
+                        iter_chunks)
+from rws_metrics import METRICS
+
+# Spans per worker, so a slow worker does not hold up the others
+SPANS_PER_WORKER = 4
+
+# Bytes of output copied out of shared memory at a time (a multiple of the page size)
+HANDOFF_SIZE = 16 * 1024 * 1024
+
+# Set in pool workers by mark_pool_worker()
+_pool_worker = False
+
+
+def mark_pool_worker():
+    # Pool initializer: this process is one worker of many and must not start a pool of its own
+    global _pool_worker
+    _pool_worker = True
+
+
+def worker_count():
+    if _pool_worker:
+        return 1
+    return os.cpu_count() or 1
+
+
+def _decode_span(source_name, target_name, start, end):
+    # Pool workers share the resource tracker of the process that created the blocks,
+    # which also unlinks them
+    source = shared_memory.SharedMemory(name=source_name)
+    target = shared_memory.SharedMemory(name=target_name)
+    try:
+        decoded = binascii.a2b_base64(source.buf[start:end])
+        target.buf[start // 4 * 3:start // 4 * 3 + len(decoded)] = decoded
+        return end - start
+    finally:
+        source.close()
+        target.close()
+
+
+def _clean_into(buffer, data, start, end, strict, progress):
+    # Copy the alphabet characters of the region into buffer; returns (length, first "=" or -1,
+    # seconds spent validating), or None when strict mode finds a character the serial decoder
+    # would reject
+    length = 0
+    pad_index = -1
+    consumed = 0
+    validate_seconds = 0.0
+    for chunk in iter_chunks(data, start, end):
+        consumed += len(chunk)
+        if strict:
+            started = time.perf_counter()
+            if (_INVALID_STR if isinstance(chunk, str) else _INVALID_BYTES).search(chunk):
+                return None
+            validate_seconds += time.perf_counter() - started
+        if isinstance(chunk, str):
+            chunk = chunk.encode("ascii", "ignore")
+        cleaned = bytes(chunk).translate(None, _JUNK_BYTES)
+        if pad_index < 0:
+            found = cleaned.find(b"=")
+            if found >= 0:
+                pad_index = length + found
+        buffer[length:length + len(cleaned)] = cleaned
+        length += len(cleaned)
+        if progress:
+            # Cleaning is reported as the first half of the work
+            progress(consumed // 2, end - start)
+    return length, pad_index, validate_seconds
+
+
+def decode_base64_parallel(data, start=0, end=None, strict=False, progress=None, workers=None):
+    # Same result as rws_decode.decode_base64, or None when the serial path has to do it
+    if end is None:
+        end = len(data)
+    workers = workers or worker_count()
+    if workers < 2 or end <= start:
+        return None
+
+    source = shared_memory.SharedMemory(create=True, size=end - start)
+    target = None
+    executor = None
+    try:
+        started = time.perf_counter()
+        cleaned = _clean_into(source.buf, data, start, end, strict, progress)
+        if cleaned is None:
+            return None
+        length, pad_index, validate_seconds = cleaned
+        METRICS.observe("stage_seconds", time.perf_counter() - started - validate_seconds, stage="clean")
+        if strict:
+            METRICS.observe("stage_seconds", validate_seconds, stage="validate")
+
+        data_length = pad_index if pad_index >= 0 else length
+        whole = data_length - data_length % 4
+        try:
+            tail_decoder = StreamingBase64Decoder(strict=strict)
+            tail_decoder.feed(bytes(source.buf[whole:length]))
+            tail = tail_decoder.finish()
+        except Base64DecodeError:
+            return None
+
+        size = whole // 4 * 3 + len(tail)
+        target = shared_memory.SharedMemory(create=True, size=max(1, size))
+        target.buf[whole // 4 * 3:size] = tail
+
+        step = -(-whole // (workers * SPANS_PER_WORKER))
+        step += -step % 4
+        if step:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=mark_pool_worker)
+            futures = [
+                executor.submit(_decode_span, source.name, target.name, position, min(position + step, whole))
+                for position in range(0, whole, step)
+            ]
+            done = 0
+            for future in as_completed(futures):
+                done += future.result()
+                if progress:
+                    progress((end - start) // 2 + (end - start) * done // (2 * whole), end - start)
+            executor.shutdown()
+            executor = None
+        _release(source)
+        source = None
+        return _hand_off(target, size)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        for block in (source, target):
+            if block is not None:
+                _release(block)
+
+
+def _hand_off(block, size):
+    # Copy the output out piece by piece, giving each piece's shared pages back as soon as it
+    # is copied, so the payload is not held twice. Without MADV_REMOVE (Windows, macOS) the
+    # pages are only freed with the block.
+    output = bytearray()
+    remove = getattr(mmap, "MADV_REMOVE", None)
+    for position in range(0, size, HANDOFF_SIZE):
+        length = min(HANDOFF_SIZE, size - position)
+        output += block.buf[position:position + length]
+        if remove is not None:
+            # buf is a memoryview of the block's mmap
+            block.buf.obj.madvise(remove, position, length)
+    return output
+
+
+def _release(block):
+    block.close()
+    block.unlink()
@@ -0,0 +1,198 @@
+"""Preview pane for decoded payloads, shown inside the decoder windows.
+
+Images are decoded straight to a thumbnail: PIL's draft() lets JPEG decode
+at 1/2 to 1/8 scale, and thumbnail() reduces everything else while it
+resamples. Without PIL, PNG and GIF still preview through Tk. Text and HTML
+source are decoded and inserted one page at a time as the view scrolls, so a
+large file costs no more than one page up front. Nothing is written to disk
+unless the file is opened externally. Those temp files share one folder,
+which is removed with the pane.
+"""
+
+import base64
+import codecs
+import os
+import sys
+import tkinter as tk
+from io import BytesIO
+from tkinter import ttk
+
+from rws_detect import IMAGE_FORMATS
+
+# Largest size of the image preview, in pixels
+THUMBNAIL_SIZE = (480, 320)
+
+# Bytes of text decoded and inserted per page
+TEXT_PAGE_SIZE = 32 * 1024
+
+# Load the next page once the view is scrolled this far down
+PAGE_TRIGGER = 0.9
+
+
+def make_thumbnail(content, size=THUMBNAIL_SIZE):
+    # A PIL image no larger than size, or None without PIL or for images it cannot read
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        image = Image.open(BytesIO(content))
+        # Only JPEG honours draft(), and it is also the one that gains most from it
+        image.draft("RGB", size)
+        image.thumbnail(size, reducing_gap=2.0)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    return image
+
+
+def open_path(path):
+    # Hand a file to the platform's default application
+    if sys.platform == "win32":
+        os.startfile(path)
+    else:
+        import subprocess
+        opener = "open" if sys.platform == "darwin" else "xdg-open"
+        subprocess.Popen([opener, path])
+
+
+def _looks_like_text(content):
+    # The first page has to be valid UTF-8, a multi-byte character cut at the page edge is fine
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(bytes(content[:TEXT_PAGE_SIZE]), final=len(content) <= TEXT_PAGE_SIZE)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+class PreviewPane(ttk.Frame):
+    """Show the last decoded file: a thumbnail, paged text, or a one-line summary.
+
+    opener(path) opens a file externally (open_path by default); it is only
+    called from open_externally(), never on its own.
+    """
+
+    def __init__(self, master, opener=None, **options):
+        super().__init__(master, **options)
+        self.opener = opener or open_path
+        self._content = None
+        self._suffix = ""
+        self._photo = None
+        self._decoder = None
+        self._position = 0
+        self._page_pending = False
+        self._temp_dir = None
+
+        header = ttk.Frame(self)
+        header.pack(fill=tk.X, pady=(0, 5))
+        self.summary_label = ttk.Label(header, text="Decoded files are previewed here.")
+        self.summary_label.pack(side=tk.LEFT)
+        self.open_button = ttk.Button(header, text="Open Externally", command=self.open_externally, state=tk.DISABLED)
+        self.open_button.pack(side=tk.RIGHT)
+
+        self.image_label = ttk.Label(self, anchor=tk.CENTER)
+        self.text_frame = ttk.Frame(self)
+        self.text = tk.Text(self.text_frame, height=10, wrap=tk.WORD, font=("Consolas", 11), bg="#F5F5F5", fg="#333333",
+                            bd=0, highlightthickness=1, highlightcolor="#CCCCCC", highlightbackground="#CCCCCC", state=tk.DISABLED)
+        scrollbar = ttk.Scrollbar(self.text_frame, command=self.text.yview)
+        self.text.config(yscrollcommand=lambda first, last: self._on_scroll(scrollbar, first, last))
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.bind("<Destroy>", lambda event: self.cleanup() if event.widget is self else None)
+
+    def show(self, content, file_format, name=None):
+        # file_format as rws_detect reports it; unknown content that reads as UTF-8 is shown as text
+        self._clear()
+        self._content = content
+        self._suffix = f".{file_format}" if file_format else ".txt"
+        label = name or (file_format.upper() if file_format else "Unknown format")
+        self.summary_label.config(text=f"{label}, {len(content):,} bytes")
+        self.open_button.config(state=tk.NORMAL)
+
+        if file_format in IMAGE_FORMATS and self._show_image(content):
+            return
+        if file_format == "html" or (file_format is None and _looks_like_text(content)):
+            self._show_text()
+            return
+        if file_format is None:
+            self._suffix = ".bin"
+        self.summary_label.config(text=f"{label}, {len(content):,} bytes, no preview")
+
+    def _clear(self):
+        self.image_label.pack_forget()
+        self.text_frame.pack_forget()
+        self.image_label.config(image="")
+        self._photo = None
+        self._decoder = None
+        self._position = 0
+        self.text.config(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.config(state=tk.DISABLED)
+
+    def _show_image(self, content):
+        thumbnail = make_thumbnail(content)
+        if thumbnail is not None:
+            from PIL import ImageTk
+            self._photo = ImageTk.PhotoImage(thumbnail)
+        else:
+            self._photo = self._tk_thumbnail(content)
+            if self._photo is None:
+                return False
+        self.image_label.config(image=self._photo)
+        self.image_label.pack(fill=tk.BOTH, expand=True)
+        return True
+
+    def _tk_thumbnail(self, content):
+        # Tk reads PNG and GIF by itself; subsample() only shrinks by whole factors
+        try:
+            photo = tk.PhotoImage(master=self, data=base64.b64encode(bytes(content)).decode("ascii"))
+        except tk.TclError:
+            return None
+        factor = max(1, -(-photo.width() // THUMBNAIL_SIZE[0]), -(-photo.height() // THUMBNAIL_SIZE[1]))
+        return photo.subsample(factor) if factor > 1 else photo
+
+    def _show_text(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self.text_frame.pack(fill=tk.BOTH, expand=True)
+        self._load_page()
+
+    def _load_page(self):
+        self._page_pending = False
+        if self._decoder is None:
+            return
+        end = min(self._position + TEXT_PAGE_SIZE, len(self._content))
+        page = self._decoder.decode(bytes(self._content[self._position:end]), final=end == len(self._content))
+        self._position = end
+        self.text.config(state=tk.NORMAL)
+        self.text.insert(tk.END, page)
+        self.text.config(state=tk.DISABLED)
+
+    def _on_scroll(self, scrollbar, first, last):
+        scrollbar.set(first, last)
+        # The next page goes in before the reader reaches the end of this one
+        if self._page_pending or self._decoder is None or self._position >= len(self._content):
+            return
+        if float(last) >= PAGE_TRIGGER:
+            self._page_pending = True
+            self.after_idle(self._load_page)
+
+    def open_externally(self):
+        # Opt-in: the only place a preview touches the disk
+        import tempfile
+
+        if self._content is None:
+            return None
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.mkdtemp(prefix="rws-preview-")
+        fd, path = tempfile.mkstemp(suffix=self._suffix, dir=self._temp_dir)
+        with os.fdopen(fd, "wb") as file:
+            file.write(self._content)
+        self.opener(path)
+        return path
+
+    def cleanup(self):
+        # Viewers may still hold a file open (Windows), whatever cannot be removed now is left to the OS
+        if self._temp_dir is not None:
+            import shutil
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
@@ -0,0 +1,204 @@
+"""Unpack gzip, bz2, xz and zip payloads after the base64 step.
+
+Decompression is incremental: the compressed buffer is fed in CHUNK_SIZE
+pieces and no call is allowed to produce more than CHUNK_SIZE bytes at once,
+so the size and ratio limits trip before a zip bomb can fill memory. ZIP
+members are read through a seekable view of the decoded buffer instead of a
+copy of it. Every unpacked file goes back through format detection.
+"""
+
+import bz2
+import io
+import lzma
+import struct
+import zipfile
+import zlib
+from collections import namedtuple
+
+from rws_decode import CHUNK_SIZE
+from rws_detect import detect_file_format
+from rws_metrics import METRICS
+
+# Formats unpack() knows how to open
+COMPRESSED_FORMATS = frozenset(["gz", "bz2", "xz", "zip"])
+
+# Largest total output and output/input ratio accepted from one payload
+MAX_UNPACKED_SIZE = 512 * 1024 * 1024
+MAX_RATIO = 200
+
+# Archive members beyond this many are not unpacked
+MAX_MEMBERS = 1000
+
+UnpackedFile = namedtuple("UnpackedFile", ["name", "content", "format"])
+
+
+class UnpackError(ValueError):
+    pass
+
+
+class UnpackLimitError(UnpackError):
+    pass
+
+
+class _Budget:
+    # Tracks the output of one payload against the absolute and ratio limits
+    def __init__(self, compressed_size, max_size, max_ratio):
+        self.limit = min(max_size, max(compressed_size, 1) * max_ratio)
+        self.limited_by_ratio = self.limit < max_size
+        self.used = 0
+
+    def check(self, size):
+        if self.used + size > self.limit:
+            reason = " (compression ratio limit)" if self.limited_by_ratio else ""
+            raise UnpackLimitError(f"Unpacking stopped, the payload expands to more than {self.limit:,} bytes{reason}")
+
+    def claim(self, size):
+        self.check(size)
+        self.used += size
+
+
+class _BufferReader(io.RawIOBase):
+    # Seekable read-only file over a bytes-like object, without copying it
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer):
+        chunk = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+
+def _gzip_name(data):
+    # Original file name from the gzip header (FNAME), if the sender kept it
+    header = bytes(data[:10])
+    if len(header) < 10 or not header[3] & 0x08:
+        return None
+    position = 10
+    if header[3] & 0x04:  # FEXTRA
+        position += 2 + struct.unpack_from("<H", bytes(data[10:12]))[0]
+    end = bytes(data[position:position + 1024]).find(b"\x00")
+    if end <= 0:
+        return None
+    return bytes(data[position:position + end]).decode("latin-1")
+
+
+def _needs_input(decompressor):
+    # zlib hands unread input back in unconsumed_tail, bz2 and lzma keep it and say so in needs_input
+    if hasattr(decompressor, "needs_input"):
+        return decompressor.needs_input
+    return not decompressor.unconsumed_tail
+
+
+def _inflate_stream(data, new_decompressor, budget, check_cancelled=None):
+    # Run concatenated streams (multi-member gzip, multi-stream bz2/xz) through bounded decompress calls
+    output = bytearray()
+    view = memoryview(data).cast("B")
+    position = 0
+    decompressor = new_decompressor()
+    while True:
+        if check_cancelled:
+            check_cancelled()
+        if decompressor.eof:
+            rest = decompressor.unused_data
+            if not rest and position < len(view):
+                # The stream ended exactly at the end of a chunk, the next one starts in the unread input
+                rest = bytes(view[position:position + CHUNK_SIZE])
+                position += len(rest)
+            if not rest.strip(b"\x00") and position >= len(view):
+                return output
+            # Another stream follows the one that just ended
+            decompressor = new_decompressor()
+            pending = rest
+        elif not _needs_input(decompressor):
+            pending = getattr(decompressor, "unconsumed_tail", b"")
+        elif position < len(view):
+            pending = view[position:position + CHUNK_SIZE]
+            position += len(pending)
+        else:
+            # Out of input: flush what the decompressor still holds, then it has to be at the end
+            pending = b""
+        chunk = decompressor.decompress(pending, CHUNK_SIZE)
+        budget.claim(len(chunk))
+        output += chunk
+        if not chunk and not pending and not decompressor.eof:
+            raise UnpackError("The compressed payload is truncated")
+
+
+def _unzip(data, budget, check_cancelled=None):
+    unpacked = []
+    with zipfile.ZipFile(_BufferReader(data)) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        if len(members) > MAX_MEMBERS:
+            raise UnpackLimitError(f"Unpacking stopped, the archive has more than {MAX_MEMBERS} files")
+        # The sizes in the central directory can lie, so they are only a first check
+        budget.check(sum(info.file_size for info in members))
+        for info in members:
+            content = bytearray()
+            with archive.open(info) as member:
+                while True:
+                    if check_cancelled:
+                        check_cancelled()
+                    chunk = member.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    budget.claim(len(chunk))
+                    content += chunk
+            unpacked.append((info.filename, content))
+    return unpacked
+
+
+def unpack(data, file_format, max_size=MAX_UNPACKED_SIZE, max_ratio=MAX_RATIO, check_cancelled=None):
+    # Returns [UnpackedFile] for a gz, bz2 or zip payload; raises UnpackError on bad or oversized data
+    budget = _Budget(len(data), max_size, max_ratio)
+    try:
+        with METRICS.timer("stage_seconds", stage="unpack"):
+            if file_format == "gz":
+                content = _inflate_stream(data, lambda: zlib.decompressobj(wbits=31), budget, check_cancelled)
+                members = [(_gzip_name(data), content)]
+            elif file_format == "bz2":
+                members = [(None, _inflate_stream(data, bz2.BZ2Decompressor, budget, check_cancelled))]
+            elif file_format == "xz":
+                members = [(None, _inflate_stream(data, lzma.LZMADecompressor, budget, check_cancelled))]
+            elif file_format == "zip":
+                members = _unzip(data, budget, check_cancelled)
+            else:
+                raise UnpackError(f"Cannot unpack {file_format} payloads")
+    except (zlib.error, lzma.LZMAError, OSError, EOFError, zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+        # RuntimeError is what zipfile raises for encrypted members
+        METRICS.count("unpack_outcomes_total", outcome="error")
+        raise UnpackError(f"Could not unpack the {file_format} payload: {e}") from e
+    except UnpackError:
+        METRICS.count("unpack_outcomes_total", outcome="error")
+        raise
+    METRICS.count("unpack_outcomes_total", outcome="ok")
+    return [UnpackedFile(name, content, detect_file_format(content)) for name, content in members]
+
+
+def expand(content, file_format, check_cancelled=None):
+    # The unpacked files of a gz/bz2/xz/zip payload, or the payload itself for anything else.
+    # Returns ([UnpackedFile], error); when unpacking fails the payload is kept as it is.
+    if file_format not in COMPRESSED_FORMATS:
+        return [UnpackedFile(None, content, file_format)], None
+    try:
+        return unpack(content, file_format, check_cancelled=check_cancelled), None
+    except UnpackError as e:
+        return [UnpackedFile(None, content, file_format)], e
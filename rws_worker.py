@@ -0,0 +1,82 @@
+"""Run long decode work off the Tk event thread.
+
+The work function runs on a daemon thread and must not touch any widgets.
+Results travel back through a queue that is polled from the Tk loop with
+after(), so every callback below runs on the main thread.
+"""
+
+import queue
+import threading
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class BackgroundJob:
+    def __init__(self, widget, work, on_done, on_error, on_progress=None, on_cancel=None, poll_interval=50):
+        self._widget = widget
+        self._work = work
+        self._on_done = on_done
+        self._on_error = on_error
+        self._on_progress = on_progress
+        self._on_cancel = on_cancel
+        self.poll_interval = poll_interval
+        self._queue = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._widget.after(self.poll_interval, self._poll)
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        # Called from the worker between units of work
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def report(self, done, total):
+        # Progress hook for the worker, doubles as a cancellation point
+        self.check_cancelled()
+        self._queue.put(("progress", done / total if total else 1.0))
+
+    def _run(self):
+        try:
+            result = self._work(self)
+        except JobCancelled:
+            self._queue.put(("cancelled", None))
+        except Exception as e:
+            self._queue.put(("error", e))
+        else:
+            self._queue.put(("done", result))
+
+    def _poll(self):
+        progress = None
+        while True:
+            try:
+                kind, value = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                # Only the latest progress update matters
+                progress = value
+                continue
+            if kind == "done":
+                self._on_done(value)
+            elif kind == "error":
+                self._on_error(value)
+            elif self._on_cancel:
+                self._on_cancel()
+            return
+        if progress is not None and self._on_progress:
+            self._on_progress(progress)
+        self._widget.after(self.poll_interval, self._poll)
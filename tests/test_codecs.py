@@ -0,0 +1,81 @@
+import base64
+import binascii
+import io
+import random
+import wave
+
+import pytest
+
+from rws_codecs import CODECS, Codec, decode_blocks, register_codec
+
+RNG = random.Random(1234)
+
+
+def _framed(text):
+    return f"-----{text}-----"
+
+
+def _wav_with_silence(seconds):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(8000)
+        audio.writeframes(bytes(int(8000 * seconds) * 2) + RNG.randbytes(16000))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("content", [
+    _wav_with_silence(0.5),
+    bytes(3000) + RNG.randbytes(3000),
+], ids=["wav-leading-silence", "zeros-then-random"])
+@pytest.mark.parametrize("encode", [base64.b64encode, base64.encodebytes], ids=["one-line", "wrapped"])
+def test_base64_starting_with_zero_bytes_is_not_base32(content, encode):
+    block = next(decode_blocks(_framed(encode(content).decode("ascii"))))
+    assert block.error is None
+    assert block.codec == "base64"
+    assert bytes(block.content) == content
+
+
+@pytest.mark.parametrize("name", ["base85", "base32", "base64url", "base64"])
+def test_payload_opening_with_a_long_zero_run_keeps_its_codec(name):
+    # The run fills the whole detection window with one character
+    content = bytes(8000) + RNG.randbytes(1000)
+    block = next(decode_blocks(_framed(CODECS[name].encode(content).decode("ascii"))))
+    assert block.error is None
+    assert block.codec == name
+    assert bytes(block.content) == content
+
+
+def test_short_junk_is_not_base85():
+    block = next(decode_blocks(_framed("broken!!")))
+    assert block.codec == "base64"
+    assert block.error is not None
+
+
+@pytest.mark.parametrize("size", [16, 100, 5000])
+@pytest.mark.parametrize("name", ["base32", "base64url", "base85", "base64"])
+def test_codecs_are_still_detected(name, size):
+    content = RNG.randbytes(size)
+    block = next(decode_blocks(_framed(CODECS[name].encode(content).decode("ascii"))))
+    assert block.codec == name
+    assert bytes(block.content) == content
+
+
+@pytest.fixture
+def hex_codec():
+    codec = register_codec(Codec(
+        "hex",
+        lambda data, start, end, strict=False, progress=None: bytearray.fromhex(data[start:end]),
+        lambda sample, chars: chars <= set("0123456789abcdef"),
+        binascii.hexlify,
+    ))
+    yield codec
+    del CODECS[codec.name]
+
+
+def test_registered_codec_is_detected(hex_codec):
+    content = RNG.randbytes(300)
+    block = next(decode_blocks(_framed(binascii.hexlify(content).decode("ascii"))))
+    assert block.codec == "hex"
+    assert bytes(block.content) == content
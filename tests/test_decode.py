@@ -0,0 +1,61 @@
+import base64
+import binascii
+import random
+
+import pytest
+
+from rws_decode import Base64DecodeError, StreamingBase64Decoder
+
+RNG = random.Random(2024)
+
+
+def _decode(text, strict=False, splits=()):
+    # Feed text in pieces cut at splits, as the chunked readers do
+    decoder = StreamingBase64Decoder(strict=strict)
+    previous = 0
+    for split in list(splits) + [len(text)]:
+        decoder.feed(text[previous:split])
+        previous = split
+    return bytes(decoder.finish())
+
+
+def _reference(text):
+    try:
+        return base64.b64decode(text)
+    except binascii.Error:
+        return None
+
+
+def test_lenient_mode_matches_b64decode():
+    # Short strings over a few data characters, padding and junk hit every padding rule
+    for _ in range(20000):
+        text = "".join(RNG.choice("A0+/==!\n") for _ in range(RNG.randrange(13)))
+        splits = sorted(RNG.sample(range(len(text) + 1), RNG.randrange(min(3, len(text) + 1))))
+        try:
+            decoded = _decode(text, splits=splits)
+        except Base64DecodeError:
+            decoded = None
+        assert decoded == _reference(text), (text, splits)
+
+
+@pytest.mark.parametrize("size", range(12))
+def test_strict_mode_matches_binascii_on_valid_input(size):
+    content = RNG.randbytes(size)
+    encoded = base64.b64encode(content).decode("ascii")
+    assert _decode(encoded, strict=True) == binascii.a2b_base64(encoded, strict_mode=True) == content
+
+
+@pytest.mark.parametrize("text, message", [
+    ("0qS==", "Excess padding at offset 4"),
+    ("yox==", "Excess padding at offset 4"),
+    ("yo===", "Excess padding at offset 4"),
+    ("yo=\n=\n=", "Excess padding at offset 6"),
+    ("yoxZ=", "Unexpected padding at offset 4"),
+    ("=yox", "Unexpected padding at offset 0"),
+    ("yo=", "Incorrect padding at offset 3"),
+    ("yo==A", "Data after padding at offset 4"),
+])
+def test_strict_mode_rejects_padding_the_last_quantum_does_not_need(text, message):
+    for split in range(len(text) + 1):
+        with pytest.raises(Base64DecodeError, match=message):
+            _decode(text, strict=True, splits=[split])
@@ -0,0 +1,91 @@
+import random
+
+import pytest
+
+from rws_codecs import CODECS, decode_blocks
+from rws_encode import package
+from rws_fec import (DEFAULT_PARITY, HEADER_SIZE, FecError, is_protected, merge_copies, merge_receptions, protect,
+                     repair)
+
+RNG = random.Random(4321)
+
+
+def _damage(text, count, rng):
+    # Garble count characters outside the whitespace, the way a noisy link does
+    chars = list(text)
+    positions = [index for index, char in enumerate(chars) if not char.isspace()]
+    for index in rng.sample(positions, count):
+        chars[index] = "#" if chars[index] != "#" else "%"
+    return "".join(chars)
+
+
+@pytest.mark.parametrize("name", ["uuencode", "base64"])
+def test_merged_receptions_decode_to_the_original(name):
+    content = RNG.randbytes(2000)
+    encoded = CODECS[name].encode(content).decode("ascii")
+    if name == "base64":
+        encoded = "\n".join(encoded[position:position + 76] for position in range(0, len(encoded), 76))
+    receptions = [f"-----{_damage(encoded, 20, RNG)}-----" for _ in range(3)]
+
+    text, merged = merge_receptions(receptions[-1], receptions[:-1])
+    assert merged == 1
+    block = next(decode_blocks(text))
+    assert block.error is None
+    assert block.codec == name
+    assert bytes(block.content) == content
+
+
+def test_merge_keeps_the_line_breaks_of_the_first_copy():
+    copies = ["ab\ncd\n", "abxcd", "a b\nc d"]
+    assert merge_copies(copies) == ("ab\ncd\n", 0)
+    copies = ["ab\ncX\n", "abcd", "Xbc\nd"]
+    assert merge_copies(copies) == ("ab\ncd\n", 2)
+
+
+@pytest.mark.parametrize("size", [0, 1, 223, 5000])
+def test_protect_and_repair_round_trip(size):
+    data = RNG.randbytes(size)
+    protected = protect(data)
+    assert is_protected(protected)
+    assert repair(protected) == (data, 0)
+
+
+def test_repair_fixes_up_to_half_the_parity_per_codeword():
+    data = RNG.randbytes(4000)
+    protected = bytearray(protect(data))
+    # Codewords are interleaved, so 16 damaged bytes per codeword means 16 * codewords in a row
+    codewords = -(-len(data) // (255 - DEFAULT_PARITY))
+    for position in range(HEADER_SIZE, HEADER_SIZE + DEFAULT_PARITY // 2 * codewords):
+        protected[position] ^= 0x5A
+    repaired, corrected = repair(protected)
+    assert repaired == data
+    assert corrected == DEFAULT_PARITY // 2 * codewords
+
+
+def test_repair_gives_up_on_too_much_damage():
+    protected = bytearray(protect(RNG.randbytes(1000)))
+    for position in range(HEADER_SIZE, HEADER_SIZE + 200):
+        protected[position] ^= 0xFF
+    with pytest.raises(FecError):
+        repair(protected)
+
+
+@pytest.mark.parametrize("damaged_copy", range(3))
+def test_header_is_voted_on(damaged_copy):
+    data = RNG.randbytes(1000)
+    protected = bytearray(protect(data))
+    copy_size = HEADER_SIZE // 3
+    protected[damaged_copy * copy_size:(damaged_copy + 1) * copy_size] = bytes(copy_size)
+    assert is_protected(protected)
+    assert repair(protected) == (data, 0)
+
+
+@pytest.mark.parametrize("name", ["base64", "base32", "base85"])
+def test_garbled_characters_are_repaired_after_decoding(name):
+    data = RNG.randbytes(3000)
+    text = package(data, codec=name, candidates=[("raw", None)], fec=True).text.decode("ascii")
+    # Inside the ----- framing, which has to survive for the block to be found at all
+    block = next(decode_blocks(f"-----{_damage(text.strip()[5:-5], 15, RNG)}-----"))
+    assert block.error is None
+    assert block.corrected > 0
+    assert bytes(block.content) == data
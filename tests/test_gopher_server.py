@@ -0,0 +1,47 @@
+import socket
+
+import pytest
+
+from gopher_server import NOT_FOUND_RESPONSE, SERVER_ERROR_RESPONSE, GopherServer, GopherSite
+
+
+def _fetch(address, selector):
+    with socket.create_connection(address, timeout=5) as sock:
+        sock.sendall(selector.encode("utf-8") + b"\r\n")
+        response = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return response
+            response += chunk
+
+
+@pytest.fixture
+def failing_site(monkeypatch, tmp_path):
+    resolve = GopherSite.resolve
+
+    def patched(self, selector, words=""):
+        if selector == "/gone":
+            # resolve() found the file, then it was removed before it was opened
+            return "file", str(tmp_path / "gone.bin")
+        if selector == "/broken":
+            raise RuntimeError("broken lookup")
+        return resolve(self, selector, words)
+
+    monkeypatch.setattr(GopherSite, "resolve", patched)
+    return tmp_path
+
+
+def _failing_search(words, limit):
+    raise ValueError("damaged index")
+
+
+@pytest.mark.parametrize("engine", ["asyncio", "threads"])
+def test_failed_requests_still_get_an_answer(engine, failing_site):
+    (failing_site / "kept.bin").write_bytes(bytes(200 * 1024))
+    with GopherServer(str(failing_site), "127.0.0.1", 0, engine=engine, search=_failing_search) as server:
+        assert _fetch(server.server_address, "/gone") == NOT_FOUND_RESPONSE
+        assert _fetch(server.server_address, "/broken") == SERVER_ERROR_RESPONSE
+        assert _fetch(server.server_address, "/search\twords") == SERVER_ERROR_RESPONSE
+        # The server keeps serving after them
+        assert len(_fetch(server.server_address, "/kept.bin")) == 200 * 1024
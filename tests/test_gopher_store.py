@@ -0,0 +1,77 @@
+import pytest
+
+from gopher_store import ContentStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ContentStore(str(tmp_path))
+    yield store
+    store.close()
+
+
+def test_search_survives_vacuum(store):
+    # VACUUM may renumber implicit rowids, the search index must keep pointing at the right files
+    for index in range(20):
+        store.put(f"note {index} about the weather".encode("ascii"), ".txt")
+    store._conn.execute("DELETE FROM files WHERE digest IN (SELECT digest FROM files LIMIT 10)")
+    store._conn.commit()
+    store._conn.execute("VACUUM")
+    record, created = store.put(b"a fresh note about antennas", ".txt")
+    assert created
+    results = store.search("antennas")
+    assert [result.file for result in results] == [record]
+
+
+def test_storing_a_removed_file_again_keeps_one_search_row(store, tmp_path):
+    record, _ = store.put(b"field day log", ".txt")
+    (tmp_path / record.file_name).unlink()
+    again, created = store.put(b"field day log", ".txt")
+    assert created
+    assert [result.file for result in store.search("field day")] == [again]
+    assert store._conn.execute("SELECT COUNT(*) FROM search").fetchone()[0] == 1
+
+
+def test_same_content_is_stored_once(store, tmp_path):
+    record, created = store.put(b"qsl card", ".txt", source="first")
+    again, created_again = store.put(b"qsl card", ".txt", source="second")
+    assert created and not created_again
+    assert again == record
+    assert (tmp_path / record.file_name).read_bytes() == b"qsl card"
+    assert store.lookup(record.digest) == record
+
+
+def test_repeated_payload_is_recognised(store):
+    record, _ = store.put(b"decoded", ".bin", payload_digest="payload-1")
+    assert store.lookup_payload("payload-1") == record
+    assert store.lookup_payload("payload-2") is None
+
+
+def test_search_finds_text_and_html(store):
+    text, _ = store.put(b"grid square JO62 on forty metres", ".txt")
+    page, _ = store.put(b"<html><style>p {}</style><p>Grid &amp; square</p></html>", ".html")
+    store.put(b"grid square in a binary file", ".bin")
+    assert {result.file for result in store.search("grid square")} == {text, page}
+    [result] = store.search("JO62")
+    assert result.file == text
+    assert "JO62" in result.snippet
+    # Markup is not indexed, and FTS5 syntax in a query is taken literally
+    assert store.search("style") == []
+    assert store.search('grid" OR "x') == []
+
+
+def test_search_skips_files_that_were_removed(store, tmp_path):
+    record, _ = store.put(b"net control", ".txt")
+    (tmp_path / record.file_name).unlink()
+    assert store.search("net control") == []
+
+
+def test_index_missing_indexes_files_stored_without_it(store):
+    record, _ = store.put(b"beacon schedule", ".txt")
+    store.put(b"not text", ".bin")
+    store._conn.execute("DELETE FROM search")
+    store._conn.commit()
+    assert store.search("beacon") == []
+    assert store.index_missing() == 1
+    assert [result.file for result in store.search("beacon")] == [record]
+    assert store.index_missing() == 0
@@ -0,0 +1,42 @@
+import base64
+import random
+
+import pytest
+
+from rws_codecs import CODECS, decode_blocks
+from rws_metrics import METRICS
+
+RNG = random.Random(99)
+
+
+@pytest.fixture
+def metrics():
+    METRICS.reset()
+    METRICS.enable()
+    yield METRICS
+    METRICS.disable()
+    METRICS.reset()
+
+
+def _stages(metrics):
+    return {dict(labels)["stage"]: histogram["count"]
+            for (name, labels), histogram in metrics.snapshot()["histograms"].items() if name == "stage_seconds"}
+
+
+@pytest.mark.parametrize("name", ["base64", "base64url", "base32", "base85"])
+def test_decoding_records_clean_and_validate(metrics, name):
+    text = "-----" + CODECS[name].encode(RNG.randbytes(1000)).decode("ascii") + "-----"
+    block = next(decode_blocks(text, strict=True))
+    assert block.error is None
+    stages = _stages(metrics)
+    assert stages["extract"] == 1
+    assert stages["decode"] == 1
+    assert stages["clean"] >= 1
+    assert stages["validate"] >= 1
+
+
+def test_lenient_decoding_records_no_validate(metrics):
+    next(decode_blocks("-----" + base64.b64encode(RNG.randbytes(1000)).decode("ascii") + "-----"))
+    stages = _stages(metrics)
+    assert stages["clean"] >= 1
+    assert "validate" not in stages
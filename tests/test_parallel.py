@@ -0,0 +1,78 @@
+import base64
+import random
+
+import pytest
+
+import rws_decode
+import rws_parallel
+from rws_decode import Base64DecodeError, StreamingBase64Decoder, decode_base64
+from rws_parallel import decode_base64_parallel, mark_pool_worker, worker_count
+
+RNG = random.Random(22)
+
+
+def _serial(data, strict=False, start=0, end=None):
+    decoder = StreamingBase64Decoder(strict=strict, base_offset=start)
+    for chunk in rws_decode.iter_chunks(data, start, len(data) if end is None else end):
+        decoder.feed(chunk)
+    return bytes(decoder.finish())
+
+
+def _noisy(encoded):
+    noisy = bytearray(encoded)
+    for position in sorted(RNG.sample(range(len(noisy)), min(len(noisy), 50)), reverse=True):
+        noisy.insert(position, ord("!"))
+    return bytes(noisy)
+
+
+# Sizes around the 3-byte quantum, so the tail carries 0, 1 and 2 padding characters
+@pytest.mark.parametrize("size", [1, 2, 3, 1000, 300001, 300002])
+@pytest.mark.parametrize("form", ["wrapped", "str", "noisy"])
+def test_parallel_decode_matches_the_serial_one(size, form):
+    encoded = base64.encodebytes(RNG.randbytes(size))
+    if form == "str":
+        encoded = encoded.decode("ascii")
+    elif form == "noisy":
+        encoded = _noisy(encoded)
+    assert bytes(decode_base64_parallel(encoded, workers=3)) == _serial(encoded)
+
+
+def test_parallel_decode_of_a_region():
+    content = RNG.randbytes(9999)
+    data = b"xx" + base64.b64encode(content) + b"yy"
+    assert bytes(decode_base64_parallel(data, 2, len(data) - 2, workers=2)) == content
+
+
+def test_output_is_handed_off_in_pieces(monkeypatch):
+    monkeypatch.setattr(rws_parallel, "HANDOFF_SIZE", 3 * 4096)
+    content = RNG.randbytes(100000)
+    assert bytes(decode_base64_parallel(base64.b64encode(content), workers=2)) == content
+
+
+@pytest.mark.parametrize("data, strict", [
+    # Missing padding, data after padding, and a bad character in strict mode
+    (base64.b64encode(RNG.randbytes(1000)).rstrip(b"="), False),
+    (b"QUJD" * 1000 + b"QQ==QUJD", True),
+    (_noisy(base64.encodebytes(RNG.randbytes(1000))), True),
+])
+def test_whatever_the_serial_decode_rejects_is_left_to_it(data, strict):
+    assert decode_base64_parallel(data, strict=strict, workers=2) is None
+    with pytest.raises(Base64DecodeError):
+        _serial(data, strict)
+
+
+def test_decode_base64_takes_the_parallel_path_above_the_threshold(monkeypatch):
+    calls = []
+    monkeypatch.setattr(rws_decode, "PARALLEL_THRESHOLD", 1000)
+    monkeypatch.setattr(rws_parallel, "worker_count", lambda: 2)
+    monkeypatch.setattr(rws_parallel, "_hand_off", lambda *args: calls.append(args) or bytearray(b"parallel"))
+    assert decode_base64(base64.b64encode(RNG.randbytes(3000))) == b"parallel"
+    assert len(calls) == 1
+
+
+def test_pool_workers_decode_serially(monkeypatch):
+    monkeypatch.setattr(rws_parallel, "_pool_worker", False)
+    assert worker_count() >= 1
+    mark_pool_worker()
+    assert worker_count() == 1
+    assert decode_base64_parallel(base64.b64encode(RNG.randbytes(3000))) is None
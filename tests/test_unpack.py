@@ -0,0 +1,92 @@
+import bz2
+import gzip
+import io
+import lzma
+import random
+import zipfile
+
+import pytest
+
+import rws_unpack
+from rws_decode import CHUNK_SIZE
+from rws_detect import detect_file_format
+from rws_unpack import UnpackError, UnpackLimitError, expand, unpack
+
+RNG = random.Random(77)
+# Text that compresses well, but not past the ratio limit
+TEXT = b"".join(b"%d 73 de station %d\n" % (RNG.randrange(10 ** 6), index) for index in range(2000))
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members:
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("file_format, compress", [
+    ("gz", lambda data: gzip.compress(data, mtime=0)),
+    ("bz2", bz2.compress),
+    ("xz", lzma.compress),
+])
+def test_streams_round_trip(file_format, compress):
+    [unpacked] = unpack(compress(TEXT), file_format)
+    assert bytes(unpacked.content) == TEXT
+    # Unpacked files go back through format detection
+    assert unpacked.format == detect_file_format(TEXT)
+
+
+def test_gzip_keeps_the_original_name():
+    buffer = io.BytesIO()
+    with gzip.GzipFile(filename="log.txt", mode="wb", fileobj=buffer, mtime=0) as file:
+        file.write(TEXT)
+    [unpacked] = unpack(buffer.getvalue(), "gz")
+    assert unpacked.name == "log.txt"
+
+
+def test_zip_members_are_unpacked():
+    members = [("a.txt", TEXT), ("b.bin", RNG.randbytes(5000))]
+    unpacked = unpack(_zip(members), "zip")
+    assert [(item.name, bytes(item.content)) for item in unpacked] == members
+
+
+@pytest.mark.parametrize("first_size", [
+    # A first member of exactly CHUNK_SIZE compressed bytes ends on a chunk boundary
+    CHUNK_SIZE - 23, 1000,
+])
+def test_every_gzip_member_is_unpacked(first_size):
+    first = RNG.randbytes(first_size)
+    payload = gzip.compress(first, compresslevel=0, mtime=0) + gzip.compress(TEXT, mtime=0)
+    [unpacked] = unpack(payload, "gz")
+    assert bytes(unpacked.content) == first + TEXT
+
+
+def test_ratio_limit_stops_a_bomb():
+    with pytest.raises(UnpackLimitError, match="compression ratio limit"):
+        unpack(gzip.compress(bytes(10 * 1024 * 1024)), "gz")
+
+
+def test_size_limit_applies_to_zip_members():
+    payload = _zip([("zeros.bin", bytes(1024 * 1024))])
+    with pytest.raises(UnpackLimitError):
+        unpack(payload, "zip", max_size=512 * 1024, max_ratio=10 ** 6)
+
+
+def test_member_limit(monkeypatch):
+    monkeypatch.setattr(rws_unpack, "MAX_MEMBERS", 3)
+    with pytest.raises(UnpackLimitError, match="more than 3 files"):
+        unpack(_zip([(f"{index}.txt", TEXT) for index in range(4)]), "zip")
+
+
+def test_truncated_stream_is_an_error():
+    payload = lzma.compress(RNG.randbytes(100000))
+    with pytest.raises(UnpackError):
+        unpack(payload[:len(payload) // 2], "xz")
+
+
+def test_expand_keeps_a_payload_that_fails_to_unpack():
+    payload = gzip.compress(TEXT)[:-100]
+    [kept], error = expand(payload, "gz")
+    assert kept.content == payload
+    assert isinstance(error, UnpackError)